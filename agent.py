@@ -0,0 +1,43 @@
+"""
+    Lean entry point of a car agent. Only the standard library is imported
+    before the options are parsed, and features bring in their modules when
+    they are enabled: aiohttp for --async, the inference service and Keras
+    for a Keras --policy (an .npz export of numpy_policy.py runs on NumPy
+    alone), SciPy's graph search only when a map's distance tables are not
+    cached yet and its assignment solver on the first assignment.
+
+        python agent.py --policy checkpoints/policy.npz --profile-startup
+
+    --profile-startup logs the import time per package and the time of every
+    initialisation phase up to the start of the first game.
+"""
+import argparse
+import logging
+
+from startup_profile import StartupProfiler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the team's cars")
+    parser.add_argument('--policy', type=str, default=None,
+                        help="Keras model file or its numpy_policy.py export (.npz), the A* expert if not given")
+    parser.add_argument('--async', dest='async_runner', action='store_true',
+                        help="drive all cars from one asyncio loop instead of a thread per car")
+    parser.add_argument('--single-stop', action='store_true',
+                        help="assign one customer per car instead of planning multi-stop routes")
+    parser.add_argument('--oracle-max-size', type=int, default=100,
+                        help="largest map to build distance tables for, larger ones are searched with A*")
+    parser.add_argument('--profile-startup', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    profiler = StartupProfiler(enabled=args.profile_startup)
+    profiler.install()
+    with profiler.phase("load client_vm"):
+        import client_vm
+    client_vm.main(policy_model=args.policy, multi_stop=not args.single_stop, async_runner=args.async_runner,
+                   profiler=profiler, oracle_max_size=args.oracle_max_size)
+
+
+if __name__ == "__main__":
+    main()
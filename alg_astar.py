@@ -1,181 +1,149 @@
-#https://github.com/BaijayantaRoy/Medium-Article/blob/master/A_Star.ipynb
- 
-import numpy as np 
-
-class Node:
-    """
-        A node class for A* Pathfinding
-        parent is parent of the current Node
-        position is current position of the Node in the maze
-        g is cost from start to current Node
-        h is heuristic based estimated cost for current Node to end Node
-        f is total cost of present node i.e. :  f = g + h
-    """
-
-    def __init__(self, parent=None, position=None):
-        self.parent = parent
-        self.position = position
-
-        self.g = 0
-        self.h = 0
-        self.f = 0
-    def __eq__(self, other):
-        return self.position == other.position
-
-    def print_node(self):
-        print(self.position, self.g, self.h, self.f)
-
-#This function return the path of the search
-def return_path(current_node,maze,status):
-    path = []
-    current = current_node
-    while current is not None:
-        path.append(current.position)
-        current = current.parent
-    # Return reversed path as we need to show from start to end path
-    path = path[::-1]
-    # print('Whole path:',path)
-    return path[1:], status
-
-
-def search(maze, cost, start, end):
-    """
-        Returns a list of tuples as a path from the given start to the given end in the given maze
-        :param maze:
-        :param cost
-        :param start:
-        :param end:
-        :return:
-    """
-
-    # Create start and end node with initized values for g, h and f
-    start_node = Node(None, tuple(start))
-    start_node.g = start_node.h = start_node.f = 0
-    end_node = Node(None, tuple(end))
-    end_node.g = end_node.h = end_node.f = 0
-
-    # Initialize both yet_to_visit and visited list
-    # in this list we will put all node that are yet_to_visit for exploration. 
-    # From here we will find the lowest cost node to expand next
-    yet_to_visit_list = []  
-    # in this list we will put all node those already explored so that we don't explore it again
-    visited_list = [] 
-    
-    # Add the start node
-    yet_to_visit_list.append(start_node)
-    
-    # Adding a stop condition. This is to avoid any infinite loop and stop 
-    # execution after some reasonable number of steps
-    outer_iterations = 0
-    #max_iterations = (len(maze) // 2) ** 10
-    max_iterations = 500
-
-    # what squares do we search . serarch movement is left-right-top-bottom 
-    #(4 movements) from every positon
-
-    move  =  [[-1, 0 ], # go up
-              [ 0, -1], # go left
-              [ 1, 0 ], # go down
-              [ 0, 1 ]] # go right
-
-
-    """
-        1) We first get the current node by comparing all f cost and selecting the lowest cost node for further expansion
-        2) Check max iteration reached or not . Set a message and stop execution
-        3) Remove the selected node from yet_to_visit list and add this node to visited list
-        4) Perofmr Goal test and return the path else perform below steps
-        5) For selected node find out all children (use move to find children)
-            a) get the current postion for the selected node (this becomes parent node for the children)
-            b) check if a valid position exist (boundary will make few nodes invalid)
-            c) if any node is a wall then ignore that
-            d) add to valid children node list for the selected parent
-            
-            For all the children node
-                a) if child in visited list then ignore it and try next node
-                b) calculate child node g, h and f values
-                c) if child in yet_to_visit list then ignore it
-                d) else move the child to yet_to_visit list
-    """
-    #find maze has got how many rows and columns 
-    no_rows, no_columns = np.shape(maze)
-    
-    # Loop until you find the end
-    #loops=0
-    while len(yet_to_visit_list) > 0:
-        #print('loops:', loops)
-        #loops += 1
-        #for x in yet_to_visit_list:
-        #    x.print_node()
-        # Every time any node is referred from yet_to_visit list, counter of limit operation incremented
-        outer_iterations += 1    
-
-        
-        # Get the current node
-        current_node = yet_to_visit_list[0]
-        current_index = 0
-        for index, item in enumerate(yet_to_visit_list):
-            if item.f < current_node.f:
-                current_node = item
-                current_index = index
-                
-        # if we hit this point return the path such as it may be no solution or 
-        # computation cost is too high
-        if outer_iterations > max_iterations:
-            print ("giving up on pathfinding too many iterations")
-            return return_path(current_node,maze, status=1)
-
-        # Pop current node out off yet_to_visit list, add to visited list
-        yet_to_visit_list.pop(current_index)
-        visited_list.append(current_node)
-
-        # test if goal is reached or not, if yes then return the path
-        if current_node == end_node:
-            return return_path(current_node,maze, status=0)
-
-        # Generate children from all adjacent squares
-        children = []
-
-        for new_position in move: 
-
-            # Get node position
-            node_position = (current_node.position[0] + new_position[0], current_node.position[1] + new_position[1])
-
-            # Make sure within range (check if within maze boundary)
-            if (node_position[0] > (no_rows - 1) or 
-                node_position[0] < 0 or 
-                node_position[1] > (no_columns -1) or 
-                node_position[1] < 0):
-                continue
-
-            # Make sure walkable terrain
-            if maze[node_position[0]][node_position[1]] != 0:
-                continue
-
-            # Create new node
-            new_node = Node(current_node, node_position)
-
-            # Append
-            children.append(new_node)
-
-        # Loop through children
-        for child in children:
-            
-            # Child is on the visited list (search entire visited list)
-            if len([visited_child for visited_child in visited_list if visited_child == child]) > 0:
-                continue
-
-            # Create the f, g, and h values
-            child.g = current_node.g + cost
-            ## Heuristic costs calculated here, this is using eucledian distance
-            child.h = (((child.position[0] - end_node.position[0]) ** 2) + 
-                       ((child.position[1] - end_node.position[1]) ** 2)) 
-
-            child.f = child.g + child.h
-
-            # Child is already in the yet_to_visit list and g cost is already lower
-            if len([i for i in yet_to_visit_list if child == i and child.g > i.g]) > 0:
-                continue
-
-            # Add the child to the yet_to_visit list
-            yet_to_visit_list.append(child)
-    return None, 2
+#https://github.com/BaijayantaRoy/Medium-Article/blob/master/A_Star.ipynb
+
+import heapq
+import numpy as np
+
+# what squares do we search . serarch movement is left-right-top-bottom
+#(4 movements) from every positon
+MOVES = ((-1, 0),  # go up
+         (0, -1),  # go left
+         (1, 0),   # go down
+         (0, 1))   # go right
+
+# Cell offsets of the car actions (client.CarDirection values), north is +1 row
+ACTION_STEPS = ((1, 0),   # north
+                (0, 1),   # east
+                (-1, 0),  # south
+                (0, -1))  # west
+
+
+def move_action(position, cell):
+    """Returns the action moving a car from position to the adjacent cell, 4 (stay) otherwise"""
+    step = (int(cell[0]) - int(position[0]), int(cell[1]) - int(position[1]))
+    if step in ACTION_STEPS:
+        return ACTION_STEPS.index(step)
+    return 4
+
+
+def _neighbours(index, no_rows, no_columns):
+    """Yields flat indices of the 4-connected cells around a flat index"""
+    row, column = divmod(index, no_columns)
+    if row > 0:
+        yield index - no_columns
+    if column > 0:
+        yield index - 1
+    if row < no_rows - 1:
+        yield index + no_columns
+    if column < no_columns - 1:
+        yield index + 1
+
+
+#This function return the path of the search
+def return_path(parents, index, no_columns):
+    """
+        Walks the parent array back from index to the start node and returns the
+        path from start to index, excluding the start itself
+    """
+    path = []
+    while index >= 0:
+        path.append(divmod(int(index), no_columns))
+        index = parents[index]
+    # Return reversed path as we need to show from start to end path
+    path = path[::-1]
+    return path[1:]
+
+
+def search(maze, cost, start, end):
+    """
+        Returns a list of tuples as a path from the given start to the given end in the given maze
+        :param maze: 2d array, 0 is walkable terrain, anything else is a wall
+        :param cost: cost of a single move
+        :param start: (row, column) of the start cell
+        :param end: (row, column) of the end cell
+        :return: (path, status), status 0 means that the end was reached and
+                 status 2 that there is no path (then path is None)
+    """
+    maze = np.asarray(maze)
+    no_rows, no_columns = maze.shape
+    walkable = (maze == 0).ravel()
+
+    start_index = int(start[0]) * no_columns + int(start[1])
+    end_row, end_column = int(end[0]), int(end[1])
+    end_index = end_row * no_columns + end_column
+
+    # g-scores, closed flags and parents of every cell of the maze
+    g = np.full(no_rows * no_columns, np.inf)
+    closed = np.zeros(no_rows * no_columns, dtype=bool)
+    parents = np.full(no_rows * no_columns, -1, dtype=np.int64)
+
+    g[start_index] = 0
+    # Heap of (f, h, index). Ties on f are broken by the lower h, which makes
+    # the search dive towards the end instead of flooding equal-f plateaus
+    h = cost * (abs(int(start[0]) - end_row) + abs(int(start[1]) - end_column))
+    yet_to_visit = [(h, h, start_index)]
+
+    while yet_to_visit:
+        _, _, current = heapq.heappop(yet_to_visit)
+        # Stale heap entry, the cell was already expanded with a lower g
+        if closed[current]:
+            continue
+        closed[current] = True
+
+        # test if goal is reached or not, if yes then return the path
+        if current == end_index:
+            return return_path(parents, current, no_columns), 0
+
+        child_g = g[current] + cost
+        for child in _neighbours(current, no_rows, no_columns):
+            # Make sure walkable terrain and not expanded yet
+            if not walkable[child] or closed[child]:
+                continue
+            if child_g >= g[child]:
+                continue
+            g[child] = child_g
+            parents[child] = current
+            # Manhattan distance is admissible for 4-connected moves
+            child_row, child_column = divmod(child, no_columns)
+            h = cost * (abs(child_row - end_row) + abs(child_column - end_column))
+            heapq.heappush(yet_to_visit, (child_g + h, h, child))
+    return None, 2
+
+
+def search_many(maze, cost, start, ends):
+    """
+        One-to-many counterpart of search: expands a single breadth-first frontier
+        from start until every end is reached or known to be unreachable
+        :param maze: 2d array, 0 is walkable terrain, anything else is a wall
+        :param cost: cost of a single move
+        :param start: (row, column) of the start cell
+        :param ends: list of (row, column) end cells
+        :return: list of (path, status) in the order of ends, with the statuses of
+                 search (2 for ends without a path)
+    """
+    maze = np.asarray(maze)
+    no_rows, no_columns = maze.shape
+    walkable = (maze == 0).ravel()
+
+    start_index = int(start[0]) * no_columns + int(start[1])
+    end_indices = [int(end[0]) * no_columns + int(end[1]) for end in ends]
+    remaining = set(end_indices)
+
+    visited = np.zeros(no_rows * no_columns, dtype=bool)
+    parents = np.full(no_rows * no_columns, -1, dtype=np.int64)
+    visited[start_index] = True
+    remaining.discard(start_index)
+
+    frontier = [start_index]
+    while frontier and remaining:
+        next_frontier = []
+        for current in frontier:
+            for child in _neighbours(current, no_rows, no_columns):
+                if not walkable[child] or visited[child]:
+                    continue
+                visited[child] = True
+                parents[child] = current
+                next_frontier.append(child)
+                remaining.discard(child)
+        frontier = next_frontier
+
+    return [(return_path(parents, index, no_columns), 0) if visited[index] else (None, 2) for index in end_indices]
@@ -0,0 +1,124 @@
+import time
+from threading import Lock
+
+import numpy as np
+
+from alg_astar import search_many
+from distance_oracle import UNREACHABLE
+
+# Cost used for car/customer pairs without a path, large enough to never be preferred
+NO_PATH_COST = 1e9
+
+
+def index_to_cell(index, width):
+    """World grid index to the (row, column) cell of the observations"""
+    return divmod(int(index), width)
+
+
+def waiting_customers(world):
+    """Customer id -> world dict of the customers that are waiting for a car"""
+    return {customer_id: customer for customer_id, customer in world["customers"].items()
+            if customer["status"] == "waiting"}
+
+
+def idle_cars(world, car_ids):
+    """The cars of car_ids that have no customers on board"""
+    # Waiting customers may carry a car_id as well, it does not make that car busy
+    busy = {str(customer["car_id"]) for customer in world["customers"].values() if customer["status"] != "waiting"}
+    return [car_id for car_id in car_ids if str(car_id) not in busy]
+
+
+def road_distance_matrix(maze, car_cells, customer_cells, oracle=None):
+    """
+        Cars x customers matrix of road distances, NO_PATH_COST where there is no path.
+        With an oracle this is a single gather from its tables, otherwise one
+        search_many sweep per car.
+    """
+    cost = np.full((len(car_cells), len(customer_cells)), NO_PATH_COST)
+    if not len(car_cells) or not len(customer_cells):
+        return cost
+
+    if oracle is not None:
+        car_nodes = np.array([oracle.node(cell) for cell in car_cells])
+        customer_nodes = np.array([oracle.node(cell) for cell in customer_cells])
+        known = (car_nodes >= 0)[:, np.newaxis] & (customer_nodes >= 0)[np.newaxis, :]
+        # distances is indexed [target, source]
+        dist = oracle.distances[np.ix_(np.maximum(customer_nodes, 0), np.maximum(car_nodes, 0))].T
+        reachable = known & (dist != UNREACHABLE)
+        cost[reachable] = dist[reachable]
+        return cost
+
+    for i, cell in enumerate(car_cells):
+        for j, (path, status) in enumerate(search_many(maze, 1, cell, customer_cells)):
+            if status == 0:
+                cost[i, j] = len(path)
+    return cost
+
+
+def solve_assignment(cost):
+    """Min-cost matching of rows (cars) to columns (customers), as a list of (row, column) pairs"""
+    if not cost.size:
+        return []
+    # Imported on first use, SciPy's optimize package takes about half a second to load
+    from scipy.optimize import linear_sum_assignment
+    rows, columns = linear_sum_assignment(cost)
+    # Pairs that only exist to complete the matching are left unassigned
+    feasible = cost[rows, columns] < NO_PATH_COST
+    return list(zip(rows[feasible].tolist(), columns[feasible].tolist()))
+
+
+class Dispatcher:
+    """
+        Fleet-level assignment of idle cars to waiting customers.
+
+        Every refresh takes one world snapshot, builds the cars x customers road
+        distance matrix and solves it, so that no two cars chase the same customer.
+        Runners ask for their target with target_for. Without get_world, the
+        dispatcher only plans with the worlds passed to update, e.g. by the
+        on_world callback of async_client.run_fleet, and never fetches one.
+    """
+
+    def __init__(self, get_world, car_ids, maze, oracle=None, refresh_interval=0.3):
+        self.get_world = get_world
+        self.car_ids = [str(car_id) for car_id in car_ids]
+        self.maze = maze
+        self.oracle = oracle
+        self.refresh_interval = refresh_interval
+        self.width = np.shape(maze)[1]
+
+        self.targets = {}
+        self.updated_at = None
+        self.lock = Lock()
+
+    def update(self, world):
+        """Recomputes the assignment from a world snapshot, returns car id -> target cell"""
+        if "grid" not in world:
+            self.targets = {}
+            return self.targets
+
+        cars = [car_id for car_id in idle_cars(world, self.car_ids) if car_id in world["cars"]]
+        customers = list(waiting_customers(world).values())
+        car_cells = [index_to_cell(world["cars"][car_id]["position"], self.width) for car_id in cars]
+        customer_cells = [index_to_cell(customer["origin"], self.width) for customer in customers]
+
+        cost = road_distance_matrix(self.maze, car_cells, customer_cells, self.oracle)
+        self.targets = {cars[i]: customer_cells[j] for i, j in solve_assignment(cost)}
+        self.updated_at = time.monotonic()
+        return self.targets
+
+    def target_for(self, car_id, obs=None):
+        """
+            Target cell of the car from the latest assignment, refreshed when it is
+            older than refresh_interval or the target is gone from obs
+        """
+        with self.lock:
+            target = self.targets.get(str(car_id))
+            gone = target is not None and obs is not None and not obs[target[0], target[1], [1, 3]].any()
+            stale = gone or self.updated_at is None or time.monotonic() - self.updated_at >= self.refresh_interval
+            if stale and self.get_world is not None:
+                self.update(self.get_world())
+                target = self.targets.get(str(car_id))
+            elif gone:
+                # Left for the next world passed to update
+                target = None
+            return target
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+
+import aiohttp
+
+from client import CarDirection
+
+
+class AsyncClient:
+    """
+        asyncio counterpart of the game API of client.Client and client2.Client.
+
+        It borrows the URLs, the team's token and the move format of an already
+        set up sync client, and sends requests over one aiohttp session, so moves
+        of many cars can be in flight at the same time.
+    """
+
+    def __init__(self, client, limit=32, timeout=10):
+        self.client = client
+        self.team_name = client.team_name
+        self.limit = limit
+        self.timeout = timeout
+        self.session = None
+
+    async def _session(self):
+        # aiohttp sessions have to be created inside the running event loop
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            self.session = aiohttp.ClientSession(connector=connector, headers=self.client.auth_headers(),
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        await self._session()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def get_world(self):
+        session = await self._session()
+        async with session.get(self.client.world_status_url) as r:
+            world = await r.json(content_type=None)
+        logging.debug('Updated world data: %s', world)
+        return world
+
+    async def get_score(self):
+        session = await self._session()
+        async with session.get(self.client.scores_url) as r:
+            scores = await r.json(content_type=None)
+        return scores[self.team_name]["current"]
+
+    async def move_car(self, car_id, direction):
+        logging.debug('Moving car ID %s to the %s', car_id, direction.name)
+        session = await self._session()
+        request_content = self.client.move_request_content(car_id, direction)
+        async with session.post(self.client.actions_url, data=request_content) as r:
+            await r.read()
+        return r.status
+
+    async def move_cars(self, moves):
+        """Sends the moves of a {car_id: direction} dict concurrently"""
+        return await asyncio.gather(*(self.move_car(car_id, direction) for car_id, direction in moves.items()))
+
+
+async def run_fleet(aclient, env, act, tick=0.3, on_world=None, act_fleet=None):
+    """
+        Drives all the team's cars: every tick fetches the world once, asks
+        act(car_id, obs) for the action of every car and sends all the moves
+        concurrently, so a tick takes about one round trip whatever the fleet size.
+        on_world(world) is called with every fetched world, e.g. to refresh a
+        Dispatcher. Both run in the default executor, so that planning and
+        inference never block the event loop. act_fleet(observations), if given, maps the {car_id: obs}
+        of all the cars to their actions at once instead, e.g. with one batched
+        forward pass. Returns the last score once the game is over.
+    """
+    loop = asyncio.get_running_loop()
+    last_score = None
+    while True:
+        started = loop.time()
+        world, score = await asyncio.gather(aclient.get_world(), aclient.get_score(), return_exceptions=True)
+        if isinstance(world, Exception):
+            raise world
+        if "grid" not in world:
+            return last_score
+        if isinstance(score, Exception):
+            raise score
+        last_score = score
+
+        def decide():
+            if on_world is not None:
+                on_world(world)
+            observations = env.observe(world)
+            if act_fleet is not None:
+                return act_fleet(observations)
+            return {car_id: act(car_id, obs) for car_id, obs in observations.items()}
+
+        actions = await loop.run_in_executor(None, decide)
+        moves = {car_id: CarDirection(action) for car_id, action in actions.items() if action < 4}
+        await aclient.move_cars(moves)
+
+        await asyncio.sleep(max(0.0, tick - (loop.time() - started)))
@@ -0,0 +1,292 @@
+"""
+    Reproducible benchmarks of the hot paths, on seeded maps of
+    simulator.generate_grid from 20x20 to 200x200 and fleets of several car and
+    customer counts:
+
+        search              alg_astar.search between random road cells
+        oracle_build        DistanceOracle.build of the map (up to --oracle-max-size)
+        oracle_path         DistanceOracle.path between random road cells
+        encode              ObservationEncoder.encode of a world, from scratch
+        encode_incremental  ObservationEncoder.encode of consecutive worlds, patched
+        observe             JunctionEnvironment.observe, the encoding plus the copies
+        assignment          Dispatcher.update, with the oracle where there is one
+        simulator_tick      CitySimulator.tick with random moves
+        agent_tick          one tick of the whole agent: world, encoding, route
+                            planning, the A* expert for every car and the moves
+        client_get_world    Client.get_world round trips, only with --server
+
+    Every result holds the median and 95th percentile time of a call in ms and
+    calls per second. They are written as JSON to cache/benchmarks/<commit>.json
+    along with the commit they were measured on, and two result files can be
+    compared:
+
+        python benchmark.py
+        python benchmark.py --compare cache/benchmarks/<old>.json cache/benchmarks/<new>.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+from alg_astar import search
+from client import CarDirection
+from distance_oracle import DistanceOracle
+from obs_encoder import ObservationEncoder
+from simulator import CitySimulator
+
+RESULTS_DIR = os.path.join("cache", "benchmarks")
+
+
+def git_commit():
+    """(commit, whether the working tree has uncommitted changes), (None, False) outside a git checkout"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                                text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(status.strip())
+
+
+def measure(function, calls, max_time=None):
+    """
+        Times calls calls of function(), as a result dict; with max_time, stops
+        after at least 3 calls once max_time seconds have been spent
+    """
+    times = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+        if max_time is not None and len(times) >= 3 and sum(times) > max_time:
+            break
+    times = np.array(times)
+    return {
+        "calls": len(times),
+        "median_ms": float(np.median(times) * 1e3),
+        "p95_ms": float(np.percentile(times, 95) * 1e3),
+        "per_second": float(len(times) / times.sum()) if times.sum() > 0 else float("inf"),
+    }
+
+
+class Benchmark:
+    """Runs the benchmarks of one map size and collects their results"""
+
+    def __init__(self, size, fleets, seed, calls, oracle_max_size, max_time=None):
+        self.size = size
+        self.fleets = fleets
+        self.seed = seed
+        self.calls = calls
+        self.oracle_max_size = oracle_max_size
+        self.max_time = max_time
+        self.results = []
+
+    def measure(self, function, calls):
+        return measure(function, calls, self.max_time)
+
+    def record(self, name, result, cars=None, customers=None):
+        result = dict(benchmark=name, size=self.size, cars=cars, customers=customers, **result)
+        self.results.append(result)
+        logging.info(f'{name:<20} {self.size:>4} {str(cars):>5} {str(customers):>5} '
+                     f'{result["median_ms"]:10.3f} ms (p95 {result["p95_ms"]:.3f} ms)')
+
+    def run(self):
+        simulator = CitySimulator(size=self.size, n_cars=1, seed=self.seed)
+        maze = 1 - simulator.grid
+        rng = np.random.default_rng(self.seed)
+        pairs = []
+        for _ in range(self.calls):
+            start, end = rng.choice(simulator.roads, size=2, replace=False)
+            pairs.append((divmod(int(start), self.size), divmod(int(end), self.size)))
+
+        queries = iter(pairs)
+        self.record("search", self.measure(lambda: search(maze, 1, *next(queries)), len(pairs)))
+
+        oracle = None
+        if self.size <= self.oracle_max_size:
+            built = []
+            self.record("oracle_build", self.measure(lambda: built.append(DistanceOracle.build(maze)), 1))
+            oracle = built[0]
+            queries = iter(pairs)
+            self.record("oracle_path", self.measure(lambda: oracle.path(*next(queries)), len(pairs)))
+
+        for n_cars, n_customers in self.fleets:
+            self.run_fleet(n_cars, n_customers, oracle)
+        return self.results
+
+    def game(self, n_cars, n_customers):
+        """A fresh simulated game of the benchmark's map with the fleet; the same map for every fleet"""
+        return CitySimulator(size=self.size, n_cars=n_cars, n_customers=n_customers,
+                             max_customers=max(100, 2 * n_customers), seed=self.seed)
+
+    def worlds(self, simulator, n_cars, count):
+        """count consecutive worlds of a game played with seeded random moves"""
+        rng = np.random.default_rng(self.seed)
+        worlds = []
+        for _ in range(count):
+            simulator.move_cars({str(i): CarDirection(int(action)) for i, action in
+                                 enumerate(rng.integers(0, 4, size=n_cars))})
+            simulator.tick()
+            worlds.append(simulator.get_world())
+        return worlds
+
+    def run_fleet(self, n_cars, n_customers, oracle):
+        from assignment import Dispatcher
+        from env import JunctionEnvironment
+
+        fleet = dict(cars=n_cars, customers=n_customers)
+        simulator = self.game(n_cars, n_customers)
+        world = simulator.get_world()
+        car_ids = simulator.get_team_cars(world)
+
+        encoder = ObservationEncoder(self.size, self.size, car_ids)
+        self.record("encode", self.measure(lambda: encoder.encode(world), self.calls), **fleet)
+
+        worlds = self.worlds(simulator, n_cars, self.calls)
+        encoder = ObservationEncoder(self.size, self.size, car_ids, incremental=True)
+        encoder.encode(world)
+        sequence = iter(worlds)
+        self.record("encode_incremental", self.measure(lambda: encoder.encode(next(sequence)), len(worlds)), **fleet)
+
+        env = JunctionEnvironment(self.game(n_cars, n_customers), step_delay=0)
+        env.reset()
+        self.record("observe", self.measure(lambda: env.observe(world), self.calls), **fleet)
+
+        maze = 1 - simulator.grid
+        dispatcher = Dispatcher(lambda: world, car_ids, maze, oracle)
+        self.record("assignment", self.measure(lambda: dispatcher.update(world), self.calls), **fleet)
+
+        simulator = self.game(n_cars, n_customers)
+        rng = np.random.default_rng(self.seed)
+        moves = [{str(i): CarDirection(int(action)) for i, action in enumerate(rng.integers(0, 4, size=n_cars))}
+                 for _ in range(self.calls)]
+        sequence = iter(moves)
+
+        def simulator_tick():
+            simulator.move_cars(next(sequence))
+            simulator.tick()
+
+        self.record("simulator_tick", self.measure(simulator_tick, len(moves)), **fleet)
+        agent_tick = self.agent(n_cars, n_customers, oracle)
+        self.record("agent_tick", self.measure(agent_tick, max(self.calls // 4, 1)), **fleet)
+
+    def agent(self, n_cars, n_customers, oracle):
+        """One tick of the agent of client_vm, as deployed with the route planner, as a function"""
+        from client_vm import Runner
+        from route_planner import RoutePlanner
+
+        simulator = self.game(n_cars, n_customers)
+        world = simulator.get_world()
+        car_ids = simulator.get_team_cars(world)
+        maze = 1 - simulator.grid
+        encoder = ObservationEncoder(self.size, self.size, car_ids, incremental=True)
+        # Replanned once per tick below rather than on a wall clock interval
+        planner = RoutePlanner(simulator.get_world, car_ids, maze, oracle, refresh_interval=float("inf"))
+        runners = [Runner(car_id, self.seed, None, None, oracle, planner) for car_id in car_ids]
+
+        def tick():
+            world = simulator.get_world()
+            planner.update(world)
+            observations = encoder.encode(world)
+            actions = {runner.car_id: runner.megaalg(observations[i]) for i, runner in enumerate(runners)}
+            simulator.move_cars({car_id: CarDirection(action) for car_id, action in actions.items() if action < 4})
+            simulator.tick()
+
+        return tick
+
+
+def benchmark_client(server, team_name, team_key, calls):
+    from client import Client
+
+    client = Client(server_url=server, team_name=team_name, team_key=team_key, log_level=logging.INFO)
+    result = dict(benchmark="client_get_world", size=None, cars=None, customers=None,
+                  **measure(client.get_world, calls))
+    logging.info(f'client_get_world {result["median_ms"]:10.3f} ms (p95 {result["p95_ms"]:.3f} ms)')
+    return result
+
+
+def compare(old_path, new_path):
+    """Logs the ratio of the median times of the results both files have"""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def key(result):
+        return result["benchmark"], result["size"], result["cars"], result["customers"]
+
+    old_results = {key(result): result for result in old["results"]}
+    logging.info(f'{str(old["commit"])[:12]} -> {str(new["commit"])[:12]}, new/old median time:')
+    for result in new["results"]:
+        before = old_results.get(key(result))
+        if before is None or not before["median_ms"]:
+            continue
+        name, size, cars, customers = key(result)
+        logging.info(f'{name:<20} {str(size):>4} {str(cars):>5} {str(customers):>5} '
+                     f'{before["median_ms"]:10.3f} -> {result["median_ms"]:10.3f} ms '
+                     f'{result["median_ms"] / before["median_ms"]:6.2f}x')
+
+
+def fleet(value):
+    """CARSxCUSTOMERS, e.g. 4x20"""
+    cars, _, customers = value.partition("x")
+    return int(cars), int(customers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the planner, encoder and client hot paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 50, 100, 200])
+    parser.add_argument('--fleets', type=fleet, nargs='+', default=[(4, 20), (16, 100)],
+                        help="CARSxCUSTOMERS fleets to run on every map, e.g. 4x20")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--calls', type=int, default=200, help="calls per benchmark")
+    parser.add_argument('--max-time', type=float, default=10.0, help="seconds after which a benchmark stops early")
+    parser.add_argument('--oracle-max-size', type=int, default=100,
+                        help="largest map to build a distance oracle for, its tables grow with the square of the roads")
+    parser.add_argument('--server', type=str, default=None, help="challenge server URL to time Client round trips")
+    parser.add_argument('--team-name', type=str, default="turing")
+    parser.add_argument('--team-key', type=str, default="admin")
+    parser.add_argument('--output', type=str, default=None,
+                        help="results file, cache/benchmarks/<commit>.json by default")
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('OLD', 'NEW'), help="compare two results files")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit, dirty = git_commit()
+    results = []
+    for size in args.sizes:
+        results += Benchmark(size, args.fleets, args.seed, args.calls, args.oracle_max_size, args.max_time).run()
+    if args.server:
+        results.append(benchmark_client(args.server, args.team_name, args.team_key, args.calls))
+
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "numpy": np.__version__,
+                    "cpus": os.cpu_count()},
+        "config": {"sizes": args.sizes, "fleets": args.fleets, "seed": args.seed, "calls": args.calls,
+                   "max_time": args.max_time, "oracle_max_size": args.oracle_max_size},
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        name = (commit or "unknown")[:12] + ("-dirty" if dirty else "")
+        output = os.path.join(RESULTS_DIR, f"{name}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    logging.info(f'Results written to {output}')
+
+
+if __name__ == "__main__":
+    main()
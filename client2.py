@@ -5,9 +5,10 @@ import json
 import logging
 import random
 import time
-import requests
 import lxml.html as lh
 
+from transport import shared_transport
+
 
 class CarDirection(enum.Enum):
     north = 0
@@ -21,7 +22,8 @@ class Client:
                  server_url="https://api.citysimulation.eu/",
                  team_key="gozwislx6txtylar9jsr6i6xkgkafjf8",
                  team_name="turing",
-                 log_level=logging.DEBUG):
+                 log_level=logging.DEBUG,
+                 transport=None):
 
         self.server_url = server_url
         self.admin_url = server_url +  team_key
@@ -34,6 +36,7 @@ class Client:
         self.team_base_url = self.admin_url + '/admin/team'
         self.actions_url = self.api_base_url + '/actions'
         self.team_name = team_name
+        self.transport = transport if transport is not None else shared_transport()
 
         self.__token = self.__get_token()
         if not self.__token:
@@ -54,13 +57,13 @@ class Client:
 
     def __send_get_request(self, url, data=None):
         self.__log_request('GET', url)
-        r = requests.get(url)
+        r = self.transport.get(url)
         self.__log_response(r)
         return r
 
     def __send_put_request(self, url, data=None):
         self.__log_request('PUT', url, data)
-        r = requests.put(url, data)
+        r = self.transport.put(url, data)
         self.__log_response(r)
 
     def __send_post_request(self, url, data=None):
@@ -68,9 +71,9 @@ class Client:
         if self.__token:
             # print(url)
             # print(data)
-            r = requests.post(url, data, headers={'Authorization': self.__token})
+            r = self.transport.post(url, data, headers={'Authorization': self.__token})
         else:
-            r = requests.post(url, data)
+            r = self.transport.post(url, data)
         self.__log_response(r)
         # print(r.text)
         return r
@@ -119,17 +122,17 @@ class Client:
 
     def get_score(self):
         if self.__token:
-            r = requests.get(self.scores_url, headers={'Authorization': self.__token})
+            r = self.transport.get(self.scores_url, headers={'Authorization': self.__token})
         else:
-            r = requests.get(self.scores_url)
+            r = self.transport.get(self.scores_url)
         r = r.json()
         return r[self.team_name]["current"]
 
     def get_world(self):
         if self.__token:
-            r = requests.get(self.world_status_url, headers={'Authorization': self.__token})
+            r = self.transport.get(self.world_status_url, headers={'Authorization': self.__token})
         else:
-            r = requests.get(self.world_status_url)
+            r = self.transport.get(self.world_status_url)
         #print(self.world_status_url)
         world = r.json()
 
@@ -154,10 +157,13 @@ class Client:
         teams = [int(team_id) for team_id, team in teams.items() if team["name"] == self.team_name]
         return str(max(teams))
 
-    def move_car(self, car_id, direction):
-        print(car_id)
-        logging.debug('Moving car ID %d to the %s', car_id, direction.name)
-        request_content = json.dumps({
+    def auth_headers(self):
+        """Headers authorizing the team's API requests"""
+        return {'Authorization': self.__token} if self.__token else {}
+
+    @staticmethod
+    def move_request_content(car_id, direction):
+        return json.dumps({
             'Type': 'move',
             'Action': {
                 'message': 'Moving car ID %s to the %s' % (car_id, direction.name),
@@ -165,4 +171,14 @@ class Client:
                 'MoveDirection': direction.value
             }
         })
+
+    def move_car(self, car_id, direction):
+        print(car_id)
+        logging.debug('Moving car ID %d to the %s', car_id, direction.name)
+        request_content = self.move_request_content(car_id, direction)
         self.__send_post_request(self.actions_url, request_content)
+
+    def move_cars(self, moves):
+        """Sends the moves of a {car_id: direction} dict for the same tick"""
+        for car_id, direction in moves.items():
+            self.move_car(car_id, direction)
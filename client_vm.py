@@ -1,15 +1,18 @@
-import gym
 import logging
 import numpy as np
-import dill as pickle
 import os
 
 from threading import Thread, Lock
 from time import sleep
 from client2 import CarDirection, Client
 from env import JunctionEnvironment
-from matplotlib import pyplot as plt
-from alg_astar import *
+from alg_astar import move_action, search, search_many
+from distance_oracle import DistanceOracle
+from assignment import Dispatcher
+from route_planner import RoutePlanner
+from route_follower import RouteFollower
+from world_poller import WorldPoller
+from startup_profile import StartupProfiler
 
 logger = logging.getLogger(None)
 logger.setLevel(logging.INFO)
@@ -17,14 +20,26 @@ logger.setLevel(logging.INFO)
 team_name = "turing"
 team_key = "gozwislx6txtylar9jsr6i6xkgkafjf8"
 N_GAMES = 1
+# Plan capacity-aware multi-stop routes instead of one customer per car
+MULTI_STOP = True
+# Drive all cars from one asyncio loop with concurrent moves instead of a thread per car
+ASYNC_RUNNER = False
+# Keras model file (e.g. an imitation learning checkpoint) driving the cars instead of the A* expert,
+# or its numpy_policy.py export (.npz), which needs no TensorFlow
+POLICY_MODEL = None
+# Largest map to load or build distance tables for at the start of a game, larger ones are searched with A*
+ORACLE_MAX_SIZE = 100
 
 class Runner(Thread):
-    def __init__(self, car_id, game_id, env, lock):
+    def __init__(self, car_id, game_id, env, lock, oracle=None, dispatcher=None, policy=None):
         super().__init__()
         self.car_id = car_id
         self.game_id = game_id
         self.env = env
         self.lock = lock
+        self.oracle = oracle
+        self.dispatcher = dispatcher
+        self.policy = policy
         
         self.prev_obs = None
         
@@ -33,29 +48,70 @@ class Runner(Thread):
         self.actions = []
         
         self.current_target = None
+        # Last target the dispatcher assigned to this car
+        self.assigned = None
+        self.route = RouteFollower(self.find_path)
 
+    def find_path(self, maze, start, end):
+        """Path lookup in the oracle of the map if there is one, A* search otherwise"""
+        if self.oracle is not None:
+            return self.oracle.path(start, end)
+        return search(maze, 1, start, end)
+
+    def find_paths(self, maze, start, ends):
+        """Paths to all the ends, with a single sweep from start when there is no oracle"""
+        if self.oracle is not None:
+            return [self.oracle.path(start, end) for end in ends]
+        return search_many(maze, 1, start, ends)
+
+    def follow_route(self, maze, position):
+        """Next cell towards current_target along the stored route, replanning only when needed"""
+        target_cell = self.route.next_cell(maze, position, self.current_target)
+        if target_cell is None or target_cell == self.route.target:
+            # No path, or the target is reached with this move
+            self.current_target = None
+            self.route.clear()
+        return target_cell
+
+    def act(self, obs):
+        """Action of the fleet's policy service if there is one, of the A* expert otherwise"""
+        if self.policy is not None:
+            return self.policy.act(obs)
+        return self.megaalg(obs)
 
     def megaalg(self, obs):
         car_x, car_y = np.where(obs[:,:,4])[0][0], np.where(obs[:,:,4])[1][0]
-        print('Car position:', car_x, car_y)
         customer_positions = []
         customer_dists = []
         paths_to_clients = []
         maze = 1-obs[:,:,0]
         statuses = []
 
+        if self.current_target is not None:
+            # Forget the target once it disappears, e.g. a customer picked up by another car
+            x, y = self.current_target
+            if obs[x, y, 1] == 0 and obs[x, y, 3] == 0:
+                self.current_target = None
+                self.route.clear()
+
+        if self.dispatcher is not None:
+            # The fleet-level assignment (or route planner) decides where this car goes next,
+            # also when its plan changes on the way
+            target = self.dispatcher.target_for(self.car_id, obs)
+            if target is not None and target != self.current_target:
+                self.current_target = target
+                self.route.clear()
+            elif target is None and self.assigned is not None and self.current_target == self.assigned:
+                # The assignment was taken away, the old target may be another car's now
+                self.current_target = None
+                self.route.clear()
+            self.assigned = target
+
         if obs[:,:,3].sum() > 0:
             # go to destination
             if self.current_target is None:
                 self.current_target = np.where(obs[:,:,3])[0][0], np.where(obs[:,:,3])[1][0]
-            x, y = self.current_target
-            path, _ = search(maze, 1, (car_x, car_y), (x ,y))
-            if not path:
-                self.current_target = None
-                return 4
-            target_cell = path[0]
-            if len(path)==1:
-                self.current_target = None
+            target_cell = self.follow_route(maze, (car_x, car_y))
         else:
             # look for customer
 
@@ -63,55 +119,37 @@ class Runner(Thread):
                 return 4
             coords = np.where(obs[:,:,1])
 
+            if self.current_target is None and self.dispatcher is not None:
+                return 4
+
             if self.current_target is None:
                 for i in range(len(coords[0])):
                     x, y = coords[0][i], coords[1][i]
                     customer_positions.append((x,y))
                     dist = np.abs(car_x - x) + np.abs(car_y - y)
                     customer_dists.append(dist)
-                    if dist < 50:
-                        path, status = search(maze, 1, (car_x, car_y), (x ,y))
-                        paths_to_clients.append(path)
-                        statuses.append(status)
 
-                completed_paths = [p for p,s in zip(paths_to_clients, statuses) if s==0]
+                # One sweep from the car reaches all the close customers at once
+                candidates = [p for p, d in zip(customer_positions, customer_dists) if d < 50]
+                for path, status in self.find_paths(maze, (car_x, car_y), candidates):
+                    paths_to_clients.append(path)
+                    statuses.append(status)
+
+                completed_paths = [p for p,s in zip(paths_to_clients, statuses) if s==0 and len(p)>0]
                 if len(completed_paths)>0:
                     min_path = min(completed_paths, key = lambda p: len(p))
                 else:
-                    min_ind = np.argmin(np.array(customer_dists))
-                    min_path = paths_to_clients[min_ind]
+                    # Searches are exhaustive now, so no close customer is reachable
+                    return 4
 
                 self.current_target = min_path[-1]
+                # Keep the whole path instead of searching it again on the next ticks
+                self.route.set_route((car_x, car_y), self.current_target, min_path)
+            target_cell = self.follow_route(maze, (car_x, car_y))
 
-                #current_target, path = min(zip(customer_dists, paths_to_clients), key = lambda p: len(p[1]))
-                target_cell = min_path[0]
-            else:
-                x, y = self.current_target
-                #print(car_x, car_y)
-                path, _ = search(maze, 1, (car_x, car_y), (x ,y))
-                if not path:
-                    self.current_target = None
-                    return 4
-                target_cell = path[0]
-                if len(path)==1:
-                    self.current_target = None
-
-        #print(target_cell, car_x, car_y)
         if target_cell is None:
             return 4
-        if target_cell[0] == car_x and target_cell[1] == car_y - 1:
-            #return 3
-            return 3
-        if target_cell[0] == car_x and target_cell[1] == car_y + 1:
-            #return 1
-            return 1
-        if target_cell[0] == car_x - 1 and target_cell[1] == car_y:
-            #return 2
-            return 2
-        if target_cell[0] == car_x + 1 and target_cell[1] == car_y:
-            #return 0
-            return 0
-        return 4
+        return move_action((car_x, car_y), target_cell)
 
         
     def run(self):
@@ -121,7 +159,7 @@ class Runner(Thread):
         
         while True:
             try:
-                new_action = self.megaalg(self.prev_obs)
+                new_action = self.act(self.prev_obs)
          
                 self.lock.acquire()
                 #print(new_action)
@@ -155,20 +193,69 @@ class Runner(Thread):
         print('Last score:', self.scores[-1])
 
 
+def fleet_actions(policy, observations):
+    """{car_id: action} of the policy service for the {car_id: obs} of all the cars, in one batch"""
+    car_ids = list(observations)
+    return dict(zip(car_ids, policy.act_many([observations[car_id] for car_id in car_ids])))
+
+
+def run_policy_game(env, policy, observations):
+    """Plays a game with the policy: one batched forward pass and one fleet step per tick"""
+    while True:
+        observations, _, dones, _ = env.step(fleet_actions(policy, observations))
+        if any(dones.values()):
+            return
+
+
+async def run_game_async(client, env, runners, dispatcher, policy=None):
+    """Plays a game with the runners' actions, sending all cars' moves concurrently every tick"""
+    from async_client import AsyncClient, run_fleet
+
+    runners = {runner.car_id: runner for runner in runners}
+    act_fleet = None
+    if policy is not None:
+        act_fleet = lambda observations: fleet_actions(policy, observations)
+    async with AsyncClient(client) as aclient:
+        return await run_fleet(aclient, env, lambda car_id, obs: runners[car_id].act(obs),
+                               on_world=dispatcher.update, act_fleet=act_fleet)
+
+
 game_ids = []
 
-if __name__ == "__main__":
+def main(policy_model=POLICY_MODEL, multi_stop=MULTI_STOP, async_runner=ASYNC_RUNNER, profiler=None,
+         oracle_max_size=ORACLE_MAX_SIZE):
+    """Plays games forever, reconnecting on failures; profiler times the startup phases"""
+    if profiler is None:
+        profiler = StartupProfiler(enabled=False)
+    poller = None
     while True:
         try:
             print("In main thread")
-            while True:
-                try:
-                    client = Client(team_name=team_name, team_key=team_key)
-                    env = JunctionEnvironment(client)
-                    break
-                except:
-                    sleep(1)
-                    
+            with profiler.phase("connect"):
+                while True:
+                    try:
+                        client = Client(team_name=team_name, team_key=team_key)
+                        # One thread downloads the world for the env, the runners and the dispatcher;
+                        # the async runner fetches the world itself, once per tick
+                        if poller is not None:
+                            poller.stop()
+                            poller = None
+                        if not async_runner:
+                            poller = WorldPoller(client)
+                            poller.start()
+                        env = JunctionEnvironment(client, poller=poller, tick_sync=True, incremental_obs=True)
+                        break
+                    except:
+                        sleep(1)
+
+            model = None
+            with profiler.phase("load policy"):
+                if policy_model is not None and policy_model.endswith(".npz"):
+                    from numpy_policy import NumpyPolicy
+                    model = NumpyPolicy(policy_model)
+                elif policy_model is not None:
+                    from keras.models import load_model
+                    model = load_model(policy_model)
 
             lock = Lock()
 
@@ -177,25 +264,74 @@ if __name__ == "__main__":
                 print("Running game", i)
                 i += 1
                 game_id = i
-                msg = env.reset()
+                with profiler.phase("first world"):
+                    msg = env.reset()
                 if msg is None:
                     sleep(1)
                     print('Sleeping...')
                     continue
 
+                # The road map is static for the whole game, so the distance
+                # tables are computed (or loaded from cache/) once per map
+                maze = 1 - next(iter(msg.values()))[:,:,0]
+                with profiler.phase("distance oracle"):
+                    oracle = DistanceOracle.load_or_build(maze, max_size=oracle_max_size)
+                # The async runner feeds the dispatcher with every world it fetches
+                get_world = None if async_runner else poller.get_world
+                if multi_stop:
+                    dispatcher = RoutePlanner(get_world, env.car_ids, maze, oracle)
+                else:
+                    dispatcher = Dispatcher(get_world, env.car_ids, maze, oracle)
+
+                policy = None
+                if model is not None:
+                    from inference_service import InferenceService
+                    from obs_encoder import center_pad_observations
+
+                    # One batched forward pass for the observations of all cars of a tick,
+                    # padded to the input size of the model
+                    receptor_size = model.input_shape[-3]
+                    policy = InferenceService(model.predict_on_batch, expected=len(env.car_ids),
+                                              preprocess=lambda batch: center_pad_observations(batch, receptor_size))
+                    policy.start()
+
                 processes = []
                 for car_id in env.car_ids:
-                    process = Runner(car_id, game_id, env, lock)
+                    process = Runner(car_id, game_id, env, lock, oracle, dispatcher, policy)
                     processes.append(process)
+
+                # Everything is set up once the first game starts
+                profiler.report()
+
+                if async_runner:
+                    import asyncio
+                    score = asyncio.run(run_game_async(client, env, processes, dispatcher, policy))
+                    print(f"Game {i} finished with score {score}")
+                    game_ids.append(game_id)
+                    if policy is not None:
+                        policy.log_stats()
+                        policy.stop()
+                    continue
             
 
-                for process in processes:
-                    process.start()
+                if policy is not None:
+                    # Per-car threads would take turns on the env lock and never share a batch
+                    run_policy_game(env, policy, msg)
+                else:
+                    for process in processes:
+                        process.start()
 
-                for process in processes:
-                    process.join()
+                    for process in processes:
+                        process.join()
                 print(f"Game {i} finished")
+                client.transport.log_stats()
+                if policy is not None:
+                    policy.log_stats()
+                    policy.stop()
                 game_ids.append(game_id)
         except Exception:
             pass
-        
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Channels the expert decides on: road map, waiting customers, destinations, the car
+STATE_CHANNELS = [0, 1, 3, 4]
+
+
+def state_keys(observations):
+    """Bytes keys of the (map, car, target set) state of each of the (B, H, W, 8) observations"""
+    states = np.asarray(observations)[..., STATE_CHANNELS] > 0
+    packed = np.packbits(states.reshape(len(states), -1), axis=1)
+    return [row.tobytes() for row in packed]
+
+
+def expert_action(obs):
+    """Action of the A* expert of client_vm for obs, starting without a remembered target"""
+    from client_vm import Runner
+
+    return int(Runner('0', 0, None, None).megaalg(obs))
+
+
+def _label_chunk(observations):
+    return [expert_action(obs) for obs in observations]
+
+
+class DaggerLabeler:
+    """
+        Labels the states visited by a learned policy with the expert's actions.
+
+        The observations of a batch are deduplicated on their (map, car, target
+        set) state first, and the distinct states are labeled by a pool of
+        worker processes that lives as long as the labeler, so it is started
+        once for all the DAgger iterations.
+    """
+
+    def __init__(self, workers=None, chunk_size=32):
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.executor = None
+        self.labeled = 0
+        self.queried = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def label(self, observations):
+        """Expert actions for the (B, H, W, 8) observations, as an int64 array of shape (B,)"""
+        observations = np.asarray(observations)
+        if len(observations) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Number of the state of every observation, states numbered in order of first appearance
+        first, inverse = {}, np.empty(len(observations), dtype=np.int64)
+        for i, key in enumerate(state_keys(observations)):
+            inverse[i] = first.setdefault(key, len(first))
+        distinct = observations[np.unique(inverse, return_index=True)[1]]
+
+        chunks = [distinct[start:start + self.chunk_size] for start in range(0, len(distinct), self.chunk_size)]
+        if self.workers > 1 and len(chunks) > 1:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            labels = [action for chunk in self.executor.map(_label_chunk, chunks) for action in chunk]
+        else:
+            labels = _label_chunk(distinct)
+
+        self.labeled += len(observations)
+        self.queried += len(distinct)
+        return np.array(labels, dtype=np.int64)[inverse]
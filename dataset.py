@@ -0,0 +1,219 @@
+import glob
+import os
+import re
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+import numpy as np
+
+from obs_encoder import center_pad_observations
+from sparse_obs import SparseObservations
+
+# The shards of a directory, shared by the datasets split from it: OpenShards of
+# their observations, the actions and scores arrays of every shard and the (H, W)
+# observation size
+Shards = namedtuple("Shards", ["observations", "actions", "scores", "shape"])
+
+
+def shard_files(directory, prefix):
+    """{shard number: [file names]} of the shards of prefix in directory"""
+    pattern = re.compile(re.escape(prefix) + r"_(\d+)_(obs\.npz|obs\.tmp\.npz|actions\.npy|scores\.npy)$")
+    shards = {}
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            shards.setdefault(int(match.group(1)), []).append(name)
+    return shards
+
+
+def next_shard(directory, prefix):
+    """Number after the highest shard of prefix in directory, so that no existing shard is overwritten"""
+    return max(shard_files(directory, prefix), default=-1) + 1
+
+
+class ShardWriter:
+    """
+        Appends (observation, action, score) records to fixed-size shards while
+        games run: {prefix}_{n:05d}_obs.npz, _actions.npy and _scores.npy in
+        directory. Observations are center-padded to observation_size x
+        observation_size, the input size of the models, so that games on maps
+        of any size share the shards, and kept in the sparse form of
+        sparse_obs.SparseObservations. A shard is written as soon as it is
+        full, flush writes the last, partial one. Appending is thread-safe, so
+        the runners of all cars can share a writer.
+
+        New shards are numbered after the existing ones of prefix, or with
+        overwrite, those are deleted first, e.g. to generate them again.
+    """
+
+    def __init__(self, directory, shard_size=1024, prefix="shard", observation_size=100, overwrite=False):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.observation_size = observation_size
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = Lock()
+        if overwrite:
+            for names in shard_files(directory, prefix).values():
+                for name in names:
+                    os.remove(os.path.join(directory, name))
+        self.shard = next_shard(directory, prefix)
+        self._start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def _start(self):
+        self.observations = SparseObservations(self.observation_size, self.observation_size)
+        self.actions = []
+        self.scores = []
+
+    def append(self, obs, action, score):
+        obs = center_pad_observations(np.asarray(obs), self.observation_size)
+        with self.lock:
+            self.observations.append(obs)
+            self.actions.append(action)
+            self.scores.append(score)
+            if len(self.actions) < self.shard_size:
+                return
+            shard, records = self._take()
+        self._write(shard, *records)
+
+    def extend(self, observations, actions, scores):
+        for obs, action, score in zip(observations, actions, scores):
+            self.append(obs, action, score)
+
+    def flush(self):
+        with self.lock:
+            if not self.actions:
+                return
+            shard, records = self._take()
+        self._write(shard, *records)
+
+    def _take(self):
+        """Hands the buffered records over to be written and starts a new shard"""
+        records = (self.observations, np.array(self.actions, dtype=np.int8), np.array(self.scores, dtype=np.float32))
+        shard = self.shard
+        self.shard += 1
+        self._start()
+        return shard, records
+
+    def _write(self, shard, observations, actions, scores):
+        base = os.path.join(self.directory, f"{self.prefix}_{shard:05d}")
+        np.save(f"{base}_actions.npy", actions)
+        np.save(f"{base}_scores.npy", scores)
+        # The observations file makes the shard visible to the loader, so it comes last
+        temporary = f"{base}_obs.tmp.npz"
+        observations.save(temporary)
+        os.replace(temporary, f"{base}_obs.npz")
+
+
+class OpenShards:
+    """
+        Sparse observations of the shard files at paths, loaded on first use.
+        Only the max_open most recently used shards are kept in memory, so
+        datasets of any size can be streamed; thread-safe.
+    """
+
+    def __init__(self, paths, max_open=16):
+        self.paths = paths
+        self.max_open = max_open
+        self.lock = Lock()
+        # shard number -> SparseObservations, least recently used first
+        self.open = OrderedDict()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, shard):
+        with self.lock:
+            if shard in self.open:
+                self.open.move_to_end(shard)
+                return self.open[shard]
+        observations = SparseObservations.load(self.paths[shard])
+        with self.lock:
+            self.open[shard] = observations
+            while len(self.open) > self.max_open:
+                self.open.popitem(last=False)
+        return observations
+
+
+class ShardedDataset:
+    """
+        Loader of the shards of a ShardWriter directory, the ones written with
+        prefix or all of them.
+
+        Only actions and scores, which are small, are loaded at once; they
+        index the records. The observations of a shard are loaded the first
+        time one of its records is requested, at most max_open_shards of them
+        are kept in memory, and they are only decoded for the requested
+        records. batches streams shuffled (observations, actions) minibatches
+        forever, e.g. for Keras:
+
+            train, validation = ShardedDataset(directory).split(0.2)
+            model.fit(train.batches(32), steps_per_epoch=train.steps(32),
+                      validation_data=validation.batches(32), validation_steps=validation.steps(32))
+    """
+
+    def __init__(self, directory, prefix=None, indices=None, shards=None, max_open_shards=16):
+        if shards is None:
+            paths, actions, scores = [], [], []
+            pattern = f"{prefix}_*_obs.npz" if prefix is not None else "*_obs.npz"
+            for filename in sorted(glob.glob(os.path.join(directory, pattern))):
+                base = filename[:-len("_obs.npz")]
+                paths.append(filename)
+                actions.append(np.load(f"{base}_actions.npy"))
+                scores.append(np.load(f"{base}_scores.npy"))
+            shapes = {SparseObservations.read_shape(path) for path in paths}
+            if len(shapes) > 1:
+                raise ValueError(f'Shards of {directory} hold observations of different sizes {sorted(shapes)}')
+            shards = Shards(OpenShards(paths, max_open_shards), actions, scores, shapes.pop() if shapes else None)
+        self.directory = directory
+        self.prefix = prefix
+        self.shards = shards
+
+        sizes = [len(actions) for actions in shards.actions]
+        self.offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        all_actions = np.concatenate(shards.actions) if shards.actions else np.zeros(0, np.int8)
+        all_scores = np.concatenate(shards.scores) if shards.scores else np.zeros(0, np.float32)
+
+        self.indices = np.arange(self.offsets[-1]) if indices is None else np.asarray(indices, dtype=np.int64)
+        self.actions = all_actions[self.indices]
+        self.scores = all_scores[self.indices]
+        self.observation_shape = shards.shape + (8,) if shards.shape is not None else None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def split(self, validation_fraction, seed=None):
+        """Random (train, validation) split sharing the shards and the ones loaded"""
+        permutation = np.random.default_rng(seed).permutation(self.indices)
+        validation = int(round(len(permutation) * validation_fraction))
+        return (ShardedDataset(self.directory, self.prefix, np.sort(permutation[validation:]), self.shards),
+                ShardedDataset(self.directory, self.prefix, np.sort(permutation[:validation]), self.shards))
+
+    def observations(self, positions):
+        """Observations of the records at positions of this dataset, as one uint8 array"""
+        records = self.indices[np.asarray(positions, dtype=np.int64)]
+        shard_of = np.searchsorted(self.offsets, records, side="right") - 1
+        out = np.empty((len(records),) + self.observation_shape, dtype=np.uint8)
+        for shard in np.unique(shard_of):
+            selected = np.flatnonzero(shard_of == shard)
+            out[selected] = self.shards.observations[shard].decode(records[selected] - self.offsets[shard])
+        return out
+
+    def steps(self, batch_size):
+        return -(-len(self) // batch_size)
+
+    def batches(self, batch_size, shuffle=True, seed=None):
+        """Endless generator of (observations, actions) minibatches, reshuffled every epoch"""
+        rng = np.random.default_rng(seed)
+        while True:
+            positions = rng.permutation(len(self)) if shuffle else np.arange(len(self))
+            for start in range(0, len(positions), batch_size):
+                batch = positions[start:start + batch_size]
+                yield self.observations(batch), self.actions[batch]
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from alg_astar import ACTION_STEPS, MOVES
+
+CACHE_DIR = os.path.join("cache", "distance_oracle")
+UNREACHABLE = np.iinfo(np.uint16).max
+
+
+def maze_key(maze):
+    """Hash of the walkable cells of a maze, used as the cache key of its tables"""
+    walkable = np.asarray(maze) == 0
+    digest = hashlib.sha1(str(walkable.shape).encode())
+    digest.update(np.packbits(walkable).tobytes())
+    return digest.hexdigest()
+
+
+def road_graph(maze):
+    """
+        (graph, nodes) of a maze: the CSR adjacency matrix of its 4-connected
+        road cells, and the node number of every flat cell index, -1 for walls
+    """
+    # SciPy is only needed here, loading cached tables does without it
+    from scipy.sparse import coo_matrix
+
+    maze = np.asarray(maze)
+    no_rows, no_columns = maze.shape
+    cells = np.flatnonzero(maze.ravel() == 0)
+    nodes = np.full(maze.size, -1, dtype=np.int64)
+    nodes[cells] = np.arange(len(cells))
+    rows, columns = np.divmod(cells, no_columns)
+
+    heads, tails = [], []
+    for d_row, d_column in MOVES:
+        n_rows, n_columns = rows + d_row, columns + d_column
+        inside = (n_rows >= 0) & (n_rows < no_rows) & (n_columns >= 0) & (n_columns < no_columns)
+        neighbours = np.full(len(cells), -1, dtype=np.int64)
+        neighbours[inside] = nodes[n_rows[inside] * no_columns + n_columns[inside]]
+        linked = neighbours >= 0
+        heads.append(np.flatnonzero(linked))
+        tails.append(neighbours[linked])
+    heads, tails = np.concatenate(heads), np.concatenate(tails)
+    graph = coo_matrix((np.ones(len(heads)), (heads, tails)), shape=(len(cells), len(cells))).tocsr()
+    return graph, nodes
+
+
+class DistanceOracle:
+    """
+        All-pairs shortest-path distances and first moves of a static maze.
+
+        The maze follows the convention of alg_astar.search: 0 is walkable
+        terrain, anything else is a wall, and cells are (row, column) tuples.
+        Once built, distance and next_move lookups are O(1).
+    """
+
+    def __init__(self, maze, distances, moves):
+        self.maze = np.asarray(maze)
+        self.no_rows, self.no_columns = self.maze.shape
+        self.key = maze_key(self.maze)
+        # cell -> node number, -1 for walls
+        cells = np.flatnonzero(self.maze.ravel() == 0)
+        self.nodes = np.full(self.maze.size, -1, dtype=np.int32)
+        self.nodes[cells] = np.arange(len(cells), dtype=np.int32)
+        # distances[target_node, source_node] and moves[target_node, source_node]
+        # keep the rows contiguous per target, which is what the builder produces
+        self.distances = distances
+        self.moves = moves
+
+    @classmethod
+    def build(cls, maze, chunk_size=512):
+        """Computes the tables with one BFS per road cell"""
+        from scipy.sparse.csgraph import shortest_path
+
+        maze = np.asarray(maze)
+        no_columns = maze.shape[1]
+        # Undirected 4-connected graph over the road cells
+        graph, nodes = road_graph(maze)
+        cells = np.flatnonzero(nodes >= 0)
+        rows, columns = np.divmod(cells, no_columns)
+
+        # action taken when moving from a cell by (d_row, d_column), indexed [d_row + 1, d_column + 1]
+        step_actions = np.full((3, 3), 4, dtype=np.int8)
+        for action, (d_row, d_column) in enumerate(ACTION_STEPS):
+            step_actions[d_row + 1, d_column + 1] = action
+
+        distances = np.empty((len(cells), len(cells)), dtype=np.uint16)
+        moves = np.empty((len(cells), len(cells)), dtype=np.int8)
+        for first in range(0, len(cells), chunk_size):
+            targets = np.arange(first, min(first + chunk_size, len(cells)))
+            dist, predecessors = shortest_path(graph, directed=False, unweighted=True,
+                                               return_predecessors=True, indices=targets)
+            dist[np.isinf(dist)] = UNREACHABLE
+            distances[targets] = dist.astype(np.uint16)
+            # The graph is undirected, so the predecessor of a source on the
+            # path from the target is the next hop from that source to the target
+            reachable = predecessors >= 0
+            hop = np.where(reachable, predecessors, 0)
+            d_rows = np.where(reachable, rows[hop] - rows[np.newaxis, :], 0)
+            d_columns = np.where(reachable, columns[hop] - columns[np.newaxis, :], 0)
+            moves[targets] = step_actions[d_rows + 1, d_columns + 1]
+        return cls(maze, distances, moves)
+
+    @classmethod
+    def load_or_build(cls, maze, cache_dir=CACHE_DIR, max_size=None):
+        """
+            Loads the tables of the maze from cache_dir, building and saving them
+            on a miss. The tables grow with the square of the road cells (about
+            a minute and 700 MB at 200x200), so a maze larger than max_size in
+            either dimension gets None, for the callers to fall back to search.
+        """
+        maze = np.asarray(maze)
+        if max_size is not None and max(maze.shape) > max_size:
+            logging.info(f'No distance oracle for the {maze.shape[0]}x{maze.shape[1]} map, larger than {max_size}')
+            return None
+        path = os.path.join(cache_dir, maze_key(maze) + ".npz")
+        if os.path.isfile(path):
+            with np.load(path) as tables:
+                logging.info(f'Loaded distance oracle from {path}')
+                return cls(maze, tables["distances"], tables["moves"])
+
+        oracle = cls.build(maze)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary name first so that a crash never leaves a truncated cache
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, distances=oracle.distances, moves=oracle.moves)
+        os.replace(tmp_path, path)
+        logging.info(f'Saved distance oracle to {path}')
+        return oracle
+
+    def node(self, cell):
+        """Node number of a (row, column) cell, -1 for walls"""
+        return self.nodes[int(cell[0]) * self.no_columns + int(cell[1])]
+
+    def distance(self, start, end):
+        """Road distance from start to end, None if there is no path"""
+        source, target = self.node(start), self.node(end)
+        if source < 0 or target < 0:
+            return None
+        dist = self.distances[target, source]
+        return None if dist == UNREACHABLE else int(dist)
+
+    def next_move(self, start, end):
+        """Action (0-3) of the first move on a shortest path from start to end, 4 if there is none"""
+        source, target = self.node(start), self.node(end)
+        if source < 0 or target < 0:
+            return 4
+        return int(self.moves[target, source])
+
+    def path(self, start, end):
+        """Same return value as alg_astar.search, following the next-hop table"""
+        if self.distance(start, end) is None:
+            return None, 2
+        path = []
+        cell = (int(start[0]), int(start[1]))
+        end = (int(end[0]), int(end[1]))
+        while cell != end:
+            d_row, d_column = ACTION_STEPS[self.next_move(cell, end)]
+            cell = (cell[0] + d_row, cell[1] + d_column)
+            path.append(cell)
+        return path, 0
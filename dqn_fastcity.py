@@ -2,100 +2,62 @@
 from __future__ import division
 import argparse
 
-from PIL import Image
 import numpy as np
 import os
-import gym
 
-from keras.models import Sequential
-from keras.layers import Dense, Activation, Dropout, Flatten, Permute, InputLayer
+from keras.models import Model, Sequential
+from keras.layers import Dense, Activation, Dropout, Flatten, Permute, InputLayer, Input, Concatenate
 from keras.layers import Convolution2D, MaxPooling2D
 from keras.optimizers import Adam
 import keras.backend as K
 
 from rl.agents.dqn import DQNAgent
 from rl.policy import LinearAnnealedPolicy, BoltzmannQPolicy, EpsGreedyQPolicy
-from rl.memory import SequentialMemory
 from rl.core import Processor
 from rl.callbacks import FileLogger, ModelIntervalCheckpoint
 from keras.callbacks import TensorBoard
 
+from obs_encoder import SUMMARY_FEATURES, center_pad_observations
+from replay_memory import CompactMemory
+
 
 INPUT_SHAPE = (100, 100)
 WINDOW_LENGTH = 8
 
 
-def center_pad_observations(obs, receptor_size=100):
-    npad_ = (receptor_size-obs.shape[1])//2 # make sure the receptive field is always 200
-    npads = ((0, 0), (npad_, npad_), (npad_, npad_), (0, 0))
-    return np.pad(obs, pad_width=npads, mode='constant', constant_values=0)
-
-
 class SmartCityProcessor(Processor):
+    def __init__(self, crop_size=None):
+        # With crop_size, observations are the egocentric {"view", "summary"} dicts of the env
+        self.crop_size = crop_size
+
     def process_observation(self, observation):
         # print(type(observation))
         # print(observation['0'].shape) # FIXME: implement the abstract method for the environment step
-        if isinstance(observation, dict):
-            processed_observation = observation['0'] #center_pad_observations(observation)
+        if isinstance(observation, dict) and "view" not in observation:
+            processed_observation = observation['0']
         else:
             processed_observation = observation
 
-        return processed_observation
+        if self.crop_size:
+            # Views have the same size on every map
+            return processed_observation
+        # Padded before it is stored, the replay memory holds observations of the model's input size
+        return center_pad_observations(processed_observation, INPUT_SHAPE[0])
 
     def process_state_batch(self, batch):
-        processed_batch = center_pad_observations(batch[0])
-        # print(processed_batch.shape)
-        # print(len(processed_batch))
-        return processed_batch
+        if self.crop_size:
+            # (B, window_length) windows of observation dicts to the [views, summaries] inputs of the model
+            views = np.array([[frame["view"] for frame in state] for state in batch])
+            summaries = np.array([[frame["summary"] for frame in state] for state in batch])
+            return [views[:, -1], summaries[:, -1]]
+        # (B, window_length, H, W, 8) states to the (B, H, W, 8) model input, window_length is 1
+        return batch[:, -1]
     
     def process_action(self, action):
         return action
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--mode', choices=['train', 'test'], default='train')
-parser.add_argument('--env-name', type=str, default='fastcity')
-parser.add_argument('--weights', type=str, default=None)
-args = parser.parse_args()
-
-# Get the environment and extract the number of actions.
-from client import CarDirection, Client
-from env import JunctionEnvironment
-team_name = "ipa"
-team_key = "admin"
-client = Client(team_name=team_name, team_key=team_key)
-env = JunctionEnvironment(client)
-# env = gym.make(args.env_name)
-np.random.seed(123)
-env.seed(123)
-nb_actions = env.action_space.n
-print(nb_actions)
-
-# Next, we build our model. We use the same model that was described by Mnih et al. (2015).
-input_shape = (100,100,8) #(WINDOW_LENGTH,) + INPUT_SHAPE
-model = Sequential()
-# if K.image_dim_ordering() == 'tf':
-    # # (width, height, channels)
-    # print("tf ran")
-    # # model.add(Permute((2, 3, 1), input_shape=input_shape))
-# elif K.image_dim_ordering() == 'th':
-    # # (channels, width, height)
-    # model.add(Permute((1, 2, 3), input_shape=input_shape))
-# else:
-    # raise RuntimeError('Unknown image_dim_ordering.')
-
-# model.add(Convolution2D(32, (8, 8), strides=(4, 4), input_shape=input_shape))
-# model.add(Activation('relu'))
-# model.add(Convolution2D(64, (4, 4), strides=(2, 2)))
-# model.add(Activation('relu'))
-# model.add(Convolution2D(64, (3, 3), strides=(1, 1)))
-# model.add(Activation('relu'))
-# model.add(Flatten())
-# model.add(Dense(512))
-# model.add(Activation('relu'))
-# model.add(Dense(nb_actions))
-# model.add(Activation('linear'))
-def create_model_1():
+def create_model_1(input_shape, nb_actions):
     model = Sequential()
 
     model.add(Convolution2D(32, 8, 8, border_mode='same',
@@ -127,64 +89,144 @@ def create_model_1():
     model.add(Dense(nb_actions, activation='softmax'))
     return model
 
-model = create_model_1()
-
-print(model.summary())
-
-# Finally, we configure and compile our agent. You can use every built-in Keras optimizer and
-# even the metrics!
-memory = SequentialMemory(limit=1000000, window_length=1)#WINDOW_LENGTH) # FIXME: make the windo length work!
-processor = SmartCityProcessor() #AtariProcessor()
-
-# Select a policy. We use eps-greedy action selection, which means that a random action is selected
-# with probability eps. We anneal eps from 1.0 to 0.1 over the course of 1M steps. This is done so that
-# the agent initially explores the environment (high eps) and then gradually sticks to what it knows
-# (low eps). We also set a dedicated eps value that is used during testing. Note that we set it to 0.05
-# so that the agent still performs some random actions. This ensures that the agent cannot get stuck.
-policy = LinearAnnealedPolicy(EpsGreedyQPolicy(), attr='eps', value_max=1., value_min=.1, value_test=.05,
-                              nb_steps=1000000)
-
-# The trade-off between exploration and exploitation is difficult and an on-going research topic.
-# If you want, you can experiment with the parameters or use a different policy. Another popular one
-# is Boltzmann-style exploration:
-# policy = BoltzmannQPolicy(tau=1.)
-# Feel free to give it a try!
-batch_size = 32
-dqn = DQNAgent(model=model, nb_actions=nb_actions, policy=policy, memory=memory,
-               processor=processor, nb_steps_warmup=50000, gamma=.99, target_model_update=10000,
-               train_interval=4, delta_clip=1., batch_size=batch_size)
-dqn.compile(Adam(lr=.00025), metrics=['sparse_categorical_crossentropy', 'accuracy'])
-
-if args.mode == 'train':
-    # Okay, now it's time to learn something! We capture the interrupt exception so that training
-    # can be prematurely aborted. Notice that now you can use the built-in Keras callbacks!
-
-    # Load weights from previously learned model
-    #weights_filename = os.path.join("checkpoints", "dqn", f'dqn_{args.env_name}_weights.h5f')
-    if args.weights: # or from direct path e.g. from the imitated model
-        weights_filename = args.weights
+
+def create_model_crop(crop_size, nb_actions):
+    """Model of the egocentric observations: a small convolution stack on the view, joined with the summary"""
+    view = Input(shape=(crop_size, crop_size, 8), name='view')
+    summary = Input(shape=(len(SUMMARY_FEATURES),), name='summary')
+
+    x = Convolution2D(32, (3, 3), padding='same', activation='relu')(view)
+    x = Convolution2D(32, (3, 3), activation='relu')(x)
+    x = MaxPooling2D(pool_size=(2, 2))(x)
+    x = Convolution2D(64, (3, 3), padding='same', activation='relu')(x)
+    x = Convolution2D(64, (3, 3), activation='relu')(x)
+    x = MaxPooling2D(pool_size=(2, 2))(x)
+    x = Flatten()(x)
+
+    x = Concatenate()([x, Dense(64, activation='relu')(summary)])
+    x = Dense(256, activation='relu')(x)
+    x = Dropout(0.5)(x)
+    return Model(inputs=[view, summary], outputs=Dense(nb_actions, activation='softmax')(x))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['train', 'test'], default='train')
+    parser.add_argument('--env-name', type=str, default='fastcity')
+    parser.add_argument('--weights', type=str, default=None)
+    parser.add_argument('--crop-size', type=int, default=None,
+                        help="egocentric crop_size x crop_size views and summary features instead of the whole map")
+    args = parser.parse_args()
+
+    # Get the environment and extract the number of actions.
+    from client import CarDirection, Client
+    from env import JunctionEnvironment
+    team_name = "ipa"
+    team_key = "admin"
+    client = Client(team_name=team_name, team_key=team_key)
+    env = JunctionEnvironment(client, crop_size=args.crop_size)
+    # env = gym.make(args.env_name)
+    np.random.seed(123)
+    env.seed(123)
+    nb_actions = env.action_space.n
+    print(nb_actions)
+
+    # Next, we build our model. We use the same model that was described by Mnih et al. (2015).
+    input_shape = (100,100,8) #(WINDOW_LENGTH,) + INPUT_SHAPE
+    model = Sequential()
+    # if K.image_dim_ordering() == 'tf':
+        # # (width, height, channels)
+        # print("tf ran")
+        # # model.add(Permute((2, 3, 1), input_shape=input_shape))
+    # elif K.image_dim_ordering() == 'th':
+        # # (channels, width, height)
+        # model.add(Permute((1, 2, 3), input_shape=input_shape))
+    # else:
+        # raise RuntimeError('Unknown image_dim_ordering.')
+
+    # model.add(Convolution2D(32, (8, 8), strides=(4, 4), input_shape=input_shape))
+    # model.add(Activation('relu'))
+    # model.add(Convolution2D(64, (4, 4), strides=(2, 2)))
+    # model.add(Activation('relu'))
+    # model.add(Convolution2D(64, (3, 3), strides=(1, 1)))
+    # model.add(Activation('relu'))
+    # model.add(Flatten())
+    # model.add(Dense(512))
+    # model.add(Activation('relu'))
+    # model.add(Dense(nb_actions))
+    # model.add(Activation('linear'))
+    if args.crop_size:
+        input_shape = (args.crop_size, args.crop_size, 8)
+        model = create_model_crop(args.crop_size, nb_actions)
+    else:
+        model = create_model_1(input_shape, nb_actions)
+
+    print(model.summary())
+
+    # Finally, we configure and compile our agent. You can use every built-in Keras optimizer and
+    # even the metrics!
+    # Sparse uint8 transitions memory-mapped under cache/, a few GB on disk instead of tens of GB of RAM:
+    # about 2.8 kB per step, so the files of the 1M steps (~2.8 GB) are preallocated on the first run
+    # With --crop-size the memory holds the views and the summaries
+    memory_dir = os.path.join("cache", "replay_memory" if not args.crop_size else f"replay_memory_crop{args.crop_size}")
+    memory = CompactMemory(limit=1000000, observation_shape=input_shape, path=memory_dir, sparse=True,
+                           summary_size=len(SUMMARY_FEATURES) if args.crop_size else 0,
+                           window_length=1)#WINDOW_LENGTH) # FIXME: make the windo length work!
+    processor = SmartCityProcessor(args.crop_size) #AtariProcessor()
+
+    # Select a policy. We use eps-greedy action selection, which means that a random action is selected
+    # with probability eps. We anneal eps from 1.0 to 0.1 over the course of 1M steps. This is done so that
+    # the agent initially explores the environment (high eps) and then gradually sticks to what it knows
+    # (low eps). We also set a dedicated eps value that is used during testing. Note that we set it to 0.05
+    # so that the agent still performs some random actions. This ensures that the agent cannot get stuck.
+    policy = LinearAnnealedPolicy(EpsGreedyQPolicy(), attr='eps', value_max=1., value_min=.1, value_test=.05,
+                                  nb_steps=1000000)
+
+    # The trade-off between exploration and exploitation is difficult and an on-going research topic.
+    # If you want, you can experiment with the parameters or use a different policy. Another popular one
+    # is Boltzmann-style exploration:
+    # policy = BoltzmannQPolicy(tau=1.)
+    # Feel free to give it a try!
+    batch_size = 32
+    dqn = DQNAgent(model=model, nb_actions=nb_actions, policy=policy, memory=memory,
+                   processor=processor, nb_steps_warmup=50000, gamma=.99, target_model_update=10000,
+                   train_interval=4, delta_clip=1., batch_size=batch_size)
+    dqn.compile(Adam(lr=.00025), metrics=['sparse_categorical_crossentropy', 'accuracy'])
+
+    if args.mode == 'train':
+        # Okay, now it's time to learn something! We capture the interrupt exception so that training
+        # can be prematurely aborted. Notice that now you can use the built-in Keras callbacks!
+
+        # Load weights from previously learned model
+        #weights_filename = os.path.join("checkpoints", "dqn", f'dqn_{args.env_name}_weights.h5f')
+        if args.weights: # or from direct path e.g. from the imitated model
+            weights_filename = args.weights
+            dqn.load_weights(weights_filename)
+            print(f"Loaded weights from {weights_filename}")
+
+        # Path to save weights learned
+        dagger_experiment = np.random.randint(0, 1000000)
+        weights_filename = os.path.join("checkpoints", "dqn", f'dqn_{args.env_name}_weights.h5f')
+        checkpoint_dir = os.path.dirname(weights_filename)
+        checkpoint_weights_filename = 'dqn_' + args.env_name + '_weights_{step}.h5f'
+        log_filename = 'dqn_{}_log.json'.format(args.env_name)
+        callbacks = [ModelIntervalCheckpoint(checkpoint_weights_filename, interval=250000)]
+        callbacks += [FileLogger(log_filename, interval=100)]
+        callbacks += [TensorBoard(log_dir=f'./logs/dagger_{dagger_experiment}', batch_size=batch_size)]
+        dqn.fit(env, callbacks=callbacks, nb_steps=1750000, log_interval=10000)
+
+        # After training is done, we save the final weights one more time.
+        dqn.save_weights(weights_filename, overwrite=True)
+
+        # Finally, evaluate our algorithm for 10 episodes.
+        dqn.test(env, nb_episodes=10, visualize=False)
+    elif args.mode == 'test':
+        weights_filename = f'dqn_{args.env_name}_weights.h5f'
+        if args.weights:
+            weights_filename = args.weights
         dqn.load_weights(weights_filename)
-        print(f"Loaded weights from {weights_filename}")
-
-    # Path to save weights learned
-    dagger_experiment = np.random.randint(0, 1000000)
-    weights_filename = os.path.join("checkpoints", "dqn", f'dqn_{args.env_name}_weights.h5f')
-    checkpoint_dir = os.path.dirname(weights_filename)
-    checkpoint_weights_filename = 'dqn_' + args.env_name + '_weights_{step}.h5f'
-    log_filename = 'dqn_{}_log.json'.format(args.env_name)
-    callbacks = [ModelIntervalCheckpoint(checkpoint_weights_filename, interval=250000)]
-    callbacks += [FileLogger(log_filename, interval=100)]
-    callbacks += [TensorBoard(log_dir=f'./logs/dagger_{dagger_experiment}', batch_size=batch_size)]
-    dqn.fit(env, callbacks=callbacks, nb_steps=1750000, log_interval=10000)
-
-    # After training is done, we save the final weights one more time.
-    dqn.save_weights(weights_filename, overwrite=True)
-
-    # Finally, evaluate our algorithm for 10 episodes.
-    dqn.test(env, nb_episodes=10, visualize=False)
-elif args.mode == 'test':
-    weights_filename = f'dqn_{args.env_name}_weights.h5f'
-    if args.weights:
-        weights_filename = args.weights
-    dqn.load_weights(weights_filename)
-    dqn.test(env, nb_episodes=10, visualize=True)
\ No newline at end of file
+        dqn.test(env, nb_episodes=10, visualize=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import gym
 import numpy as np
 
-from scipy.spatial.distance import cityblock
 from gym import spaces
 from client import CarDirection, Client
+from obs_encoder import SUMMARY_FEATURES, EgocentricView, ObservationEncoder
+from threading import Lock
 import time
 
 
@@ -33,10 +34,46 @@ class JunctionEnvironment(gym.Env):
         functionality over time.
         """
 
-    def __init__(self, client: Client):
+    def __init__(self, client: Client, step_delay=0.3, poller=None, tick_sync=False,
+                 poll_interval=0.02, tick_timeout=2.0, incremental_obs=False, crop_size=None):
+        """
+            client can be a client.Client talking to the challenge server or an
+            in-process simulator.CitySimulator, which ignores step_delay.
+            With a world_poller.WorldPoller the world is read from its latest
+            snapshot instead of being downloaded on every step.
+
+            With tick_sync, step waits for the world to advance after a move
+            instead of sleeping step_delay: it sleeps until the next tick is
+            expected from the measured tick period, then polls every
+            poll_interval (or waits on the poller) for at most tick_timeout.
+            The measured period is reported as info["tick_period"].
+
+            With incremental_obs, observations are patched from the previous
+            world where it changed instead of being encoded from scratch.
+
+            With crop_size, observations are egocentric: a dict of the
+            crop_size x crop_size "view" centred on the car and the "summary"
+            vector of obs_encoder.SUMMARY_FEATURES, whatever the map size.
+        """
         super().__init__()
 
         self.client = client
+        self.step_delay = step_delay
+        self.poller = poller
+        self.tick_sync = tick_sync
+        self.poll_interval = poll_interval
+        self.tick_timeout = tick_timeout
+        self.incremental_obs = incremental_obs
+        self.crop_size = crop_size
+        self.egocentric = EgocentricView(crop_size) if crop_size else None
+
+        self.encoder = None
+        self.encoder_lock = Lock()
+
+        self.tick_period = None
+        self._last_world = None
+        self._last_tick_at = None
+        self._last_tick = None
 
         self.reward_range = (-float('inf'), float('inf'))
 
@@ -50,7 +87,13 @@ class JunctionEnvironment(gym.Env):
         self.width = world["height"]
         self.height = world["width"]
         self.car_ids = self.client.get_team_cars(world)
-        self.observation_space = spaces.Box(low=0, high=100, shape=(self.height, self.width, 8), dtype=np.uint8)
+        self.observation_space = spaces.Box(low=0, high=255, shape=(self.height, self.width, 8), dtype=np.uint8)
+        if self.egocentric is not None:
+            self.observation_space = spaces.Dict({
+                "view": spaces.Box(low=0, high=255, shape=(self.crop_size, self.crop_size, 8), dtype=np.uint8),
+                "summary": spaces.Box(low=-np.inf, high=np.inf, shape=(len(SUMMARY_FEATURES),), dtype=np.float32),
+            })
+        self.encoder = ObservationEncoder(self.height, self.width, self.car_ids, self.incremental_obs)
 
     def step(self, action, car_id='0'):
         """Run one timestep of the environment's dynamics. When end of
@@ -60,7 +103,9 @@ class JunctionEnvironment(gym.Env):
         Accepts an action and returns a tuple (observation, reward, done, info).
 
         Args:
-            action (object): an action provided by the agent
+            action (object): an action provided by the agent, or a {car_id: action}
+                dict to move several cars in the same tick. The observation,
+                reward and done are then dicts by car id as well.
 
         Returns:
             observation (object): agent's observation of the current environment
@@ -68,17 +113,22 @@ class JunctionEnvironment(gym.Env):
             done (bool): whether the episode has ended, in which case further step() calls will return undefined results
             info (dict): contains auxiliary diagnostic information (helpful for debugging, and sometimes learning)
         """
+        if isinstance(action, dict):
+            return self._step_fleet(action)
+
         if car_id not in self.car_ids:
             raise Exception("Wrong car id")
 
         if action < 4:
+            seen = self._seen_world()
             self.client.move_car(car_id, CarDirection(action))
-            time.sleep(0.3)
+            self._advance_clock()
+            world = self._world_after_move(seen, [car_id])
         else:
             # Do nothing (stay)
-            pass
-        
-        world = self.client.get_world()
+            self._advance_clock()
+            world = self._get_world()
+
         done = True if 'grid' not in world else False
 
         if done:
@@ -86,9 +136,143 @@ class JunctionEnvironment(gym.Env):
 
         obs = self.__process_observations(world, car_id)
         reward = self.client.get_score()
-        info = {}
+        info = {"tick_period": self.tick_period}
         return obs, reward, done, info
 
+    def _step_fleet(self, actions):
+        """Multi-agent step: submits all the moves of the tick, then fetches the world and the score once"""
+        for car_id in actions:
+            if car_id not in self.car_ids:
+                raise Exception("Wrong car id")
+
+        moves = {car_id: CarDirection(action) for car_id, action in actions.items() if action < 4}
+        if moves:
+            seen = self._seen_world()
+            self.client.move_cars(moves)
+            self._advance_clock()
+            world = self._world_after_move(seen, list(moves))
+        else:
+            self._advance_clock()
+            world = self._get_world()
+        if 'grid' not in world:
+            return ({car_id: None for car_id in actions}, {car_id: None for car_id in actions},
+                    {car_id: True for car_id in actions}, None)
+
+        score = self.client.get_score()
+        observations = self.observe(world)
+        observations = {car_id: observations[car_id] for car_id in actions}
+        rewards = {car_id: score for car_id in actions}
+        dones = {car_id: False for car_id in actions}
+        return observations, rewards, dones, {"tick_period": self.tick_period}
+
+    def _advance_clock(self):
+        """One tick per step of an in-process simulator, which has no clock of its own; servers tick by themselves"""
+        tick = getattr(self.client, "tick", None)
+        if tick is not None:
+            tick()
+
+    def _get_world(self):
+        if self.poller is not None:
+            world = self.poller.get_world()
+        else:
+            world = self.client.get_world()
+        self._last_world = world
+        return world
+
+    def _seen_world(self):
+        """World before a move, with its poller version (None without a poller)"""
+        if self.poller is not None:
+            snapshot = self.poller.latest()
+            return snapshot.version, snapshot.world
+        return None, self._last_world
+
+    def _world_after_move(self, seen, car_ids):
+        """
+            World once the move of car_ids has been applied. A world that changed
+            since seen is not enough, it may come from a tick before the move was
+            sent: either a moved car is somewhere else, or the world advances again
+            after the first one fetched since the move (e.g. for a blocked move).
+        """
+        if getattr(self.client, "tick", None) is not None:
+            # An in-process simulator applied the move in _advance_clock already
+            return self._get_world()
+        if not self.tick_sync:
+            if self.step_delay:
+                time.sleep(self.step_delay)
+            return self._get_world()
+
+        version, before = seen
+        if self.poller is not None:
+            deadline = time.monotonic() + self.tick_timeout
+            for _ in range(2):
+                snapshot = self.poller.wait_for(version, max(deadline - time.monotonic(), 0))
+                if snapshot.version <= version:
+                    break
+                self._record_tick(snapshot.fetched_at, snapshot.world)
+                version = snapshot.version
+                if self._moved(before, snapshot.world, car_ids):
+                    break
+            self._last_world = snapshot.world
+            return snapshot.world
+
+        started = time.monotonic()
+        deadline = started + self.tick_timeout
+        if self.tick_period is not None and self._last_tick_at is not None:
+            # No need to ask before the next tick is due
+            expected = self._last_tick_at + self.tick_period - self.poll_interval
+            if expected > started:
+                time.sleep(min(expected, deadline) - started)
+        reference = None
+        while True:
+            world = self._get_world()
+            now = time.monotonic()
+            if reference is None:
+                if self._world_advanced(before, world):
+                    self._record_tick(now, world)
+                if self._moved(before, world, car_ids):
+                    return world
+                reference = world
+            elif self._world_advanced(reference, world):
+                self._record_tick(now, world)
+                return world
+            if now >= deadline:
+                return world
+            time.sleep(self.poll_interval)
+
+    @staticmethod
+    def _moved(before, world, car_ids):
+        """Whether one of the cars is somewhere else in world than before, or there is nothing to compare"""
+        if before is None or "grid" not in before or "grid" not in world:
+            return True
+        return any(before["cars"][car_id]["position"] != world["cars"][car_id]["position"]
+                   for car_id in car_ids if car_id in before["cars"] and car_id in world["cars"])
+
+    def _record_tick(self, at, world):
+        """Updates the moving average of the tick period with a world change observed at time at"""
+        if "grid" not in world:
+            return
+        tick = world.get("tick")
+        if self._last_tick_at is not None:
+            ticks = 1
+            if tick is not None and self._last_tick is not None:
+                ticks = max(tick - self._last_tick, 1)
+            elif self.tick_period:
+                # Without a tick counter, the ticks missed in between are estimated from the period so far
+                ticks = max(round((at - self._last_tick_at) / self.tick_period), 1)
+            period = (at - self._last_tick_at) / ticks
+            self.tick_period = period if self.tick_period is None else 0.8 * self.tick_period + 0.2 * period
+        self._last_tick_at = at
+        self._last_tick = tick
+
+    @staticmethod
+    def _world_advanced(seen, world):
+        if seen is None or "grid" not in world or "grid" not in seen:
+            return True
+        if "tick" in seen and "tick" in world:
+            return world["tick"] != seen["tick"]
+        # The server has no tick counter, the road map is static but cars and customers change
+        return world["cars"] != seen["cars"] or world["customers"] != seen["customers"]
+
     def reset(self):
         """Resets the state of the environment and returns an initial observation.
 
@@ -98,15 +282,25 @@ class JunctionEnvironment(gym.Env):
         #self.client.stop_game()
         #self.client.start_game()
 
-        world = self.client.get_world()
+        world = self._get_world()
         self._setup(world)
         if "grid" not in world:
             return None
 
-        obsers = {}
-        for car_id in self.car_ids:
-            obsers[car_id] = self.__process_observations(world, car_id)
-        return obsers
+        return self.observe(world)
+
+    def observe(self, world):
+        """Observations of all the team's cars in a world fetched elsewhere, as a dict by car id"""
+        with self.encoder_lock:
+            observations = self._format(self.encoder.encode(world))
+        return {car_id: observations[i] for i, car_id in enumerate(self.car_ids)}
+
+    def _format(self, observations):
+        """Observations of all cars, out of the encoder buffer, in the configured form"""
+        if self.egocentric is None:
+            return observations.copy()
+        views, summaries = self.egocentric.crop(observations)
+        return [{"view": view, "summary": summary} for view, summary in zip(views, summaries)]
 
     def render(self, mode='human'):
         """Renders the environment.
@@ -163,56 +357,10 @@ class JunctionEnvironment(gym.Env):
     def _coordinates_to_index(self, x, y):
         return x + self.width * y
 
-    def __process_observations(self, obs, car_id):
-        map_space = np.array(obs["grid"]).reshape(self.height, self.width)
-        customers, distance, destinations = self.__process_customers(obs["customers"], car_id)
-        my_locations, my_avail_capacity = self.__process_myself(obs["cars"], car_id)
-        others_locations, others_avail_capacity = self.__process_others(obs["cars"], car_id)
-
-        obs = (map_space, customers, distance, destinations,
-               my_locations, my_avail_capacity, others_locations, others_avail_capacity)
-        obs = np.array(obs)
-        obs = np.moveaxis(obs, 0, 2)
-        return obs
-
-    def __process_customers(self, customers, car_id):
-        customer_matrix = np.zeros((self.height, self.width))
-        distance_matrix = np.zeros((self.height, self.width))
-        destination_matrix = np.zeros((self.height, self.width))
-
-        for customer in [c for c in customers.values() if c["status"] == "waiting"]:
-            origin_x, origin_y = self._index_to_coordinates(customer["origin"])
-            destination_x, destionation_y = self._index_to_coordinates(customer["destination"])
-
-            customer_matrix[origin_y, origin_x] = 1
-            distance_matrix[origin_y, origin_x] = cityblock((origin_x, origin_y), (destination_x, destionation_y))
-
-        for customer in [c for c in customers.values() if str(c["car_id"]) == str(car_id)]:
-            destination_x, destionation_y = self._index_to_coordinates(customer["destination"])
-            destination_matrix[destionation_y, destination_x] = 1
-
-        return customer_matrix, distance_matrix, destination_matrix
-
-    def __process_myself(self, cars, car_id):
-        car = [car for ind, car in cars.items() if str(ind) == car_id][0]
-
-        locations = np.zeros((self.height, self.width))
-        x, y = self._index_to_coordinates(car["position"])
-        locations[y, x] = 1
-        avail_capacity = np.full((self.height, self.width), car["capacity"] - car["used_capacity"])
-
-        return locations, avail_capacity
-
-    def __process_others(self, cars, car_id):
-        cars = [car for ind, car in cars.items() if str(ind) != car_id]
-
-        locations = np.zeros((self.height, self.width))
-        avail_capacity = np.zeros((self.height, self.width))
-        for car in cars:
-            x, y = self._index_to_coordinates(car["position"])
-            locations[y, x] = 1
-            avail_capacity[y, x] = car["capacity"] - car["used_capacity"]
-
-        return locations, avail_capacity
-
-        return self.__add_cars(cars)
+    def __process_observations(self, world, car_id):
+        # Runners share the env between threads, the encoder buffer is not theirs to keep
+        with self.encoder_lock:
+            if self.egocentric is not None:
+                return self._format(self.encoder.encode(world))[self.encoder.car_index[str(car_id)]]
+            self.encoder.encode(world)
+            return self.encoder.observation(car_id).copy()
@@ -0,0 +1,94 @@
+"""
+    Generates imitation learning data offline: games of the in-process city
+    simulator are played by the A* expert of client_vm (Runner.megaalg) in a
+    pool of worker processes, and every (observation, action, score) record is
+    written straight into dataset shards.
+
+        python generate_dataset.py --games 1000 --workers 8
+
+    Game i is played with seed --seed + i into the shards expert_<seed>_*, so a
+    run can be reproduced or extended with more games: running a seed again
+    replaces its shards.
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from client import CarDirection
+from dataset import ShardWriter
+from obs_encoder import ObservationEncoder
+from simulator import CitySimulator
+
+DATASET_DIR = os.path.join("cache", "dataset", "imitation_learning")
+
+
+def play_game(seed, writer, size=100, n_cars=4, max_ticks=1000):
+    """Plays one simulated game with the expert, returns the number of records written"""
+    from client_vm import Runner
+
+    simulator = CitySimulator(size=size, n_cars=n_cars, max_ticks=max_ticks, seed=seed)
+    world = simulator.get_world()
+    car_ids = simulator.get_team_cars(world)
+    encoder = ObservationEncoder(size, size, car_ids, incremental=True)
+    runners = {car_id: Runner(car_id, seed, None, None) for car_id in car_ids}
+
+    records = 0
+    while "grid" in world:
+        observations = encoder.encode(world)
+        actions = {car_id: runners[car_id].megaalg(observations[i]) for i, car_id in enumerate(car_ids)}
+        simulator.move_cars({car_id: CarDirection(action) for car_id, action in actions.items() if action < 4})
+        simulator.tick()
+        world = simulator.get_world()
+        score = simulator.get_score()
+        for i, car_id in enumerate(car_ids):
+            writer.append(observations[i], actions[car_id], score)
+        records += len(car_ids)
+    return records
+
+
+def play_games(seeds, directory, shard_size, size, n_cars, max_ticks):
+    """Worker task: a few games, each written into shards of its own"""
+    records = 0
+    for seed in seeds:
+        # Padded to the 100x100 input of the models, or to larger maps
+        with ShardWriter(directory, shard_size, prefix=f"expert_{seed:07d}", observation_size=max(size, 100),
+                         overwrite=True) as writer:
+            records += play_game(seed, writer, size, n_cars, max_ticks)
+    return len(seeds), records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate expert trajectories into dataset shards")
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first game")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--games-per-task', type=int, default=4)
+    parser.add_argument('--output', type=str, default=DATASET_DIR)
+    parser.add_argument('--shard-size', type=int, default=1024)
+    parser.add_argument('--size', type=int, default=100)
+    parser.add_argument('--cars', type=int, default=4)
+    parser.add_argument('--ticks', type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    seeds = list(range(args.seed, args.seed + args.games))
+    tasks = [seeds[i:i + args.games_per_task] for i in range(0, len(seeds), args.games_per_task)]
+
+    started = time.time()
+    games = records = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(play_games, task, args.output, args.shard_size, args.size, args.cars, args.ticks)
+                   for task in tasks]
+        for future in as_completed(futures):
+            task_games, task_records = future.result()
+            games += task_games
+            records += task_records
+            elapsed = time.time() - started
+            logging.info(f'{games}/{args.games} games, {records} records, '
+                         f'{records / elapsed * 3600:.0f} records per hour')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import logging
+import queue
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from threading import Thread
+
+import numpy as np
+
+Request = namedtuple("Request", ["obs", "future", "submitted"])
+
+
+class InferenceService(Thread):
+    """
+        Runs one policy for the whole fleet with micro-batched forward passes.
+
+        Cars submit their observation and get a future of their action, or
+        act_many the observations of the whole fleet at once. The
+        service thread takes the first waiting observation, collects more until
+        expected observations (e.g. the number of cars, one tick's worth) or
+        max_batch are there or window seconds have passed, and runs a single
+        predict(batch) for all of them. The action of each car is the argmax of
+        its row of the output.
+
+        predict is e.g. model.predict_on_batch of a Keras model, which then is
+        only ever called from the service thread; preprocess, if given, maps the
+        stacked (B, H, W, 8) observations to the model input.
+    """
+
+    def __init__(self, predict, max_batch=32, window=0.005, expected=None, preprocess=None):
+        super().__init__(daemon=True)
+        self.predict = predict
+        self.max_batch = max_batch
+        self.window = window
+        self.expected = expected
+        self.preprocess = preprocess
+
+        self.requests = queue.Queue()
+        self.running = True
+        self.buffer = None
+
+        self.batches = 0
+        self.served = 0
+        self.batch_sizes = deque(maxlen=10000)
+        self.latencies = deque(maxlen=10000)
+        self.inference_times = deque(maxlen=10000)
+
+    def submit(self, obs):
+        future = Future()
+        self.requests.put(Request(obs, future, time.monotonic()))
+        return future
+
+    def act(self, obs, timeout=None):
+        """Action for obs, blocking until its batch has been run"""
+        return self.submit(obs).result(timeout)
+
+    def act_many(self, observations, timeout=None):
+        """
+            Actions for several observations, e.g. those of all the cars of a
+            tick: all of them are submitted before waiting, so they share a batch
+        """
+        futures = [self.submit(obs) for obs in observations]
+        return [future.result(timeout) for future in futures]
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            try:
+                first = self.requests.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self._run_batch(self._collect(first))
+
+    def _collect(self, first):
+        batch = [first]
+        wanted = min(self.expected or self.max_batch, self.max_batch)
+        deadline = first.submitted + self.window
+        while len(batch) < wanted:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Whatever else is already waiting goes along
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, batch):
+        size = len(batch)
+        started = time.monotonic()
+        try:
+            first = np.asarray(batch[0].obs)
+            # Reallocated whenever the observations change shape, e.g. on a new map
+            if self.buffer is None or self.buffer.shape[1:] != first.shape or self.buffer.dtype != first.dtype:
+                self.buffer = np.zeros((self.max_batch,) + first.shape, dtype=first.dtype)
+            for i, request in enumerate(batch):
+                self.buffer[i] = request.obs
+            inputs = self.buffer[:size]
+            if self.preprocess is not None:
+                inputs = self.preprocess(inputs)
+            actions = np.asarray(self.predict(inputs)).reshape(size, -1).argmax(axis=1)
+        except Exception as ex:
+            logging.warning(f'Batched inference failed: {ex}')
+            for request in batch:
+                request.future.set_exception(ex)
+            return
+        finished = time.monotonic()
+
+        for request, action in zip(batch, actions):
+            request.future.set_result(int(action))
+            self.latencies.append(finished - request.submitted)
+        self.inference_times.append(finished - started)
+        self.batch_sizes.append(size)
+        self.batches += 1
+        self.served += size
+
+    def stats(self):
+        """Batch sizes, request latencies (submit to action) and forward pass times, in seconds"""
+        if not self.batches:
+            return {"requests": 0, "batches": 0}
+        latencies = np.array(self.latencies)
+        return {
+            "requests": self.served,
+            "batches": self.batches,
+            "mean_batch_size": float(np.mean(self.batch_sizes)),
+            "latency_p50": float(np.percentile(latencies, 50)),
+            "latency_p95": float(np.percentile(latencies, 95)),
+            "inference_mean": float(np.mean(self.inference_times)),
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        if not stats["batches"]:
+            return
+        logging.info(f'Inference: {stats["requests"]} requests in {stats["batches"]} batches '
+                     f'(mean size {stats["mean_batch_size"]:.1f}), latency p50 {stats["latency_p50"] * 1e3:.1f} ms '
+                     f'p95 {stats["latency_p95"] * 1e3:.1f} ms, forward pass {stats["inference_mean"] * 1e3:.1f} ms')
@@ -0,0 +1,219 @@
+"""
+    Keras-free inference for the trained policies: export_model writes the
+    layers and weights of a Keras model (create_model_1 of dqn_fastcity or the
+    res-block model of the imitation learning notebook) into one .npz file,
+    NumpyPolicy runs its forward pass with NumPy alone, so a car agent starts
+    without importing TensorFlow.
+
+        python numpy_policy.py checkpoints/supervised/model.h5 checkpoints/policy.npz
+
+    Supported layers: InputLayer, Conv2D, Dense, BatchNormalization, Activation,
+    Softmax, MaxPooling2D, Dropout, Flatten and Add, channels last.
+"""
+import argparse
+import json
+
+import numpy as np
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "elu": lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0))),
+    "tanh": np.tanh,
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "softmax": lambda x: _softmax(x),
+}
+
+# Layer config entries the forward pass needs, by layer class
+CONFIG_KEYS = {
+    "Conv2D": ["strides", "padding", "activation", "use_bias", "dilation_rate", "data_format"],
+    "Dense": ["activation", "use_bias"],
+    "BatchNormalization": ["epsilon", "center", "scale", "axis"],
+    "Activation": ["activation"],
+    "Softmax": ["axis"],
+    "MaxPooling2D": ["pool_size", "strides", "padding", "data_format"],
+    "Dropout": [],
+    "Flatten": [],
+    "Add": [],
+}
+
+
+def _softmax(x, axis=-1):
+    e = np.exp(x - x.max(axis=axis, keepdims=True))
+    return e / e.sum(axis=axis, keepdims=True)
+
+
+def _layer_inputs(layer, previous):
+    """Names of the layers feeding layer, previous for a layer without graph information"""
+    try:
+        tensors = layer.input if isinstance(layer.input, (list, tuple)) else [layer.input]
+    except (AttributeError, ValueError):
+        return [previous]
+    names = []
+    for tensor in tensors:
+        history = tensor._keras_history
+        source = getattr(history, "operation", None) or getattr(history, "layer", None) or history[0]
+        names.append(source.name)
+    return names
+
+
+def export_model(model, path):
+    """Writes the graph and weights of the Keras model to the .npz file at path"""
+    layers, arrays = [], {}
+    names = set()
+    previous = "input"
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind == "InputLayer":
+            continue
+        if kind not in CONFIG_KEYS:
+            raise ValueError(f'Layer {layer.name} of type {kind} is not supported')
+        config = layer.get_config()
+        if config.get("data_format", "channels_last") != "channels_last":
+            raise ValueError(f'Layer {layer.name} is not channels last')
+        inputs = [name if name in names else "input" for name in _layer_inputs(layer, previous)]
+
+        weights = layer.get_weights()
+        for i, weight in enumerate(weights):
+            arrays[f"{layer.name}/{i}"] = weight
+        layers.append({"name": layer.name, "class": kind, "inputs": inputs, "weights": len(weights),
+                       "config": {key: config[key] for key in CONFIG_KEYS[kind] if key in config}})
+        names.add(layer.name)
+        previous = layer.name
+
+    input_shape = [dim for dim in model.input_shape[1:]]
+    graph = {"layers": layers, "input_shape": input_shape, "output": previous}
+    np.savez(path, graph=np.array(json.dumps(graph)), **arrays)
+
+
+class NumpyPolicy:
+    """
+        Forward pass of a model exported with export_model, in float32 NumPy.
+        predict maps a (B, H, W, C) batch to the (B, n_actions) output of the
+        model and is also available as predict_on_batch, so it can stand in for
+        the Keras model, e.g. in an inference_service.InferenceService.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            graph = json.loads(str(data["graph"]))
+            self.layers = []
+            for layer in graph["layers"]:
+                weights = [data[f'{layer["name"]}/{i}'].astype(np.float32) for i in range(layer["weights"])]
+                self.layers.append((layer["name"], layer["inputs"], self._build(layer, weights)))
+        self.input_shape = tuple(graph["input_shape"])
+        self.output = graph["output"]
+
+    def predict(self, batch):
+        outputs = {"input": np.asarray(batch, dtype=np.float32)}
+        for name, inputs, forward in self.layers:
+            outputs[name] = forward(*[outputs[source] for source in inputs])
+        return outputs[self.output]
+
+    predict_on_batch = predict
+
+    def act(self, obs):
+        return int(self.predict(obs[np.newaxis])[0].argmax())
+
+    def _build(self, layer, weights):
+        """The forward function of one layer, with its weights bound"""
+        kind, config = layer["class"], layer["config"]
+        if kind == "Conv2D":
+            kernel = weights[0]
+            bias = weights[1] if config.get("use_bias", True) else None
+            if tuple(config.get("dilation_rate", (1, 1))) != (1, 1):
+                raise ValueError(f'Layer {layer["name"]}: dilated convolutions are not supported')
+            activation = ACTIVATIONS[config.get("activation", "linear")]
+            strides, padding = tuple(config["strides"]), config["padding"]
+            return lambda x: activation(_conv2d(x, kernel, bias, strides, padding))
+        if kind == "Dense":
+            kernel = weights[0]
+            bias = weights[1] if config.get("use_bias", True) else 0
+            activation = ACTIVATIONS[config.get("activation", "linear")]
+            return lambda x: activation(x @ kernel + bias)
+        if kind == "BatchNormalization":
+            # Inference mode only: folded into one scale and shift per channel
+            weights = list(weights)
+            gamma = weights.pop(0) if config.get("scale", True) else 1
+            beta = weights.pop(0) if config.get("center", True) else 0
+            mean, variance = weights
+            scale = gamma / np.sqrt(variance + config.get("epsilon", 1e-3))
+            shift = beta - mean * scale
+            return lambda x: x * scale + shift
+        if kind == "Activation":
+            return ACTIVATIONS[config["activation"]]
+        if kind == "Softmax":
+            axis = config.get("axis", -1)
+            return lambda x: _softmax(x, axis)
+        if kind == "MaxPooling2D":
+            pool_size = tuple(config["pool_size"])
+            strides = tuple(config.get("strides") or pool_size)
+            return lambda x: _max_pool(x, pool_size, strides, config.get("padding", "valid"))
+        if kind == "Dropout":
+            return lambda x: x
+        if kind == "Flatten":
+            return lambda x: x.reshape(len(x), -1)
+        if kind == "Add":
+            return lambda *xs: sum(xs[1:], xs[0])
+        raise ValueError(f'Layer {layer["name"]} of type {kind} is not supported')
+
+
+def _same_padding(size, kernel, stride):
+    """(before, after) padding of TensorFlow's "same" along one axis"""
+    out = -(-size // stride)
+    total = max((out - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+
+def _conv2d(x, kernel, bias, strides, padding):
+    kernel_height, kernel_width, _, filters = kernel.shape
+    stride_rows, stride_columns = strides
+    if padding == "same":
+        x = np.pad(x, ((0, 0), _same_padding(x.shape[1], kernel_height, stride_rows),
+                       _same_padding(x.shape[2], kernel_width, stride_columns), (0, 0)))
+    batch, height, width, _ = x.shape
+    out_height = (height - kernel_height) // stride_rows + 1
+    out_width = (width - kernel_width) // stride_columns + 1
+
+    # One (B * H' * W', C) x (C, F) product per kernel offset instead of an im2col copy of every window
+    out = np.zeros((batch, out_height, out_width, filters), dtype=np.float32)
+    for i in range(kernel_height):
+        for j in range(kernel_width):
+            window = x[:, i:i + stride_rows * (out_height - 1) + 1:stride_rows,
+                       j:j + stride_columns * (out_width - 1) + 1:stride_columns]
+            out += window @ kernel[i, j]
+    if bias is not None:
+        out += bias
+    return out
+
+
+def _max_pool(x, pool_size, strides, padding):
+    pool_rows, pool_columns = pool_size
+    stride_rows, stride_columns = strides
+    if padding == "same":
+        x = np.pad(x, ((0, 0), _same_padding(x.shape[1], pool_rows, stride_rows),
+                       _same_padding(x.shape[2], pool_columns, stride_columns), (0, 0)), constant_values=-np.inf)
+    _, height, width, _ = x.shape
+    out_height = (height - pool_rows) // stride_rows + 1
+    out_width = (width - pool_columns) // stride_columns + 1
+    out = None
+    for i in range(pool_rows):
+        for j in range(pool_columns):
+            window = x[:, i:i + stride_rows * (out_height - 1) + 1:stride_rows,
+                       j:j + stride_columns * (out_width - 1) + 1:stride_columns]
+            out = window.copy() if out is None else np.maximum(out, window)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a saved Keras policy for NumpyPolicy")
+    parser.add_argument('model', help="Keras model file, e.g. a checkpoint saved with model.save")
+    parser.add_argument('output', help=".npz file to write")
+    args = parser.parse_args()
+
+    from keras.models import load_model
+    export_model(load_model(args.model, compile=False), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import numpy as np
+
+
+def center_pad_observations(obs, receptor_size=100):
+    """
+        Zero-pads the maps of (..., H, W, 8) observations, one or a batch, to
+        receptor_size x receptor_size with the map in the centre, the fixed
+        input size of the models
+    """
+    height, width = obs.shape[-3:-1]
+    rows, columns = receptor_size - height, receptor_size - width
+    if rows < 0 or columns < 0:
+        raise ValueError(f'{height}x{width} map does not fit into {receptor_size}x{receptor_size}')
+    npads = [(0, 0)] * (obs.ndim - 3) + [(rows // 2, rows - rows // 2), (columns // 2, columns - columns // 2), (0, 0)]
+    return np.pad(obs, pad_width=npads, mode='constant', constant_values=0)
+
+
+class ObservationEncoder:
+    """
+        Encodes a world into the (H, W, 8) observations of all the team's cars at
+        once, in the channel layout of env.JunctionEnvironment:
+
+            0 road map, 1 waiting customers, 2 their Manhattan distance to their
+            destination (clipped at 255), 3 destinations of the car's customers,
+            4 the car, 5 its free capacity, 6 the other cars, 7 their free capacity
+
+        Where several customers or cars share a cell, channels 2 and 7 hold the
+        largest value.
+
+        The world is parsed once per call and customers and cars are scattered
+        with fancy indexing into one preallocated uint8 buffer of shape
+        (n_cars, H, W, 8). The buffer is overwritten by the next call, copy the
+        observations to keep them around.
+
+        With incremental, the road map is written once per map and every call
+        diffs the world against the previous one and only rewrites the cells of
+        the customers and cars that changed, so the cost follows the number of
+        changes rather than the map area (except for channel 5, which is
+        refilled for a car whose free capacity changed).
+    """
+
+    def __init__(self, height, width, car_ids, incremental=False):
+        self.height = height
+        self.width = width
+        self.car_ids = [str(car_id) for car_id in car_ids]
+        self.car_index = {car_id: i for i, car_id in enumerate(self.car_ids)}
+        self.incremental = incremental
+
+        self.buffer = np.zeros((len(self.car_ids), height, width, 8), dtype=np.uint8)
+        # Cells are indexed like the world: index = row * width + column
+        self.cells = self.buffer.reshape(len(self.car_ids), height * width, 8)
+
+        # State of the last world encoded incrementally
+        self._grid = None
+        self._customers = {}
+        self._cars = {}
+        self._waiting_at = {}
+        self._carried_to = [{} for _ in self.car_ids]
+        self._cars_at = {}
+
+    def encode(self, world):
+        if self.incremental:
+            return self._encode_incremental(world)
+
+        cells = self.cells
+        cells[:, :, 0] = world["grid"]
+        cells[:, :, 1:] = 0
+
+        origins, destinations, carried_by, carried_to = [], [], [], []
+        for customer in world["customers"].values():
+            if customer["status"] == "waiting":
+                origins.append(customer["origin"])
+                destinations.append(customer["destination"])
+            index = self.car_index.get(str(customer["car_id"]))
+            if index is not None:
+                carried_by.append(index)
+                carried_to.append(customer["destination"])
+
+        if origins:
+            distances = np.minimum(self._distances(np.array(origins), np.array(destinations)), 255)
+            # The last write wins on shared cells, so write in increasing order
+            order = np.argsort(distances, kind="stable")
+            origins = np.array(origins)[order]
+            cells[:, origins, 1] = 1
+            cells[:, origins, 2] = distances[order]
+        if carried_by:
+            cells[carried_by, carried_to, 3] = 1
+
+        car_ids, positions, free = [], [], []
+        for car_id, car in world["cars"].items():
+            car_ids.append(str(car_id))
+            positions.append(car["position"])
+            free.append(car["capacity"] - car["used_capacity"])
+        positions = np.array(positions, dtype=np.int64)
+        free = np.clip(np.array(free, dtype=np.int64), 0, 255)
+
+        ours = np.array([self.car_index[car_id] for car_id in self.car_ids if car_id in car_ids], dtype=np.int64)
+        slots = np.array([car_ids.index(car_id) for car_id in self.car_ids if car_id in car_ids], dtype=np.int64)
+        cells[ours, positions[slots], 4] = 1
+        cells[ours, :, 5] = free[slots, np.newaxis]
+
+        # Every other car, of any team, as seen from each of the team's cars
+        observer, other = np.nonzero(slots[:, np.newaxis] != np.arange(len(car_ids)))
+        order = np.argsort(free[other], kind="stable")
+        observer, other = observer[order], other[order]
+        cells[ours[observer], positions[other], 6] = 1
+        cells[ours[observer], positions[other], 7] = free[other]
+        return self.buffer
+
+    def observation(self, car_id):
+        """Observation of car_id in the buffer, valid until the next encode"""
+        return self.buffer[self.car_index[str(car_id)]]
+
+    def _distances(self, origins, destinations):
+        origin_rows, origin_columns = np.divmod(origins, self.width)
+        destination_rows, destination_columns = np.divmod(destinations, self.width)
+        return np.abs(origin_rows - destination_rows) + np.abs(origin_columns - destination_columns)
+
+    def _grid_changed(self, grid):
+        if grid is self._grid:
+            return False
+        if self._grid is None:
+            return True
+        if isinstance(grid, np.ndarray) or isinstance(self._grid, np.ndarray):
+            return not np.array_equal(grid, self._grid)
+        return grid != self._grid
+
+    def _reset(self, grid):
+        """Starts over on a new map: static channel written, everything else empty"""
+        self._grid = grid
+        self.cells[:] = 0
+        self.cells[:, :, 0] = grid
+        self._customers = {}
+        self._cars = {}
+        self._waiting_at = {}
+        self._carried_to = [{} for _ in self.car_ids]
+        self._cars_at = {}
+
+    def _encode_incremental(self, world):
+        if self._grid_changed(world["grid"]):
+            self._reset(world["grid"])
+        else:
+            # Snapshots of the same map may come with a fresh copy of the grid
+            self._grid = world["grid"]
+
+        customers = {}
+        for customer_id, customer in world["customers"].items():
+            customers[customer_id] = (customer["status"] == "waiting", customer["origin"], customer["destination"],
+                                      self.car_index.get(str(customer["car_id"])))
+        cars = {}
+        for car_id, car in world["cars"].items():
+            cars[str(car_id)] = (car["position"], min(max(car["capacity"] - car["used_capacity"], 0), 255))
+
+        customer_cells, carried_cells = set(), set()
+        for customer_id in self._customers.keys() | customers.keys():
+            old, new = self._customers.get(customer_id), customers.get(customer_id)
+            if old == new:
+                continue
+            if old is not None:
+                self._remove_customer(customer_id, old, customer_cells, carried_cells)
+            if new is not None:
+                self._add_customer(customer_id, new, customer_cells, carried_cells)
+
+        car_cells, refills = set(), set()
+        for car_id in self._cars.keys() | cars.keys():
+            old, new = self._cars.get(car_id), cars.get(car_id)
+            if old == new:
+                continue
+            if old is not None:
+                del self._cars_at[old[0]][car_id]
+                car_cells.add(old[0])
+            if new is not None:
+                self._cars_at.setdefault(new[0], {})[car_id] = new[1]
+                car_cells.add(new[0])
+            if car_id in self.car_index and (old is None or new is None or old[1] != new[1]):
+                refills.add(car_id)
+
+        self._customers = customers
+        self._cars = cars
+        self._patch(customer_cells, carried_cells, car_cells, refills)
+        return self.buffer
+
+    def _remove_customer(self, customer_id, customer, customer_cells, carried_cells):
+        waiting, origin, destination, carrier = customer
+        if waiting:
+            del self._waiting_at[origin][customer_id]
+            customer_cells.add(origin)
+        if carrier is not None:
+            self._carried_to[carrier][destination] -= 1
+            carried_cells.add((carrier, destination))
+
+    def _add_customer(self, customer_id, customer, customer_cells, carried_cells):
+        waiting, origin, destination, carrier = customer
+        if waiting:
+            distance = int(self._distances(origin, destination))
+            self._waiting_at.setdefault(origin, {})[customer_id] = min(distance, 255)
+            customer_cells.add(origin)
+        if carrier is not None:
+            carried = self._carried_to[carrier]
+            carried[destination] = carried.get(destination, 0) + 1
+            carried_cells.add((carrier, destination))
+
+    def _patch(self, customer_cells, carried_cells, car_cells, refills):
+        cells = self.cells
+        for cell in customer_cells:
+            waiting = self._waiting_at.get(cell)
+            cells[:, cell, 1] = 1 if waiting else 0
+            cells[:, cell, 2] = max(waiting.values()) if waiting else 0
+
+        for carrier, cell in carried_cells:
+            cells[carrier, cell, 3] = 1 if self._carried_to[carrier].get(cell) else 0
+
+        for cell in car_cells:
+            here = self._cars_at.get(cell, {})
+            for i, car_id in enumerate(self.car_ids):
+                others = [free for other_id, free in here.items() if other_id != car_id]
+                cells[i, cell, 4] = 1 if car_id in here else 0
+                cells[i, cell, 6] = 1 if others else 0
+                cells[i, cell, 7] = max(others) if others else 0
+
+        for car_id in refills:
+            car = self._cars.get(car_id)
+            cells[self.car_index[car_id], :, 5] = car[1] if car is not None else 0
+
+
+# Features of EgocentricView.summary
+SUMMARY_FEATURES = (
+    "free_capacity", "waiting", "destinations",
+    # Counts in the directions of the actions: north (row + 1), east (column + 1), south, west
+    "waiting_north", "waiting_east", "waiting_south", "waiting_west",
+    "destinations_north", "destinations_east", "destinations_south", "destinations_west",
+    # Offsets to the closest ones, in map sizes
+    "nearest_waiting_row", "nearest_waiting_column", "nearest_destination_row", "nearest_destination_column",
+    # Position of the car, in map sizes
+    "row", "column",
+)
+
+
+class EgocentricView:
+    """
+        Map-size independent form of the observations: a crop_size x crop_size
+        window of the (H, W, 8) observation centred on the car (cells beyond the
+        map edge are zero, i.e. not road) and a float32 vector of global
+        SUMMARY_FEATURES about waiting customers and destinations out of view.
+    """
+
+    def __init__(self, crop_size=21):
+        self.crop_size = crop_size
+        self.radius = crop_size // 2
+        self.padded = None
+
+    def crop(self, observations):
+        """(views, summaries) of shapes (n, crop_size, crop_size, 8) and (n, len(SUMMARY_FEATURES))"""
+        n, height, width, channels = observations.shape
+        radius, size = self.radius, self.crop_size
+        if self.padded is None or self.padded.shape != (n, height + 2 * radius, width + 2 * radius, channels):
+            self.padded = np.zeros((n, height + 2 * radius, width + 2 * radius, channels), dtype=observations.dtype)
+        self.padded[:, radius:radius + height, radius:radius + width] = observations
+
+        rows, columns = np.divmod(observations[:, :, :, 4].reshape(n, -1).argmax(axis=1), width)
+        views = np.empty((n, size, size, channels), dtype=observations.dtype)
+        summaries = np.zeros((n, len(SUMMARY_FEATURES)), dtype=np.float32)
+        waiting_rows, waiting_columns = np.nonzero(observations[0, :, :, 1])
+        for i in range(n):
+            # The window of the padded map starting at the car's cell is centred on it
+            views[i] = self.padded[i, rows[i]:rows[i] + size, columns[i]:columns[i] + size]
+            destination_rows, destination_columns = np.nonzero(observations[i, :, :, 3])
+            summaries[i, 0] = observations[i, 0, 0, 5]
+            summaries[i, 1] = len(waiting_rows)
+            summaries[i, 2] = len(destination_rows)
+            summaries[i, 3:7], summaries[i, 11:13] = self._directions(
+                waiting_rows - rows[i], waiting_columns - columns[i], height, width)
+            summaries[i, 7:11], summaries[i, 13:15] = self._directions(
+                destination_rows - rows[i], destination_columns - columns[i], height, width)
+            summaries[i, 15:17] = rows[i] / height, columns[i] / width
+        return views, summaries
+
+    @staticmethod
+    def _directions(row_offsets, column_offsets, height, width):
+        """Counts per action direction and the offset to the closest one"""
+        counts = ((row_offsets > 0).sum(), (column_offsets > 0).sum(), (row_offsets < 0).sum(),
+                  (column_offsets < 0).sum())
+        if len(row_offsets) == 0:
+            return counts, (0, 0)
+        nearest = np.argmin(np.abs(row_offsets) + np.abs(column_offsets))
+        return counts, (row_offsets[nearest] / height, column_offsets[nearest] / width)
@@ -0,0 +1,221 @@
+import logging
+import os
+
+import numpy as np
+from rl.memory import Experience, Memory
+
+from sparse_obs import capacity_extent, fill_observations, observation_entities
+
+
+class CompactMemory(Memory):
+    """
+        Drop-in replacement of keras-rl's SequentialMemory for the (H, W, 8)
+        observations of env.JunctionEnvironment.
+
+        Transitions live in preallocated ring buffers: observations as uint8
+        instead of Python objects, or with sparse in the form of sparse_obs
+        (road map packed to bits, entities padded to max_entities per step),
+        which takes a few kB per step instead of H * W * 8 bytes. With path
+        the buffers are memory-mapped .npy files in that directory, so the
+        memory can be larger than the RAM and is picked up again on restart.
+
+        The buffers are preallocated for limit steps of observation_shape,
+        observations of other shapes are rejected, pad them first (e.g. with
+        obs_encoder.center_pad_observations). Sparse, with the default
+        max_entities, a step takes about 2.8 kB, so a memory of 1M steps
+        creates about 2.8 GB of files right away; dense, a step takes H * W * 8
+        bytes (80 kB for 100x100).
+
+        Minibatches are sampled like SequentialMemory does (same windows and
+        episode boundaries), but gathered with vectorized indexing;
+        sample_arrays returns them as stacked arrays.
+
+        With summary_size, observations are the egocentric dicts of
+        JunctionEnvironment(crop_size=...): the "view" is stored like a map of
+        observation_shape and the float32 "summary" vector next to it.
+    """
+
+    def __init__(self, limit, observation_shape, path=None, sparse=False, max_entities=256, seed=None,
+                 summary_size=0, **kwargs):
+        super().__init__(**kwargs)
+        self.limit = limit
+        self.observation_shape = tuple(observation_shape)
+        self.path = path
+        self.sparse = sparse
+        self.max_entities = max_entities
+        self.summary_size = summary_size
+        self.rng = np.random.default_rng(seed)
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        height, width = self.observation_shape[:2]
+        if sparse:
+            self.grids = self._buffer("grids", (limit, (height * width + 7) // 8), np.uint8)
+            self.capacities = self._buffer("capacities", (limit,), np.uint8)
+            # Cells the capacity fills, less than the map in padded observations
+            self.extents = self._buffer("extents", (limit, 4), np.int16)
+            self.entity_counts = self._buffer("entity_counts", (limit,), np.int16)
+            self.entity_cells = self._buffer("entity_cells", (limit, max_entities), np.int32)
+            self.kinds = self._buffer("kinds", (limit, max_entities), np.uint8)
+            self.values = self._buffer("values", (limit, max_entities), np.uint8)
+        else:
+            self.observations = self._buffer("observations", (limit,) + self.observation_shape, np.uint8)
+        if summary_size:
+            self.summaries = self._buffer("summaries", (limit, summary_size), np.float32)
+        self.actions = self._buffer("actions", (limit,), np.int32)
+        self.rewards = self._buffer("rewards", (limit,), np.float32)
+        self.terminals = self._buffer("terminals", (limit,), np.bool_)
+        # Next slot to write and number of entries, persisted along with the buffers
+        self.state = self._buffer("state", (2,), np.int64)
+
+    def _buffer(self, name, shape, dtype):
+        if self.path is None:
+            return np.zeros(shape, dtype=dtype)
+        filename = os.path.join(self.path, f"{name}.npy")
+        if os.path.exists(filename):
+            array = np.load(filename, mmap_mode="r+")
+            if array.shape == shape and array.dtype == dtype:
+                return array
+            logging.warning(f'Replay memory file {filename} does not match the memory, starting over')
+            del array
+        return np.lib.format.open_memmap(filename, mode="w+", dtype=dtype, shape=shape)
+
+    @property
+    def nb_entries(self):
+        return int(self.state[1])
+
+    def append(self, observation, action, reward, terminal, training=True):
+        super().append(observation, action, reward, terminal, training=training)
+        if not training:
+            return
+
+        summary = None
+        if self.summary_size:
+            observation, summary = observation["view"], observation["summary"]
+        if np.shape(observation) != self.observation_shape:
+            raise ValueError(f'Observation of shape {np.shape(observation)} in a memory of {self.observation_shape} '
+                             'observations')
+        slot = int(self.state[0])
+        if self.sparse:
+            self._write_sparse(slot, np.asarray(observation))
+        else:
+            self.observations[slot] = observation
+        if summary is not None:
+            self.summaries[slot] = summary
+        self.actions[slot] = action
+        self.rewards[slot] = reward
+        self.terminals[slot] = terminal
+        self.state[0] = (slot + 1) % self.limit
+        self.state[1] = min(self.state[1] + 1, self.limit)
+
+    def _write_sparse(self, slot, obs):
+        cells, kinds, values = observation_entities(obs)
+        if len(cells) > self.max_entities:
+            logging.warning(f'{len(cells)} entities in an observation, only {self.max_entities} are kept')
+            cells, kinds, values = cells[:self.max_entities], kinds[:self.max_entities], values[:self.max_entities]
+        count = len(cells)
+        self.grids[slot] = np.packbits(obs[:, :, 0].ravel() > 0)
+        self.capacities[slot], self.extents[slot] = capacity_extent(obs)
+        self.entity_counts[slot] = count
+        self.entity_cells[slot, :count] = cells
+        self.kinds[slot, :count] = kinds
+        self.values[slot, :count] = values
+
+    def _slots(self, indices):
+        """Ring buffer slots of entries numbered from the oldest one"""
+        oldest = (int(self.state[0]) - self.nb_entries) % self.limit
+        return (oldest + indices) % self.limit
+
+    def _observations(self, slots):
+        """Dense uint8 observations stored in slots, of any shape"""
+        if not self.sparse:
+            return self.observations[slots]
+
+        flat_slots = slots.ravel()
+        batch = len(flat_slots)
+        height, width, channels = self.observation_shape
+        out = np.zeros((batch, height * width, channels), dtype=np.uint8)
+        present = np.arange(self.max_entities) < self.entity_counts[flat_slots, np.newaxis]
+        fill_observations(out, width, np.unpackbits(self.grids[flat_slots], axis=1, count=height * width),
+                          self.capacities[flat_slots], self.extents[flat_slots], np.nonzero(present)[0],
+                          self.entity_cells[flat_slots][present], self.kinds[flat_slots][present],
+                          self.values[flat_slots][present])
+        return out.reshape(slots.shape + self.observation_shape)
+
+    def sample_arrays(self, batch_size, batch_idxs=None):
+        """
+            Minibatch as arrays: state0 and state1 of shape (B, window_length,
+            H, W, 8), actions, rewards and terminal1 of shape (B,). With
+            summary_size, state0 and state1 are (views, summaries) pairs, the
+            summaries of shape (B, window_length, summary_size).
+        """
+        entries, window = self.nb_entries, self.window_length
+        assert entries >= window + 2, 'not enough entries in the memory'
+        if batch_idxs is None:
+            indices = self.rng.integers(window, entries - 1, size=batch_size) + 1
+        else:
+            indices = np.asarray(batch_idxs, dtype=np.int64) + 1
+
+        # The first observation of an episode cannot start a transition
+        while True:
+            starting = self.terminals[self._slots(indices - 2)]
+            if not starting.any():
+                break
+            indices[starting] = self.rng.integers(window + 1, entries, size=starting.sum())
+
+        # Frames idx - window .. idx, older frames of the window dropped at an episode boundary
+        frames = indices[:, np.newaxis] + np.arange(-window, 1)
+        previous_terminal = self.terminals[self._slots(np.maximum(frames - 1, 0))] & (frames - 1 >= 0)
+        valid = frames >= 0
+        if not self.ignore_episode_boundaries:
+            valid &= ~previous_terminal
+        keep0 = np.ones((len(indices), window), dtype=bool)
+        if window > 1:
+            # The newest frame of state0 always counts, older ones as long as no boundary is crossed
+            keep0[:, :-1] = np.logical_and.accumulate(valid[:, -3::-1], axis=1)[:, ::-1]
+        keep1 = np.ones_like(keep0)
+        keep1[:, :-1] = keep0[:, 1:]
+
+        observations = self._observations(self._slots(np.maximum(frames, 0)))
+        state0 = observations[:, :-1].copy()
+        state0[~keep0] = 0
+        state1 = observations[:, 1:].copy()
+        state1[~keep1] = 0
+        if self.summary_size:
+            summaries = self.summaries[self._slots(np.maximum(frames, 0))]
+            summaries0, summaries1 = summaries[:, :-1].copy(), summaries[:, 1:].copy()
+            summaries0[~keep0] = 0
+            summaries1[~keep1] = 0
+            state0, state1 = (state0, summaries0), (state1, summaries1)
+
+        slots = self._slots(indices - 1)
+        return state0, self.actions[slots], self.rewards[slots], state1, self.terminals[slots]
+
+    def sample(self, batch_size, batch_idxs=None):
+        state0, actions, rewards, state1, terminals = self.sample_arrays(batch_size, batch_idxs)
+        if self.summary_size:
+            # Back to the window of observation dicts of every experience
+            state0, state1 = (self._frames(*state) for state in (state0, state1))
+        return [Experience(state0=state0[i], action=actions[i], reward=rewards[i], state1=state1[i],
+                           terminal1=terminals[i]) for i in range(len(actions))]
+
+    @staticmethod
+    def _frames(views, summaries):
+        return [[{"view": view, "summary": summary} for view, summary in zip(*window)]
+                for window in zip(views, summaries)]
+
+    def flush(self):
+        """Writes memory-mapped buffers to disk"""
+        for array in vars(self).values():
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def get_config(self):
+        config = super().get_config()
+        config['limit'] = self.limit
+        config['observation_shape'] = self.observation_shape
+        config['path'] = self.path
+        config['sparse'] = self.sparse
+        config['max_entities'] = self.max_entities
+        config['summary_size'] = self.summary_size
+        return config
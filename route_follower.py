@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class RouteFollower:
+    """
+        Keeps the planned route of a car and advances along it between ticks.
+
+        A new route is only planned when the target changes, the car leaves the
+        route or a cell of the remaining route is no longer walkable, so cars that
+        are already on their way cost an array lookup per tick.
+    """
+
+    def __init__(self, find_path):
+        # find_path(maze, start, end) -> (path, status), e.g. alg_astar.search
+        self.find_path = find_path
+        self.target = None
+        self.route = None
+        self.rows = self.columns = None
+        self.index = 0
+        self.position = None
+        self.replans = 0
+
+    def clear(self):
+        self.target = None
+        self.route = None
+
+    def set_route(self, position, target, path):
+        """Starts following an already planned path (excluding position) to target"""
+        self.position = (int(position[0]), int(position[1]))
+        self.target = (int(target[0]), int(target[1]))
+        self.route = [(int(r), int(c)) for r, c in path]
+        self.rows = np.array([r for r, _ in self.route], dtype=np.int64)
+        self.columns = np.array([c for _, c in self.route], dtype=np.int64)
+        self.index = 0
+
+    def _plan(self, maze, position, target):
+        self.replans += 1
+        path, _ = self.find_path(maze, position, target)
+        if path is None:
+            self.clear()
+            return
+        self.set_route(position, target, path)
+
+    def _advance(self, position):
+        """Moves along the route, returns False if the car is off route"""
+        if position == self.position:
+            # The last move has not been applied (yet)
+            return True
+        if self.index < len(self.route) and position == self.route[self.index]:
+            self.index += 1
+            self.position = position
+            return True
+        return False
+
+    def _blocked(self, maze):
+        rows, columns = self.rows[self.index:], self.columns[self.index:]
+        return bool(np.any(maze[rows, columns] != 0))
+
+    def next_cell(self, maze, position, target):
+        """Next cell to move to on the way from position to target, None if there is no path or the car is there"""
+        position = (int(position[0]), int(position[1]))
+        target = (int(target[0]), int(target[1]))
+        if (self.route is None or target != self.target
+                or not self._advance(position) or self._blocked(maze)):
+            self._plan(maze, position, target)
+            if self.route is None:
+                return None
+        if self.index >= len(self.route):
+            return None
+        return self.route[self.index]
@@ -0,0 +1,242 @@
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from assignment import NO_PATH_COST, Dispatcher, index_to_cell, solve_assignment, waiting_customers
+from distance_oracle import UNREACHABLE, road_graph
+
+PICKUP = "pickup"
+DROPOFF = "dropoff"
+
+Stop = namedtuple("Stop", ["kind", "customer_id", "cell"])
+
+
+class RoutePlanner(Dispatcher):
+    """
+        Capacity-aware multi-stop routes for the whole fleet.
+
+        Every car keeps an ordered list of pickup and drop-off stops that never
+        exceeds its capacity. On each update the routes are synced with the world,
+        new waiting customers are inserted at their cheapest feasible positions
+        (matched to cars in batches with solve_assignment), and the routes that
+        changed are improved by relocating customers. The target of a car is the
+        first stop of its route.
+
+        Without an oracle, the distances from a cell to the whole map are
+        computed with SciPy's BFS, those of all the cars and stops of an update
+        in one batch, and kept for the last distance_cache_size cells.
+    """
+
+    def __init__(self, get_world, car_ids, maze, oracle=None, refresh_interval=0.3,
+                 candidates_per_car=10, improvement_passes=3, distance_cache_size=1024):
+        super().__init__(get_world, car_ids, maze, oracle, refresh_interval)
+        self.candidates_per_car = candidates_per_car
+        self.improvement_passes = improvement_passes
+        self.distance_cache_size = distance_cache_size
+
+        self.routes = {car_id: [] for car_id in self.car_ids}
+        self._graph = self._nodes = None
+        # start cell -> distances from it to every road node, least recently used first
+        self._fields = OrderedDict()
+
+    def distance(self, start, end):
+        """Road distance, NO_PATH_COST if there is no path"""
+        if self.oracle is not None:
+            dist = self.oracle.distance(start, end)
+            return NO_PATH_COST if dist is None else dist
+        start = (int(start[0]), int(start[1]))
+        if start not in self._fields:
+            self._sweep([start])
+        field = self._fields[start]
+        node = self._nodes[int(end[0]) * self.width + int(end[1])]
+        if field is None or node < 0 or field[node] == UNREACHABLE:
+            return NO_PATH_COST
+        return int(field[node])
+
+    def _sweep(self, cells):
+        """Distance fields from the cells that have none yet, in one batch, evicting the least recently used"""
+        from scipy.sparse.csgraph import shortest_path
+
+        if self._graph is None:
+            self._graph, self._nodes = road_graph(self.maze)
+        missing = []
+        for cell in dict.fromkeys(cells):
+            if cell in self._fields:
+                self._fields.move_to_end(cell)
+            else:
+                missing.append(cell)
+        sources = [cell for cell in missing if self._nodes[cell[0] * self.width + cell[1]] >= 0]
+        if sources:
+            indices = [self._nodes[row * self.width + column] for row, column in sources]
+            fields = shortest_path(self._graph, directed=False, unweighted=True, indices=indices)
+            fields[np.isinf(fields)] = UNREACHABLE
+            self._fields.update(zip(sources, fields.astype(np.uint16)))
+        # Walls have no distances
+        self._fields.update((cell, None) for cell in missing if cell not in self._fields)
+        while len(self._fields) > self.distance_cache_size:
+            self._fields.popitem(last=False)
+
+    def route_cost(self, start, route):
+        cells = [start] + [stop.cell for stop in route]
+        return sum(self.distance(a, b) for a, b in zip(cells, cells[1:]))
+
+    def best_insertion(self, start, load, capacity, route, customer_id, pickup, dropoff):
+        """
+            Cheapest feasible (added cost, new route) when inserting the customer into
+            the route, None if there is none. A pickup of None only inserts the drop-off.
+        """
+        cells = [start] + [stop.cell for stop in route]
+        legs = [self.distance(a, b) for a, b in zip(cells, cells[1:])]
+        loads = [load]
+        for stop in route:
+            loads.append(loads[-1] + (1 if stop.kind == PICKUP else -1))
+        to_dropoff = [self.distance(cell, dropoff) for cell in cells]
+        dropoff_stop = Stop(DROPOFF, customer_id, dropoff)
+
+        def dropoff_delta(j):
+            if j == len(route):
+                return to_dropoff[j]
+            return to_dropoff[j] + to_dropoff[j + 1] - legs[j]
+
+        best = None
+        if pickup is None:
+            for j in range(len(cells)):
+                delta = dropoff_delta(j)
+                if best is None or delta < best[0]:
+                    best = (delta, route[:j] + [dropoff_stop] + route[j:])
+            return best
+
+        to_pickup = [self.distance(cell, pickup) for cell in cells]
+        pickup_dropoff = self.distance(pickup, dropoff)
+        pickup_stop = Stop(PICKUP, customer_id, pickup)
+        for i in range(len(cells)):
+            if loads[i] + 1 > capacity:
+                continue
+            if i == len(route):
+                pickup_delta = to_pickup[i]
+            else:
+                pickup_delta = to_pickup[i] + to_pickup[i + 1] - legs[i]
+            # Drop-off straight after the pickup
+            if i == len(route):
+                delta = to_pickup[i] + pickup_dropoff
+            else:
+                delta = to_pickup[i] + pickup_dropoff + to_dropoff[i + 1] - legs[i]
+            if best is None or delta < best[0]:
+                best = (delta, route[:i] + [pickup_stop, dropoff_stop] + route[i:])
+            # Drop-off later, the customer then rides through stops i+1..j
+            for j in range(i + 1, len(cells)):
+                if loads[j] + 1 > capacity:
+                    break
+                delta = pickup_delta + dropoff_delta(j)
+                if best is None or delta < best[0]:
+                    best = (delta, route[:i] + [pickup_stop] + route[i:j] + [dropoff_stop] + route[j:])
+        if best is not None and best[0] >= NO_PATH_COST:
+            return None
+        return best
+
+    def improve(self, start, load, capacity, route):
+        """Relocates customers within the route while that makes it shorter"""
+        for _ in range(self.improvement_passes):
+            improved = False
+            for customer_id in list(dict.fromkeys(stop.customer_id for stop in route)):
+                stops = [stop for stop in route if stop.customer_id == customer_id]
+                pickup = next((stop.cell for stop in stops if stop.kind == PICKUP), None)
+                dropoff = next(stop.cell for stop in stops if stop.kind == DROPOFF)
+                rest = [stop for stop in route if stop.customer_id != customer_id]
+                best = self.best_insertion(start, load, capacity, rest, customer_id, pickup, dropoff)
+                if best is not None and self.route_cost(start, best[1]) < self.route_cost(start, route):
+                    route = best[1]
+                    improved = True
+            if not improved:
+                break
+        return route
+
+    def update(self, world):
+        if "grid" not in world:
+            self.targets = {}
+            return self.targets
+
+        waiting = waiting_customers(world)
+        cars = {car_id: world["cars"][car_id] for car_id in self.car_ids if car_id in world["cars"]}
+        if self.oracle is None:
+            # The cars moved, so every update needs the distances from their new cells, and
+            # from the stops they may be routed through
+            cells = [index_to_cell(car["position"], self.width) for car in cars.values()]
+            cells += [stop.cell for route in self.routes.values() for stop in route]
+            cells += [index_to_cell(customer["origin"], self.width) for customer in waiting.values()]
+            self._sweep(cells)
+        onboard = {}
+        for customer_id, customer in world["customers"].items():
+            if customer["status"] != "waiting" and str(customer["car_id"]) in cars:
+                onboard[customer_id] = str(customer["car_id"])
+
+        starts, loads, capacities, changed = {}, {}, {}, set()
+        for car_id, car in cars.items():
+            starts[car_id] = index_to_cell(car["position"], self.width)
+            loads[car_id] = car["used_capacity"]
+            capacities[car_id] = car["capacity"]
+
+            # Drop the stops that happened already or were taken by someone else
+            route = self.routes.get(car_id, [])
+            pending = {stop.customer_id for stop in route if stop.kind == PICKUP and stop.customer_id in waiting}
+            synced = [stop for stop in route
+                      if (stop.kind == PICKUP and stop.customer_id in pending)
+                      or (stop.kind == DROPOFF and (stop.customer_id in pending or onboard.get(stop.customer_id) == car_id))]
+            if len(synced) != len(route):
+                changed.add(car_id)
+
+            # Customers picked up outside of the plan still need to be dropped off
+            planned = {stop.customer_id for stop in synced}
+            for customer_id, holder in onboard.items():
+                if holder == car_id and customer_id not in planned:
+                    dropoff = index_to_cell(world["customers"][customer_id]["destination"], self.width)
+                    synced = self.best_insertion(starts[car_id], loads[car_id], capacities[car_id],
+                                                 synced, customer_id, None, dropoff)[1]
+                    changed.add(car_id)
+            self.routes[car_id] = synced
+
+        self._insert_waiting(world, waiting, starts, loads, capacities, changed)
+
+        for car_id in changed:
+            self.routes[car_id] = self.improve(starts[car_id], loads[car_id], capacities[car_id], self.routes[car_id])
+
+        self.targets = {car_id: route[0].cell for car_id, route in self.routes.items() if route}
+        self.updated_at = time.monotonic()
+        return self.targets
+
+    def _insert_waiting(self, world, waiting, starts, loads, capacities, changed):
+        """Batched cheapest insertion of the unplanned waiting customers"""
+        planned = {stop.customer_id for route in self.routes.values() for stop in route}
+        unplanned = [customer_id for customer_id in waiting if customer_id not in planned]
+        pickups = {customer_id: index_to_cell(waiting[customer_id]["origin"], self.width) for customer_id in unplanned}
+        dropoffs = {customer_id: index_to_cell(waiting[customer_id]["destination"], self.width) for customer_id in unplanned}
+
+        while unplanned:
+            # Cars only plan as many pickups as they have free seats right now
+            cars = [car_id for car_id in starts
+                    if loads[car_id] + sum(stop.kind == PICKUP for stop in self.routes[car_id]) < capacities[car_id]]
+            if not cars:
+                break
+
+            cost = np.full((len(cars), len(unplanned)), NO_PATH_COST)
+            insertions = {}
+            for i, car_id in enumerate(cars):
+                # Only the closest customers of every car are worth an insertion attempt
+                reach = np.array([self.distance(starts[car_id], pickups[customer_id]) for customer_id in unplanned])
+                for j in np.argsort(reach, kind="stable")[:self.candidates_per_car]:
+                    customer_id = unplanned[j]
+                    best = self.best_insertion(starts[car_id], loads[car_id], capacities[car_id], self.routes[car_id],
+                                               customer_id, pickups[customer_id], dropoffs[customer_id])
+                    if best is not None:
+                        cost[i, j] = best[0]
+                        insertions[i, j] = best[1]
+
+            pairs = solve_assignment(cost)
+            if not pairs:
+                break
+            for i, j in pairs:
+                self.routes[cars[i]] = insertions[i, j]
+                changed.add(cars[i])
+            assigned = {j for _, j in pairs}
+            unplanned = [customer_id for j, customer_id in enumerate(unplanned) if j not in assigned]
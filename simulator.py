@@ -0,0 +1,207 @@
+import logging
+
+import numpy as np
+from scipy import ndimage
+
+from alg_astar import ACTION_STEPS
+
+# Customer slot states
+FREE = 0
+WAITING = 1
+IN_CAR = 2
+
+STATUS_NAMES = {WAITING: "waiting", IN_CAR: "in_car"}
+
+
+def generate_grid(size, rng, min_block=2, max_block=5, closed_segments=0.1):
+    """
+        Random city map of size x size cells, 1 for road and 0 for buildings.
+        Roads run along randomly spaced rows and columns, a share of the road
+        segments between crossings is closed, and only the largest connected
+        road network is kept.
+    """
+    grid = np.zeros((size, size), dtype=np.uint8)
+    rows = np.cumsum(rng.integers(min_block, max_block + 1, size=size))
+    rows = rows[rows < size]
+    columns = np.cumsum(rng.integers(min_block, max_block + 1, size=size))
+    columns = columns[columns < size]
+    grid[rows, :] = 1
+    grid[:, columns] = 1
+
+    # Close random segments of the horizontal roads between two crossings
+    for row in rows:
+        for start, end in zip(columns[:-1], columns[1:]):
+            if rng.random() < closed_segments:
+                grid[row, start + 1:end] = 0
+
+    labels, n_labels = ndimage.label(grid)
+    if n_labels > 1:
+        largest = np.argmax(np.bincount(labels.ravel())[1:]) + 1
+        grid = (labels == largest).astype(np.uint8)
+    return grid
+
+
+class CitySimulator:
+    """
+        In-process stand-in for client.Client, simulating a game of the challenge
+        server. get_world returns the same world dict schema as the server and
+        JunctionEnvironment can use it as its client (with step_delay=0).
+
+        move_car only records the move of a car; the pending moves of all cars are
+        applied together on the next tick. The simulator has no clock of its own,
+        it advances by one tick per call of tick, which JunctionEnvironment makes
+        once per step whether cars move or stay. On every tick cars pick up waiting customers at
+        their cell while they have free capacity, drop off the customers whose
+        destination they reached (one point each) and a new customer spawns with
+        probability spawn_rate.
+    """
+
+    def __init__(self, size=100, n_cars=4, capacity=4, n_customers=20, max_customers=100,
+                 spawn_rate=0.1, max_ticks=1000, team_name="turing", seed=None):
+        self.size = size
+        self.n_cars = n_cars
+        self.capacity = capacity
+        self.n_customers = n_customers
+        self.max_customers = max_customers
+        self.spawn_rate = spawn_rate
+        self.max_ticks = max_ticks
+        self.team_name = team_name
+        self.team_id = "1"
+        self.rng = np.random.default_rng(seed)
+
+        self.grid = None
+        self.running = False
+        self.start_game()
+
+    def start_game(self):
+        """Starts a new game on a new map"""
+        self.grid = generate_grid(self.size, self.rng)
+        self.roads = np.flatnonzero(self.grid.ravel())
+
+        self.car_positions = self.rng.choice(self.roads, size=self.n_cars)
+        self.car_used = np.zeros(self.n_cars, dtype=np.int64)
+        self.pending_moves = np.full(self.n_cars, 4, dtype=np.int64)
+
+        self.customer_ids = np.full(self.max_customers, -1, dtype=np.int64)
+        self.customer_status = np.full(self.max_customers, FREE, dtype=np.int64)
+        self.customer_origin = np.zeros(self.max_customers, dtype=np.int64)
+        self.customer_destination = np.zeros(self.max_customers, dtype=np.int64)
+        self.customer_car = np.full(self.max_customers, -1, dtype=np.int64)
+        self.next_customer_id = 0
+
+        self.ticks = 0
+        self.score = 0
+        self.moves = 0
+        self.running = True
+        for _ in range(self.n_customers):
+            self.spawn_customer()
+        logging.info('Started game')
+
+    def stop_game(self):
+        self.running = False
+        logging.info("Stopped game")
+
+    def spawn_customer(self):
+        free = np.flatnonzero(self.customer_status == FREE)
+        if not len(free):
+            return
+        slot = free[0]
+        origin, destination = self.rng.choice(self.roads, size=2, replace=False)
+        self.customer_ids[slot] = self.next_customer_id
+        self.customer_status[slot] = WAITING
+        self.customer_origin[slot] = origin
+        self.customer_destination[slot] = destination
+        self.customer_car[slot] = -1
+        self.next_customer_id += 1
+
+    def move_car(self, car_id, direction):
+        self.pending_moves[int(car_id)] = direction.value
+
+    def move_cars(self, moves):
+        for car_id, direction in moves.items():
+            self.move_car(car_id, direction)
+
+    def tick(self):
+        """Applies the pending moves of all cars and advances the game by one tick"""
+        if not self.running:
+            return
+        width = self.size
+        moving = self.pending_moves < 4
+        steps = np.array(ACTION_STEPS + ((0, 0),))[self.pending_moves]
+        rows, columns = np.divmod(self.car_positions, width)
+        new_rows = np.clip(rows + steps[:, 0], 0, width - 1)
+        new_columns = np.clip(columns + steps[:, 1], 0, width - 1)
+        inside = (new_rows == rows + steps[:, 0]) & (new_columns == columns + steps[:, 1])
+        new_positions = new_rows * width + new_columns
+        valid = moving & inside & (self.grid.ravel()[new_positions] == 1)
+        self.car_positions = np.where(valid, new_positions, self.car_positions)
+        self.moves += int(valid.sum())
+        self.pending_moves[:] = 4
+
+        # Drop-offs
+        in_car = self.customer_status == IN_CAR
+        delivered = in_car & (self.customer_destination == self.car_positions[np.maximum(self.customer_car, 0)])
+        if delivered.any():
+            np.subtract.at(self.car_used, self.customer_car[delivered], 1)
+            self.score += int(delivered.sum())
+            self.customer_status[delivered] = FREE
+            self.customer_car[delivered] = -1
+
+        # Pickups, in the order of the customer slots
+        for slot in np.flatnonzero(self.customer_status == WAITING):
+            cars = np.flatnonzero((self.car_positions == self.customer_origin[slot]) & (self.car_used < self.capacity))
+            if len(cars):
+                self.customer_status[slot] = IN_CAR
+                self.customer_car[slot] = cars[0]
+                self.car_used[cars[0]] += 1
+
+        if self.rng.random() < self.spawn_rate:
+            self.spawn_customer()
+
+        self.ticks += 1
+        if self.ticks >= self.max_ticks:
+            self.running = False
+
+    def get_score(self):
+        return self.score
+
+    def get_scores(self):
+        return {self.team_name: {"current": self.score, "moves": self.moves}}
+
+    def get_world(self):
+        if not self.running:
+            return {"message": "Game hasn't started. Map is not available yet."}
+
+        active = np.flatnonzero(self.customer_status != FREE)
+        return {
+            "width": self.size,
+            "height": self.size,
+            "tick": self.ticks,
+            "grid": self.grid.ravel().tolist(),
+            "cars": {str(i): {"position": int(self.car_positions[i]),
+                              "capacity": self.capacity,
+                              "used_capacity": int(self.car_used[i]),
+                              "team_id": int(self.team_id)}
+                     for i in range(self.n_cars)},
+            "customers": {str(self.customer_ids[slot]): {"origin": int(self.customer_origin[slot]),
+                                                         "destination": int(self.customer_destination[slot]),
+                                                         "status": STATUS_NAMES[self.customer_status[slot]],
+                                                         "car_id": int(self.customer_car[slot])}
+                          for slot in active},
+            "teams": {self.team_id: {"name": self.team_name}},
+        }
+
+    def get_cars(self, world=None):
+        if world is None:
+            world = self.get_world()
+        return world["cars"]
+
+    def get_team_cars(self, world=None):
+        cars = self.get_cars(world)
+        return [car_id for car_id, car in cars.items() if str(car["team_id"]) == self.team_id]
+
+    def get_teams(self):
+        return {self.team_id: {"name": self.team_name}}
+
+    def get_team_id(self):
+        return self.team_id
@@ -0,0 +1,195 @@
+import numpy as np
+
+# Kinds of the entities of a sparse observation, with the channels they fill
+CUSTOMER = 0     # channel 1, and its distance to the destination in channel 2
+DESTINATION = 1  # channel 3
+CAR = 2          # channel 4
+OTHER_CAR = 3    # channel 6, and its free capacity in channel 7
+
+
+def observation_entities(obs):
+    """
+        Sparse form of a dense (H, W, 8) observation: (cells, kinds, values)
+        arrays of its entities, cells being flat indices row * W + column
+    """
+    cells = obs.reshape(-1, obs.shape[-1])
+    customers = np.flatnonzero(cells[:, 1])
+    destinations = np.flatnonzero(cells[:, 3])
+    cars = np.flatnonzero(cells[:, 4])
+    others = np.flatnonzero(cells[:, 6])
+
+    entity_cells = np.concatenate((customers, destinations, cars, others))
+    kinds = np.repeat(np.array((CUSTOMER, DESTINATION, CAR, OTHER_CAR), dtype=np.uint8),
+                      (len(customers), len(destinations), len(cars), len(others)))
+    values = np.zeros(len(entity_cells), dtype=np.uint8)
+    values[:len(customers)] = cells[customers, 2]
+    values[len(entity_cells) - len(others):] = cells[others, 7]
+    return entity_cells.astype(np.int32), kinds, values
+
+
+def capacity_extent(obs):
+    """
+        Free capacity of the car (channel 5) of a dense (H, W, 8) observation and
+        the (top, bottom, left, right) extent of the cells it fills, the whole
+        map unless the observation was padded
+    """
+    plane = obs[:, :, 5]
+    capacity = plane.max()
+    if not capacity:
+        return 0, (0, 0, 0, 0)
+    rows = np.flatnonzero(plane.any(axis=1))
+    columns = np.flatnonzero(plane.any(axis=0))
+    return capacity, (rows[0], rows[-1] + 1, columns[0], columns[-1] + 1)
+
+
+def fill_observations(out, width, grids, capacities, extents, rows, cells, kinds, values):
+    """
+        Writes a batch of sparse observations into out, zeros of shape
+        (B, H * W, 8): the (B, H * W) road grids, the free capacity of the car
+        inside its (B, 4) extents, and the entities, rows being the batch row of
+        every entity
+    """
+    out[:, :, 0] = grids
+    top, bottom, left, right = extents[:, :, np.newaxis].transpose(1, 0, 2)
+    cell_rows, cell_columns = np.divmod(np.arange(out.shape[1]), width)
+    inside = (cell_rows >= top) & (cell_rows < bottom) & (cell_columns >= left) & (cell_columns < right)
+    out[:, :, 5] = np.where(inside, capacities[:, np.newaxis], 0)
+
+    for kind, channel, value_channel in ((CUSTOMER, 1, 2), (DESTINATION, 3, None),
+                                         (CAR, 4, None), (OTHER_CAR, 6, 7)):
+        selected = kinds == kind
+        out[rows[selected], cells[selected], channel] = 1
+        if value_channel is not None:
+            out[rows[selected], cells[selected], value_channel] = values[selected]
+
+
+class SparseObservations:
+    """
+        Compact storage of the observations of whole games.
+
+        Every observation is split into what is static for a game, the road map
+        stored once per distinct map, and a handful of entities per step (cars,
+        waiting customers, destinations) stored CSR-style: the entities of step
+        i are entity_cells/kinds/values[offsets[i]:offsets[i + 1]]. The free
+        capacity of the car (channel 5, constant over the map) is one byte per
+        step, along with the extent of the cells it fills, which is less than
+        the observation for padded ones. decode rebuilds dense (B, H, W, 8)
+        uint8 batches on demand.
+
+        Steps are appended to Python lists, which arrays packs into NumPy
+        arrays; a loaded storage keeps the arrays of the file and only turns
+        them back into lists when steps are appended to it.
+    """
+
+    def __init__(self, height, width, grids=None, steps_map=None, capacities=None, offsets=None,
+                 entity_cells=None, kinds=None, values=None, extents=None):
+        self.height = height
+        self.width = width
+        self.grids = list(grids) if grids is not None else []
+        self.steps_map = list(steps_map) if steps_map is not None else []
+        self.capacities = list(capacities) if capacities is not None else []
+        self.offsets = list(offsets) if offsets is not None else [0]
+        self.entity_cells = list(entity_cells) if entity_cells is not None else []
+        self.kinds = list(kinds) if kinds is not None else []
+        self.values = list(values) if values is not None else []
+        self.extents = list(extents) if extents is not None else []
+        self._arrays = None
+
+    def __len__(self):
+        if self.steps_map is None:
+            return len(self._arrays["steps_map"])
+        return len(self.steps_map)
+
+    def _unpack(self):
+        """Lists of the arrays of a loaded storage, to append to"""
+        arrays = self._arrays
+        self.grids = list(arrays["grids"])
+        for name in ("steps_map", "capacities", "offsets", "entity_cells", "kinds", "values", "extents"):
+            setattr(self, name, arrays[name].tolist())
+
+    def append(self, obs):
+        """Adds a dense (H, W, 8) observation"""
+        if self.steps_map is None:
+            self._unpack()
+        grid = obs[:, :, 0].ravel().astype(np.uint8)
+        if not self.grids or not np.array_equal(self.grids[-1], grid):
+            self.grids.append(grid)
+        self.steps_map.append(len(self.grids) - 1)
+        capacity, extent = capacity_extent(obs)
+        self.capacities.append(capacity)
+        self.extents.append(extent)
+
+        cells, kinds, values = observation_entities(obs)
+        self.entity_cells.extend(cells)
+        self.kinds.extend(kinds)
+        self.values.extend(values)
+        self.offsets.append(len(self.entity_cells))
+        self._arrays = None
+
+    def extend(self, observations):
+        for obs in observations:
+            self.append(obs)
+
+    def arrays(self):
+        """The storage as a dict of NumPy arrays, also the content of the saved file"""
+        if self._arrays is None:
+            self._arrays = {
+                "shape": np.array((self.height, self.width)),
+                "grids": np.array(self.grids, dtype=np.uint8).reshape(-1, self.height * self.width),
+                "steps_map": np.array(self.steps_map, dtype=np.int32),
+                "capacities": np.array(self.capacities, dtype=np.uint8),
+                "offsets": np.array(self.offsets, dtype=np.int64),
+                "entity_cells": np.array(self.entity_cells, dtype=np.int32),
+                "kinds": np.array(self.kinds, dtype=np.uint8),
+                "values": np.array(self.values, dtype=np.uint8),
+                "extents": np.array(self.extents, dtype=np.int16).reshape(-1, 4),
+            }
+        return self._arrays
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def decode(self, indices=None, out=None):
+        """Dense (B, H, W, 8) uint8 observations of the steps at indices, written into out if given"""
+        arrays = self.arrays()
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices, dtype=np.int64)
+        batch = len(indices)
+        if out is None:
+            out = np.empty((batch, self.height, self.width, 8), dtype=np.uint8)
+        flat = out.reshape(batch, self.height * self.width, 8)
+        flat[:] = 0
+
+        # Entity ranges of all the steps gathered at once
+        starts = arrays["offsets"][indices]
+        counts = arrays["offsets"][indices + 1] - starts
+        rows = np.repeat(np.arange(batch), counts)
+        entities = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        fill_observations(flat, self.width, arrays["grids"][arrays["steps_map"][indices]],
+                          arrays["capacities"][indices], arrays["extents"][indices], rows,
+                          arrays["entity_cells"][entities], arrays["kinds"][entities], arrays["values"][entities])
+        return out
+
+    def save(self, path):
+        np.savez_compressed(path, **self.arrays())
+
+    @staticmethod
+    def read_shape(path):
+        """(height, width) of the observations of a saved storage, without loading them"""
+        with np.load(path) as data:
+            height, width = data["shape"]
+        return int(height), int(width)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files}
+        height, width = arrays["shape"]
+        if "extents" not in arrays:
+            # Files of unpadded observations written before the extents were stored
+            arrays["extents"] = np.tile(np.array((0, height, 0, width), dtype=np.int16), (len(arrays["steps_map"]), 1))
+        storage = cls(int(height), int(width))
+        storage.grids = storage.steps_map = storage.capacities = storage.offsets = None
+        storage.entity_cells = storage.kinds = storage.values = storage.extents = None
+        storage._arrays = arrays
+        return storage
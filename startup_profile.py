@@ -0,0 +1,91 @@
+import builtins
+import importlib.util
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    """
+        Times the start of an agent: the modules imported while it is installed
+        and named phases of the initialisation, such as connecting or loading
+        the policy. report logs them once, the slowest first, and the profiler
+        stops recording after it.
+
+        Import times are the time of each module on its own, without the
+        modules it imports in turn, summed per top-level package. Imports made
+        during a phase count towards both.
+
+        A disabled profiler records nothing, so callers need no checks.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.imports = {}
+        self.phases = []
+        self._children = []
+        self._import = None
+
+    def install(self):
+        """Starts timing imports by wrapping builtins.__import__"""
+        if self.enabled and self._import is None:
+            self._import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self, limit=15):
+        if not self.enabled:
+            return
+        self.uninstall()
+        self.enabled = False
+
+        packages = {}
+        for module, seconds in self.imports.items():
+            package = module.partition(".")[0]
+            packages[package] = packages.get(package, 0) + seconds
+        lines = [f'Startup took {(time.perf_counter() - self.started) * 1e3:.0f} ms, '
+                 f'{sum(packages.values()) * 1e3:.0f} ms of it importing {len(self.imports)} modules']
+        for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:limit]:
+            lines.append(f'  import {package:<30} {seconds * 1e3:8.1f} ms')
+        for name, seconds in self.phases:
+            lines.append(f'  {name:<37} {seconds * 1e3:8.1f} ms')
+        logging.info("\n".join(lines))
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = name
+        if level:
+            try:
+                module = importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__"))
+            except (ImportError, ValueError):
+                pass
+        # Already imported modules cost nothing, unless submodules are imported from them
+        if module in sys.modules and not fromlist:
+            return self._import(name, globals, locals, fromlist, level)
+
+        started = time.perf_counter()
+        self._children.append(0.0)
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+            self.imports[module] = self.imports.get(module, 0) + elapsed - children
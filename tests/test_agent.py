@@ -0,0 +1,12 @@
+import os
+import subprocess
+import sys
+
+
+def test_client_vm_leaves_heavy_modules_for_later():
+    code = ("import sys, client_vm; "
+            "print(sorted(m for m in ('scipy.optimize', 'inference_service', 'keras', 'tensorflow', 'aiohttp') "
+            "if m in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
@@ -0,0 +1,26 @@
+import numpy as np
+
+from alg_astar import search, search_many
+
+
+def test_search_many_reports_unreachable_ends():
+    maze = np.ones((5, 9), dtype=np.uint8)
+    maze[2, :6] = 0   # a road from (2, 0) to (2, 5)
+    maze[2, 7:] = 0   # and a separate one beyond the wall at (2, 6)
+    ends = [(2, 2), (2, 5), (2, 8)]
+
+    statuses = [status for _, status in search_many(maze, 1, (2, 0), ends)]
+    assert statuses == [0, 0, 2]
+
+
+def test_search_many_paths_are_shortest():
+    rng = np.random.default_rng(0)
+    maze = (rng.random((15, 15)) < 0.3).astype(np.uint8)
+    roads = np.argwhere(maze == 0)
+    start = tuple(roads[0])
+    ends = [tuple(cell) for cell in roads[1:40]]
+    for end, (path, status) in zip(ends, search_many(maze, 1, start, ends)):
+        expected, expected_status = search(maze, 1, start, end)
+        assert status == expected_status
+        if status == 0:
+            assert len(path) == len(expected) and path[-1] == end
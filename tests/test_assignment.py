@@ -0,0 +1,36 @@
+import numpy as np
+
+from assignment import idle_cars
+from client_vm import Runner
+from obs_encoder import ObservationEncoder
+from simulator import CitySimulator
+
+
+def test_waiting_customers_do_not_make_cars_busy():
+    world = {"customers": {"1": {"status": "waiting", "car_id": 0},
+                           "2": {"status": "in_car", "car_id": 1}}}
+    assert idle_cars(world, ["0", "1", "2"]) == ["0", "2"]
+
+
+class FixedDispatcher:
+    def __init__(self, target):
+        self.target = target
+
+    def target_for(self, car_id, obs=None):
+        return self.target
+
+
+def test_runner_drops_a_target_taken_away_by_the_dispatcher():
+    simulator = CitySimulator(size=20, n_cars=1, n_customers=3, seed=0)
+    world = simulator.get_world()
+    obs = ObservationEncoder(20, 20, simulator.get_team_cars(world)).encode(world)[0]
+    customer = tuple(int(x) for x in np.argwhere(obs[:, :, 1])[0])
+
+    dispatcher = FixedDispatcher(customer)
+    runner = Runner("0", 0, None, None, dispatcher=dispatcher)
+    runner.megaalg(obs)
+    assert runner.current_target == customer
+
+    dispatcher.target = None
+    assert runner.megaalg(obs) == 4
+    assert runner.current_target is None
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+
+from assignment import Dispatcher
+from async_client import run_fleet
+from env import JunctionEnvironment
+from simulator import CitySimulator
+
+
+class SimulatedAsyncClient:
+    """AsyncClient API over an in-process simulator, ticking once per round of moves"""
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    async def get_world(self):
+        return self.simulator.get_world()
+
+    async def get_score(self):
+        return self.simulator.get_score()
+
+    async def move_cars(self, moves):
+        self.simulator.move_cars(moves)
+        self.simulator.tick()
+
+
+def test_fleet_decides_off_the_event_loop_without_fetching():
+    simulator = CitySimulator(size=20, n_cars=2, n_customers=4, max_ticks=5, seed=0)
+    env = JunctionEnvironment(simulator, step_delay=0)
+    env.reset()
+    dispatcher = Dispatcher(None, env.car_ids, 1 - simulator.grid)
+    threads = set()
+
+    def act(car_id, obs):
+        threads.add(threading.get_ident())
+        dispatcher.target_for(car_id, obs)
+        return 4
+
+    asyncio.run(run_fleet(SimulatedAsyncClient(simulator), env, act, tick=0, on_world=dispatcher.update))
+    assert threads and threading.get_ident() not in threads
+    assert simulator.ticks == 5
@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+
+from dataset import ShardedDataset, ShardWriter
+from obs_encoder import ObservationEncoder, center_pad_observations
+from simulator import CitySimulator
+from sparse_obs import SparseObservations
+
+
+def game_observations(size, seed=0, steps=3):
+    simulator = CitySimulator(size=size, n_cars=2, seed=seed)
+    car_ids = simulator.get_team_cars(simulator.get_world())
+    encoder = ObservationEncoder(size, size, car_ids)
+    observations = []
+    for _ in range(steps):
+        observations.extend(encoder.encode(simulator.get_world()).copy())
+        simulator.tick()
+    return np.array(observations)
+
+
+def test_maps_of_different_sizes_share_the_shards(tmp_path):
+    small, large = game_observations(30), game_observations(51, seed=1)
+    with ShardWriter(str(tmp_path), shard_size=4) as writer:
+        writer.extend(small, np.arange(len(small)) % 5, np.ones(len(small)))
+        writer.extend(large, np.arange(len(large)) % 5, np.zeros(len(large)))
+
+    dataset = ShardedDataset(str(tmp_path))
+    assert len(dataset) == len(small) + len(large)
+    assert dataset.observation_shape == (100, 100, 8)
+    expected = np.concatenate((center_pad_observations(small), center_pad_observations(large)))
+    assert np.array_equal(dataset.observations(np.arange(len(dataset))), expected)
+    assert np.array_equal(dataset.actions[:len(small)], np.arange(len(small)) % 5)
+
+
+def test_sparse_observations_round_trip_padded_observations(tmp_path):
+    padded = center_pad_observations(game_observations(30))
+    storage = SparseObservations(100, 100)
+    storage.extend(padded)
+    storage.save(str(tmp_path / "obs.npz"))
+    loaded = SparseObservations.load(str(tmp_path / "obs.npz"))
+    assert np.array_equal(loaded.decode(), padded)
+    assert np.array_equal(loaded.decode([4, 1]), padded[[4, 1]])
+
+
+def test_shard_numbers_continue_after_a_deleted_shard(tmp_path):
+    observations = game_observations(20)
+    with ShardWriter(str(tmp_path), shard_size=2) as writer:
+        writer.extend(observations[:6], np.zeros(6), np.zeros(6))
+    for suffix in ("obs.npz", "actions.npy", "scores.npy"):
+        os.remove(tmp_path / f"shard_00000_{suffix}")
+
+    with ShardWriter(str(tmp_path), shard_size=2) as writer:
+        writer.extend(observations[:2], np.ones(2), np.zeros(2))
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith("_obs.npz")) == \
+        ["shard_00001_obs.npz", "shard_00002_obs.npz", "shard_00003_obs.npz"]
+    assert len(ShardedDataset(str(tmp_path))) == 6
+
+
+def test_loaded_sparse_observations_stay_arrays_until_appended_to(tmp_path):
+    observations = game_observations(20)
+    storage = SparseObservations(20, 20)
+    storage.extend(observations[:4])
+    storage.save(str(tmp_path / "obs.npz"))
+
+    loaded = SparseObservations.load(str(tmp_path / "obs.npz"))
+    assert loaded.steps_map is None and len(loaded) == 4
+    assert np.array_equal(loaded.decode(), observations[:4])
+    loaded.extend(observations[4:])
+    assert np.array_equal(loaded.decode(), observations)
+
+
+def test_generating_the_same_seeds_again_replaces_their_shards(tmp_path):
+    from generate_dataset import play_games
+
+    _, records = play_games([5, 6], str(tmp_path), 16, 20, 2, 10)
+    files = sorted(os.listdir(tmp_path))
+    observations = ShardedDataset(str(tmp_path)).observations(np.arange(records))
+
+    assert play_games([5], str(tmp_path), 16, 20, 2, 10)[1] == records // 2
+    assert sorted(os.listdir(tmp_path)) == files
+    dataset = ShardedDataset(str(tmp_path))
+    assert len(dataset) == records
+    assert np.array_equal(dataset.observations(np.arange(records)), observations)
+
+
+def test_shard_observations_are_loaded_on_first_use_only(tmp_path):
+    observations = center_pad_observations(game_observations(20, steps=4))
+    with ShardWriter(str(tmp_path), shard_size=2) as writer:
+        writer.extend(observations, np.zeros(len(observations)), np.zeros(len(observations)))
+
+    train, validation = ShardedDataset(str(tmp_path), max_open_shards=2).split(0.25, seed=0)
+    shards = train.shards.observations
+    assert len(shards) == 4 and not shards.open
+    assert np.array_equal(train.observations([0]), observations[train.indices[[0]]])
+    assert len(shards.open) == 1
+    # Every shard in turn, only the two most recently used stay loaded
+    assert np.array_equal(train.observations(np.arange(len(train))), observations[train.indices])
+    assert np.array_equal(validation.observations(np.arange(len(validation))), observations[validation.indices])
+    assert len(shards.open) == 2
@@ -0,0 +1,29 @@
+import numpy as np
+
+from distance_oracle import DistanceOracle
+from simulator import generate_grid
+
+
+def test_maps_above_the_size_cap_get_no_oracle(tmp_path):
+    maze = 1 - generate_grid(30, np.random.default_rng(0))
+    assert DistanceOracle.load_or_build(maze, cache_dir=str(tmp_path), max_size=20) is None
+    assert not list(tmp_path.iterdir())
+    assert DistanceOracle.load_or_build(maze, cache_dir=str(tmp_path), max_size=30) is not None
+
+
+def test_oracle_paths_are_as_short_as_search():
+    from alg_astar import search
+
+    maze = 1 - generate_grid(30, np.random.default_rng(1))
+    oracle = DistanceOracle.build(maze)
+    roads = np.argwhere(maze == 0)
+    rng = np.random.default_rng(0)
+    for start, end in rng.choice(roads, size=(30, 2)):
+        start, end = tuple(int(x) for x in start), tuple(int(x) for x in end)
+        expected, status = search(maze, 1, start, end)
+        path, oracle_status = oracle.path(start, end)
+        assert oracle_status == status == 0
+        assert len(path) == len(expected) == oracle.distance(start, end)
+        for a, b in zip([start] + path, path):
+            assert abs(a[0] - b[0]) + abs(a[1] - b[1]) == 1 and maze[b] == 0
+        assert not path or path[-1] == end
@@ -0,0 +1,56 @@
+import numpy as np
+
+from env import JunctionEnvironment
+from inference_service import InferenceService
+from obs_encoder import center_pad_observations
+from simulator import CitySimulator
+
+
+def test_observations_of_the_fleet_share_one_batch():
+    shapes = []
+
+    def predict(batch):
+        shapes.append(batch.shape)
+        return np.eye(5)[np.arange(len(batch)) % 5]
+
+    service = InferenceService(predict, expected=4, window=1.0,
+                               preprocess=lambda batch: center_pad_observations(batch, 40))
+    service.start()
+    try:
+        actions = service.act_many([np.zeros((30, 30, 8), dtype=np.uint8)] * 4, timeout=5)
+    finally:
+        service.stop()
+    assert actions == [0, 1, 2, 3]
+    assert shapes == [(4, 40, 40, 8)]
+
+
+def test_policy_game_runs_one_batch_per_tick():
+    from client_vm import run_policy_game
+
+    env = JunctionEnvironment(CitySimulator(size=20, n_cars=3, max_ticks=10, seed=0), step_delay=0)
+    observations = env.reset()
+    service = InferenceService(lambda batch: np.tile(np.eye(5)[4], (len(batch), 1)), expected=3)
+    service.start()
+    try:
+        run_policy_game(env, service, observations)
+    finally:
+        service.stop()
+    assert service.batches == 10
+    assert service.stats()["mean_batch_size"] == 3
+
+
+def test_observations_of_a_new_shape_do_not_stop_the_service():
+    service = InferenceService(lambda batch: np.tile(np.eye(5)[batch.shape[1] % 5], (len(batch), 1)),
+                               window=0.05)
+    service.start()
+    try:
+        assert service.act(np.zeros((11, 11, 8), dtype=np.uint8), timeout=5) == 1
+        assert service.act(np.zeros((12, 12, 8), dtype=np.uint8), timeout=5) == 2
+        # Observations of two shapes in one batch fail that batch only
+        futures = [service.submit(np.zeros((size, size, 8), dtype=np.uint8)) for size in (11, 12)]
+        for future in futures:
+            assert isinstance(future.exception(timeout=5), ValueError)
+        assert service.act(np.zeros((13, 13, 8), dtype=np.uint8), timeout=5) == 3
+        assert service.is_alive()
+    finally:
+        service.stop()
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from numpy_policy import NumpyPolicy, export_model
+
+
+def test_exported_policy_predicts_like_keras(tmp_path):
+    keras = pytest.importorskip("keras")
+    from keras import layers
+
+    inputs = keras.Input(shape=(12, 12, 8))
+    x = layers.Conv2D(4, 3, padding="same", activation="relu")(inputs)
+    x = layers.BatchNormalization()(x)
+    shortcut = x
+    x = layers.Conv2D(4, 3, padding="same")(x)
+    x = layers.Add()([x, shortcut])
+    x = layers.Activation("relu")(x)
+    x = layers.MaxPooling2D(2)(x)
+    x = layers.Conv2D(6, 3, strides=2)(x)
+    x = layers.Flatten()(x)
+    x = layers.Dropout(0.5)(x)
+    outputs = layers.Dense(5, activation="softmax")(x)
+    model = keras.Model(inputs, outputs)
+    # Non-trivial batch normalization statistics
+    bn = next(layer for layer in model.layers if isinstance(layer, layers.BatchNormalization))
+    gamma, beta, mean, variance = bn.get_weights()
+    bn.set_weights([gamma * 1.5, beta + 0.1, mean + 0.2, variance * 2])
+
+    export_model(model, str(tmp_path / "policy.npz"))
+    policy = NumpyPolicy(str(tmp_path / "policy.npz"))
+    batch = np.random.default_rng(0).integers(0, 4, size=(3, 12, 12, 8)).astype(np.uint8)
+    np.testing.assert_allclose(policy.predict(batch), model.predict_on_batch(batch.astype(np.float32)),
+                               rtol=1e-4, atol=1e-5)
+    assert policy.act(batch[0]) == int(np.argmax(model.predict_on_batch(batch[:1].astype(np.float32))))
@@ -0,0 +1,21 @@
+import numpy as np
+
+from client import CarDirection
+from obs_encoder import ObservationEncoder
+from simulator import CitySimulator
+
+
+def test_incremental_encoding_matches_the_full_one():
+    simulator = CitySimulator(size=15, n_cars=4, capacity=2, n_customers=20, max_customers=30,
+                              spawn_rate=0.5, seed=0)
+    car_ids = simulator.get_team_cars(simulator.get_world())
+    full = ObservationEncoder(15, 15, car_ids)
+    incremental = ObservationEncoder(15, 15, car_ids, incremental=True)
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        world = simulator.get_world()
+        assert np.array_equal(incremental.encode(world), full.encode(world))
+        simulator.move_cars({car_id: CarDirection(int(action))
+                             for car_id, action in zip(car_ids, rng.integers(0, 4, size=len(car_ids)))})
+        simulator.tick()
+    assert simulator.score > 0
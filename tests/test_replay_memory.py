@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from obs_encoder import ObservationEncoder, center_pad_observations
+from replay_memory import CompactMemory
+from simulator import CitySimulator
+
+
+def small_observation(size=30, seed=0):
+    simulator = CitySimulator(size=size, n_cars=2, seed=seed)
+    world = simulator.get_world()
+    encoder = ObservationEncoder(size, size, simulator.get_team_cars(world))
+    return encoder.encode(world)[0].copy()
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_padded_observations_of_small_maps_are_stored(sparse):
+    memory = CompactMemory(limit=10, observation_shape=(100, 100, 8), sparse=sparse, window_length=1)
+    obs = small_observation()
+    padded = center_pad_observations(obs)
+    for i in range(4):
+        memory.append(padded, i % 5, 1.0, False)
+    state0, _, _, _, _ = memory.sample_arrays(2)
+    assert np.array_equal(state0[0, 0], padded)
+    assert np.array_equal(padded[35:65, 35:65], obs)
+
+
+def test_observation_of_another_shape_is_rejected():
+    memory = CompactMemory(limit=10, observation_shape=(100, 100, 8), sparse=True, window_length=1)
+    with pytest.raises(ValueError):
+        memory.append(small_observation(), 0, 0.0, False)
+
+
+def test_center_pad_of_odd_sizes_and_batches():
+    obs = np.ones((2, 37, 37, 8), dtype=np.uint8)
+    padded = center_pad_observations(obs)
+    assert padded.shape == (2, 100, 100, 8)
+    assert padded.sum() == obs.sum()
+    assert center_pad_observations(obs[0]).shape == (100, 100, 8)
+
+
+def test_egocentric_observations_keep_their_summaries():
+    from env import JunctionEnvironment
+    from obs_encoder import SUMMARY_FEATURES
+
+    env = JunctionEnvironment(CitySimulator(size=30, n_cars=2, seed=0), step_delay=0, crop_size=11)
+    observations = [env.reset()[env.car_ids[0]]]
+    for action in (0, 1, 2, 3, 4):
+        obs, _, _, _ = env.step(action, env.car_ids[0])
+        observations.append(obs)
+
+    memory = CompactMemory(limit=10, observation_shape=(11, 11, 8), sparse=True, window_length=1,
+                           summary_size=len(SUMMARY_FEATURES))
+    for i, obs in enumerate(observations):
+        memory.append(obs, i % 5, 0.0, False)
+    (views, summaries), _, _, _, _ = memory.sample_arrays(2, batch_idxs=[1, 3])
+    for row, index in enumerate([1, 3]):
+        assert np.array_equal(views[row, 0], observations[index]["view"])
+        assert np.array_equal(summaries[row, 0], observations[index]["summary"])
+    experience = memory.sample(1, batch_idxs=[2])[0]
+    assert np.array_equal(experience.state1[0]["summary"], observations[3]["summary"])
+
+
+@pytest.mark.parametrize("window_length", [1, 3])
+def test_samples_match_sequential_memory(window_length):
+    from rl.memory import SequentialMemory
+
+    rng = np.random.default_rng(0)
+    compact = CompactMemory(limit=100, observation_shape=(6, 6, 8), window_length=window_length)
+    sequential = SequentialMemory(limit=100, window_length=window_length)
+    for step in range(40):
+        obs = rng.integers(0, 3, size=(6, 6, 8), dtype=np.uint8)
+        # Episodes of 7 steps, so that windows cross episode boundaries
+        terminal = step % 7 == 6
+        for memory in (compact, sequential):
+            memory.append(obs, step % 5, float(step), terminal)
+
+    # Transitions that do not start an episode, which SequentialMemory would redraw at random
+    indices = [i for i in range(window_length, 38) if not sequential.terminals[i - 1]]
+    for expected, sampled in zip(sequential.sample(len(indices), indices), compact.sample(len(indices), indices)):
+        assert np.array_equal(np.array(expected.state0), sampled.state0)
+        assert np.array_equal(np.array(expected.state1), sampled.state1)
+        assert (expected.action, expected.reward, expected.terminal1) == \
+            (sampled.action, sampled.reward, sampled.terminal1)
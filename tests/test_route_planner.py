@@ -0,0 +1,49 @@
+import numpy as np
+
+from alg_astar import search
+from route_planner import RoutePlanner
+from simulator import CitySimulator
+
+
+def test_distances_without_an_oracle_match_search():
+    simulator = CitySimulator(size=30, n_cars=2, seed=0)
+    maze = 1 - simulator.grid
+    planner = RoutePlanner(simulator.get_world, ["0", "1"], maze, distance_cache_size=8)
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        start, end = (divmod(int(cell), 30) for cell in rng.choice(simulator.roads, size=2, replace=False))
+        path, status = search(maze, 1, start, end)
+        assert planner.distance(start, end) == (len(path) if status == 0 else 1e9)
+    assert len(planner._fields) <= 8
+
+
+def loads_along(load, route):
+    from route_planner import PICKUP
+    loads = [load]
+    for stop in route:
+        loads.append(loads[-1] + (1 if stop.kind == PICKUP else -1))
+    return loads
+
+
+def test_insertions_never_exceed_the_capacity():
+    from route_planner import DROPOFF, PICKUP, Stop
+
+    simulator = CitySimulator(size=30, n_cars=1, seed=0)
+    planner = RoutePlanner(simulator.get_world, ["0"], 1 - simulator.grid)
+    rng = np.random.default_rng(1)
+    cells = [divmod(int(cell), 30) for cell in rng.choice(simulator.roads, size=9, replace=False)]
+    start = cells[0]
+    # Customer b is on board and a still to be picked up, which a car of capacity 1 cannot plan
+    route = [Stop(PICKUP, "a", cells[1]), Stop(DROPOFF, "b", cells[2]), Stop(DROPOFF, "a", cells[3])]
+    for capacity in (1, 2, 3):
+        planned = route if capacity > 1 else [stop for stop in route if stop.customer_id == "b"]
+        for pickup, dropoff in zip(cells[4::2], cells[5::2]):
+            best = planner.best_insertion(start, 1, capacity, planned, "c", pickup, dropoff)
+            assert best is not None
+            assert max(loads_along(1, best[1])) <= capacity
+
+    # A full car can only pick up after a drop-off
+    full = [Stop(DROPOFF, "b", cells[2])]
+    best = planner.best_insertion(start, 2, 2, full, "c", cells[4], cells[5])
+    assert [stop.kind for stop in best[1]] == [DROPOFF, PICKUP, DROPOFF]
+    assert planner.best_insertion(start, 2, 2, [], "c", cells[4], cells[5]) is None
@@ -0,0 +1,44 @@
+import time
+
+from env import JunctionEnvironment
+from simulator import CitySimulator
+
+
+def test_game_of_staying_cars_ends_after_max_ticks():
+    env = JunctionEnvironment(CitySimulator(size=20, n_cars=2, max_ticks=30, seed=0), step_delay=0)
+    env.reset()
+    for steps in range(1, 100):
+        _, _, done, _ = env.step(4, env.car_ids[0])
+        if done:
+            break
+    assert done
+    assert steps == 30
+
+
+def test_fleet_of_staying_cars_ends_after_max_ticks():
+    env = JunctionEnvironment(CitySimulator(size=20, n_cars=3, max_ticks=25, seed=1), step_delay=0)
+    env.reset()
+    for steps in range(1, 100):
+        _, _, dones, _ = env.step({car_id: 4 for car_id in env.car_ids})
+        if all(dones.values()):
+            break
+    assert steps == 25
+
+
+def test_every_step_is_one_tick():
+    simulator = CitySimulator(size=20, n_cars=2, max_ticks=100, seed=2)
+    env = JunctionEnvironment(simulator, step_delay=0)
+    env.reset()
+    env.step(4, env.car_ids[0])
+    env.step(0, env.car_ids[0])
+    env.step({car_id: 1 for car_id in env.car_ids})
+    assert simulator.ticks == 3
+
+
+def test_simulator_steps_without_the_step_delay():
+    env = JunctionEnvironment(CitySimulator(size=20, n_cars=2, max_ticks=100, seed=3))
+    env.reset()
+    started = time.monotonic()
+    for _ in range(4):
+        env.step({car_id: 4 for car_id in env.car_ids})
+    assert time.monotonic() - started < env.step_delay
@@ -0,0 +1,77 @@
+import time
+from threading import Event, Lock, Thread
+
+import pytest
+
+from alg_astar import ACTION_STEPS
+from env import JunctionEnvironment
+from simulator import CitySimulator
+from world_poller import WorldPoller
+
+
+class TickingServer:
+    """A simulator ticking on its own clock, like the challenge server"""
+
+    def __init__(self, simulator, period=0.05):
+        self.simulator = simulator
+        self.period = period
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.period):
+            with self.lock:
+                self.simulator.tick()
+
+    def get_world(self):
+        with self.lock:
+            return self.simulator.get_world()
+
+    def move_car(self, car_id, direction):
+        with self.lock:
+            self.simulator.move_car(car_id, direction)
+
+    def move_cars(self, moves):
+        with self.lock:
+            self.simulator.move_cars(moves)
+
+    def get_score(self):
+        with self.lock:
+            return self.simulator.get_score()
+
+    def get_team_cars(self, world):
+        return self.simulator.get_team_cars(world)
+
+
+def open_move(simulator, car_id):
+    """An action moving the car onto a road cell"""
+    row, column = divmod(simulator.get_world()["cars"][car_id]["position"], simulator.size)
+    for action, (d_row, d_column) in enumerate(ACTION_STEPS):
+        r, c = row + d_row, column + d_column
+        if 0 <= r < simulator.size and 0 <= c < simulator.size and simulator.grid[r, c]:
+            return action, (r, c)
+
+
+@pytest.mark.parametrize("with_poller", [False, True])
+def test_step_returns_the_world_with_the_move_applied(with_poller):
+    simulator = CitySimulator(size=20, n_cars=1, max_ticks=10000, seed=0)
+    server = TickingServer(simulator)
+    poller = WorldPoller(server, interval=0.005) if with_poller else None
+    if poller is not None:
+        poller.start()
+    try:
+        env = JunctionEnvironment(server, poller=poller, tick_sync=True, poll_interval=0.005)
+        env.reset()
+        car_id = env.car_ids[0]
+        for _ in range(5):
+            # Ticks pass between the steps, so the last world seen is outdated
+            time.sleep(0.12)
+            action, cell = open_move(simulator, car_id)
+            obs, _, _, _ = env.step(action, car_id)
+            assert obs[cell[0], cell[1], 4] == 1
+    finally:
+        server.stopped.set()
+        if poller is not None:
+            poller.stop()
@@ -0,0 +1,77 @@
+import numpy as np
+
+from client import CarDirection
+from obs_encoder import ObservationEncoder
+from simulator import CitySimulator
+from vec_env import VecCityEnv
+
+
+def vec_env_of(simulator):
+    """A one-game VecCityEnv in the state of the simulator"""
+    env = VecCityEnv(1, size=simulator.size, n_cars=simulator.n_cars, capacity=simulator.capacity,
+                     n_customers=0, max_customers=simulator.max_customers, spawn_rate=0,
+                     max_ticks=simulator.max_ticks)
+    env.reset()
+    grid = simulator.grid.ravel()
+    env.grids[0] = grid
+    env.roads[0, :len(simulator.roads)] = simulator.roads
+    env.road_counts[0] = len(simulator.roads)
+    env.car_positions[0] = simulator.car_positions
+    env.car_used[0] = simulator.car_used
+    env.customer_status[0] = simulator.customer_status
+    env.customer_origin[0] = simulator.customer_origin
+    env.customer_destination[0] = simulator.customer_destination
+    env.customer_car[0] = simulator.customer_car
+    return env
+
+
+def test_vec_env_plays_like_the_simulator():
+    # Few cells and many customers, so that cars share cells and pickups compete
+    simulator = CitySimulator(size=12, n_cars=4, capacity=2, n_customers=30, max_customers=40,
+                              spawn_rate=0, max_ticks=200, seed=3)
+    env = vec_env_of(simulator)
+    car_ids = simulator.get_team_cars(simulator.get_world())
+    encoder = ObservationEncoder(12, 12, car_ids)
+    rng = np.random.default_rng(0)
+    score = 0
+    for _ in range(150):
+        actions = rng.integers(0, 5, size=simulator.n_cars)
+        simulator.move_cars({str(car): CarDirection(int(action)) for car, action in enumerate(actions) if action < 4})
+        simulator.tick()
+        obs, rewards, _, _ = env.step(actions[np.newaxis])
+        score += int(rewards[0])
+
+        assert np.array_equal(env.car_positions[0], simulator.car_positions)
+        assert np.array_equal(env.car_used[0], simulator.car_used)
+        assert np.array_equal(env.customer_status[0], simulator.customer_status)
+        assert np.array_equal(env.customer_car[0], simulator.customer_car)
+        assert score == simulator.score
+        assert np.array_equal(obs[0], encoder.encode(simulator.get_world())[0])
+    assert score > 0
+
+
+def test_other_cars_sharing_a_cell_show_their_largest_free_capacity():
+    shared = 0
+    for seed in range(10):
+        simulator = CitySimulator(size=8, n_cars=6, capacity=3, n_customers=20, max_customers=30,
+                                  spawn_rate=0, max_ticks=100, seed=seed)
+        env = vec_env_of(simulator)
+        encoder = ObservationEncoder(8, 8, simulator.get_team_cars(simulator.get_world()))
+        rng = np.random.default_rng(seed)
+        for _ in range(40):
+            actions = rng.integers(0, 5, size=simulator.n_cars)
+            simulator.move_cars({str(car): CarDirection(int(action))
+                                 for car, action in enumerate(actions) if action < 4})
+            simulator.tick()
+            obs, _, _, _ = env.step(actions[np.newaxis])
+            assert np.array_equal(obs[0], encoder.encode(simulator.get_world())[0])
+
+            positions, used = simulator.car_positions[1:], simulator.car_used[1:]
+            shared += any(len(set(used[positions == cell])) > 1 for cell in set(positions))
+    assert shared > 0
+
+
+def test_new_customers_travel_somewhere_else():
+    env = VecCityEnv(4, size=10, n_customers=50, max_customers=50, seed=0)
+    env.reset()
+    assert (env.customer_origin != env.customer_destination).all()
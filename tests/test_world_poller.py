@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from world_poller import WorldPoller
+
+
+class FailingClient:
+    def get_world(self):
+        raise ConnectionError("server down")
+
+
+class SlowClient:
+    def get_world(self):
+        time.sleep(10)
+        return {}
+
+
+def test_latest_raises_the_last_fetch_error():
+    poller = WorldPoller(FailingClient(), interval=0.01, first_timeout=0.2)
+    poller.start()
+    try:
+        with pytest.raises(ConnectionError):
+            poller.latest()
+    finally:
+        poller.stop()
+
+
+def test_latest_times_out_without_a_world():
+    poller = WorldPoller(SlowClient(), first_timeout=0.1)
+    poller.start()
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        poller.latest()
+    assert time.monotonic() - started < 5
+    poller.stop()
@@ -0,0 +1,69 @@
+import logging
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PooledTransport:
+    """
+        HTTP transport shared by the clients: one requests.Session whose
+        keep-alive connections are pooled per host, with default timeouts and
+        retries with exponential backoff. Only connection errors are retried for
+        POST requests, since a move that reached the server must not be repeated.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=16, timeout=(3.05, 10), retries=3, backoff_factor=0.1):
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(502, 503, 504))
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        self.requests = 0
+        self.lock = Lock()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with self.lock:
+            self.requests += 1
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request("POST", url, data=data, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request("PUT", url, data=data, **kwargs)
+
+    def stats(self):
+        """Requests sent, connections opened and the share of requests that reused a connection"""
+        pools = self.adapter.poolmanager.pools
+        connections = sum(pools[key].num_connections for key in pools.keys())
+        reused = 1 - connections / self.requests if self.requests else 0.0
+        return {"requests": self.requests, "connections": connections, "reuse_ratio": max(reused, 0.0)}
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f'HTTP transport: {stats["requests"]} requests over {stats["connections"]} connections '
+                     f'({stats["reuse_ratio"]:.0%} reused)')
+
+    def close(self):
+        self.session.close()
+
+
+_shared_transport = None
+_shared_lock = Lock()
+
+
+def shared_transport():
+    """The transport used by every client that is not given its own"""
+    global _shared_transport
+    with _shared_lock:
+        if _shared_transport is None:
+            _shared_transport = PooledTransport()
+        return _shared_transport
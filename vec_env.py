@@ -0,0 +1,183 @@
+import numpy as np
+from gym import spaces
+
+from alg_astar import ACTION_STEPS
+from simulator import FREE, IN_CAR, WAITING, generate_grid
+
+
+class VecCityEnv:
+    """
+        N independent simulated games stepped in lockstep.
+
+        The state of all games lives in stacked NumPy arrays and step takes and
+        returns batched arrays, so collecting experience costs a handful of array
+        operations per step for the whole batch instead of a Python round trip per
+        transition. The game rules are the ones of simulator.CitySimulator, and
+        tests/test_vec_env.py checks that both play a game the same way.
+
+        The agent drives car 0 of every game (actions of shape (N,)), or all cars
+        with actions of shape (N, n_cars). Observations are the (N, H, W, 8) uint8
+        maps of car 0 in the JunctionEnvironment channel layout, the reward is the
+        number of customers delivered in the step, and finished games are reset
+        automatically (their observation is then the first one of the new game).
+        The returned observations are a buffer that is overwritten by the next
+        step, copy them to keep them around.
+    """
+
+    def __init__(self, n_envs, size=100, n_cars=4, capacity=4, n_customers=20, max_customers=100,
+                 spawn_rate=0.1, max_ticks=1000, seed=None):
+        self.num_envs = n_envs
+        self.size = size
+        self.n_cars = n_cars
+        self.capacity = capacity
+        self.n_customers = n_customers
+        self.max_customers = max_customers
+        self.spawn_rate = spawn_rate
+        self.max_ticks = max_ticks
+        self.rng = np.random.default_rng(seed)
+
+        # north, east, south, west, nothing
+        self.action_space = spaces.Discrete(5)
+        self.observation_space = spaces.Box(low=0, high=255, shape=(size, size, 8), dtype=np.uint8)
+        self.steps = np.array(ACTION_STEPS + ((0, 0),))
+
+        n, cells = n_envs, size * size
+        self.grids = np.zeros((n, cells), dtype=np.uint8)
+        self.roads = np.zeros((n, cells), dtype=np.int64)
+        self.road_counts = np.zeros(n, dtype=np.int64)
+
+        self.car_positions = np.zeros((n, n_cars), dtype=np.int64)
+        self.car_used = np.zeros((n, n_cars), dtype=np.int64)
+
+        self.customer_status = np.zeros((n, max_customers), dtype=np.int64)
+        self.customer_origin = np.zeros((n, max_customers), dtype=np.int64)
+        self.customer_destination = np.zeros((n, max_customers), dtype=np.int64)
+        self.customer_car = np.full((n, max_customers), -1, dtype=np.int64)
+
+        self.ticks = np.zeros(n, dtype=np.int64)
+        self.scores = np.zeros(n, dtype=np.int64)
+        self.obs = np.zeros((n, size, size, 8), dtype=np.uint8)
+
+    def _random_roads(self, games, count):
+        """count random road cells of each of the games, shape (len(games), count)"""
+        picks = (self.rng.random((len(games), count)) * self.road_counts[games, np.newaxis]).astype(np.int64)
+        return self.roads[games[:, np.newaxis], picks]
+
+    def _random_trips(self, games):
+        """(origins, destinations) of a new customer in each of the games, two different road cells"""
+        counts = self.road_counts[games]
+        origins = (self.rng.random(len(games)) * counts).astype(np.int64)
+        # Drawn among the other roads, like choice(roads, size=2, replace=False) of the simulator
+        destinations = (self.rng.random(len(games)) * (counts - 1)).astype(np.int64)
+        destinations += destinations >= origins
+        return self.roads[games, origins], self.roads[games, destinations]
+
+    def _reset_games(self, games):
+        for game in games:
+            grid = generate_grid(self.size, self.rng).ravel()
+            roads = np.flatnonzero(grid)
+            self.grids[game] = grid
+            self.roads[game, :len(roads)] = roads
+            self.road_counts[game] = len(roads)
+
+        self.car_positions[games] = self._random_roads(games, self.n_cars)
+        self.car_used[games] = 0
+        self.customer_status[games] = FREE
+        self.customer_car[games] = -1
+        self.customer_status[games, :self.n_customers] = WAITING
+        for slot in range(self.n_customers):
+            self.customer_origin[games, slot], self.customer_destination[games, slot] = self._random_trips(games)
+        self.ticks[games] = 0
+        self.scores[games] = 0
+
+    def reset(self):
+        self._reset_games(np.arange(self.num_envs))
+        return self._observe()
+
+    def step(self, actions):
+        """Returns (observations, rewards, dones, infos) as batched arrays (infos is a list of dicts)"""
+        n, width = self.num_envs, self.size
+        actions = np.asarray(actions, dtype=np.int64)
+        if actions.ndim == 1:
+            all_actions = np.full((n, self.n_cars), 4, dtype=np.int64)
+            all_actions[:, 0] = actions
+            actions = all_actions
+
+        # Moves, invalid ones (off the map or into a building) keep the car in place
+        steps = self.steps[actions]
+        rows, columns = np.divmod(self.car_positions, width)
+        new_rows = np.clip(rows + steps[..., 0], 0, width - 1)
+        new_columns = np.clip(columns + steps[..., 1], 0, width - 1)
+        inside = (new_rows == rows + steps[..., 0]) & (new_columns == columns + steps[..., 1])
+        new_positions = new_rows * width + new_columns
+        games = np.arange(n)[:, np.newaxis]
+        valid = inside & (self.grids[games, new_positions] == 1)
+        self.car_positions = np.where(valid, new_positions, self.car_positions)
+
+        # Drop-offs
+        carrier_positions = self.car_positions[games, np.maximum(self.customer_car, 0)]
+        delivered = (self.customer_status == IN_CAR) & (self.customer_destination == carrier_positions)
+        rewards = delivered.sum(axis=1)
+        if rewards.any():
+            game_index, slot_index = np.nonzero(delivered)
+            np.subtract.at(self.car_used, (game_index, self.customer_car[game_index, slot_index]), 1)
+            self.customer_status[delivered] = FREE
+            self.customer_car[delivered] = -1
+        self.scores += rewards
+
+        # Pickups, in the order of the customer slots and the cars
+        for car in range(self.n_cars):
+            here = (self.customer_status == WAITING) & (self.customer_origin == self.car_positions[:, car, np.newaxis])
+            free_seats = self.capacity - self.car_used[:, car, np.newaxis]
+            taken = here & (np.cumsum(here, axis=1) <= free_seats)
+            self.customer_status[taken] = IN_CAR
+            self.customer_car[taken] = car
+            self.car_used[:, car] += taken.sum(axis=1)
+
+        # Spawns, at most one per game and step into the first free slot
+        free = self.customer_status == FREE
+        spawning = np.flatnonzero((self.rng.random(n) < self.spawn_rate) & free.any(axis=1))
+        if len(spawning):
+            slots = np.argmax(free[spawning], axis=1)
+            self.customer_status[spawning, slots] = WAITING
+            self.customer_origin[spawning, slots], self.customer_destination[spawning, slots] = \
+                self._random_trips(spawning)
+            self.customer_car[spawning, slots] = -1
+
+        self.ticks += 1
+        dones = self.ticks >= self.max_ticks
+        infos = [{"score": int(score)} for score in self.scores]
+        if dones.any():
+            self._reset_games(np.flatnonzero(dones))
+        return self._observe(), rewards, dones, infos
+
+    def _observe(self):
+        """Writes the observations of car 0 of every game into the reusable buffer"""
+        n, width = self.num_envs, self.size
+        obs = self.obs.reshape(n, width * width, 8)
+        obs[:, :, 0] = self.grids
+        obs[:, :, 1:] = 0
+
+        game_index, slot_index = np.nonzero(self.customer_status == WAITING)
+        origins = self.customer_origin[game_index, slot_index]
+        destinations = self.customer_destination[game_index, slot_index]
+        obs[game_index, origins, 1] = 1
+        origin_rows, origin_columns = np.divmod(origins, width)
+        destination_rows, destination_columns = np.divmod(destinations, width)
+        distances = np.abs(origin_rows - destination_rows) + np.abs(origin_columns - destination_columns)
+        # The longest trip of the customers waiting on a cell, like the encoder
+        np.maximum.at(obs[:, :, 2], (game_index, origins), np.minimum(distances, 255).astype(np.uint8))
+
+        game_index, slot_index = np.nonzero((self.customer_status == IN_CAR) & (self.customer_car == 0))
+        obs[game_index, self.customer_destination[game_index, slot_index], 3] = 1
+
+        games = np.arange(n)
+        obs[games, self.car_positions[:, 0], 4] = 1
+        obs[:, :, 5] = (self.capacity - self.car_used[:, 0])[:, np.newaxis]
+        if self.n_cars > 1:
+            others = np.repeat(games, self.n_cars - 1)
+            positions = self.car_positions[:, 1:].ravel()
+            obs[others, positions, 6] = 1
+            # The largest free capacity of the other cars on a cell, like the encoder
+            np.maximum.at(obs[:, :, 7], (others, positions), (self.capacity - self.car_used[:, 1:]).ravel())
+        return self.obs
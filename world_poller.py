@@ -0,0 +1,98 @@
+import logging
+import time
+from collections import namedtuple
+from threading import Condition, Thread
+from types import MappingProxyType
+
+import numpy as np
+
+WorldSnapshot = namedtuple("WorldSnapshot", ["version", "fetched_at", "world"])
+
+
+def freeze_world(world):
+    """
+        Read-only view of a world dict: the dicts become mapping proxies and the
+        grid a read-only NumPy array, so that it can be shared between threads
+    """
+    frozen = dict(world)
+    if "grid" in world:
+        grid = np.asarray(world["grid"], dtype=np.uint8)
+        grid.flags.writeable = False
+        frozen["grid"] = grid
+    for key in ("cars", "customers", "teams"):
+        if key in world:
+            frozen[key] = MappingProxyType({k: MappingProxyType(v) for k, v in world[key].items()})
+    return MappingProxyType(frozen)
+
+
+class WorldPoller(Thread):
+    """
+        Background thread fetching the world for all consumers.
+
+        Every fetched world that differs from the previous one is frozen once
+        into a WorldSnapshot with the next version number and published.
+        Consumers either take the latest snapshot or wait for one newer than the
+        version they have seen, instead of each downloading the world themselves.
+        Until the first world is in, they wait for at most first_timeout seconds
+        and then get the last error of the fetches, or a TimeoutError.
+    """
+
+    def __init__(self, client, interval=0.05, first_timeout=10.0):
+        super().__init__(daemon=True)
+        self.client = client
+        self.interval = interval
+        self.first_timeout = first_timeout
+
+        self.snapshot = None
+        self.error = None
+        self._raw_world = None
+        self.condition = Condition()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                self.publish(self.client.get_world())
+                self.error = None
+            except Exception as ex:
+                logging.warning(f'Fetching the world failed: {ex}')
+                self.error = ex
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+    def publish(self, world):
+        """Publishes the world as a new snapshot if it changed"""
+        if self.snapshot is not None and world == self._raw_world:
+            return self.snapshot
+        version = self.snapshot.version + 1 if self.snapshot is not None else 1
+        snapshot = WorldSnapshot(version, time.monotonic(), freeze_world(world))
+        with self.condition:
+            self._raw_world = world
+            self.snapshot = snapshot
+            self.condition.notify_all()
+        return snapshot
+
+    def wait_for(self, version=0, timeout=None):
+        """
+            First snapshot newer than version, the latest one if timeout runs out
+            first; before the first one, timeout is at most first_timeout
+        """
+        with self.condition:
+            if self.snapshot is None and (timeout is None or timeout > self.first_timeout):
+                timeout = self.first_timeout
+            self.condition.wait_for(lambda: self.snapshot is not None and self.snapshot.version > version, timeout)
+            if self.snapshot is None:
+                if self.error is not None:
+                    raise self.error
+                raise TimeoutError(f'No world fetched within {timeout} s')
+            return self.snapshot
+
+    def latest(self):
+        """The latest snapshot, waiting for the first one if needed"""
+        return self.wait_for(0)
+
+    def get_world(self):
+        """Drop-in for client.get_world serving the latest snapshot"""
+        return self.latest().world